@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+# Compare the run time of FBP implementations on the projections of the
+# male model saved by ct_reconstruction-skimage.py (projections-skimage.mhd)
+
+import os, sys, time, argparse
+import numpy as np
+dir_path = os.path.dirname(os.path.realpath(__file__))
+
+# FBP engine and reconstruction shared across the demos (at the top of the repository)
+sys.path.append(os.path.join(dir_path, ".."))
+import fbp
+import reconstruction
+
+import SimpleITK as sitk
+from skimage.transform import iradon
+
+
+def processCmdLine():
+    parser = argparse.ArgumentParser(description="Benchmark of FBP reconstructions (skimage, tomopy and fbp.py).")
+    parser.add_argument("--input", help="Projections after the flat-field correction and minus log (angles, rows, columns)", default="projections-skimage.mhd")
+    parser.add_argument("--last_angle", help="Angle of the last projection excluded (in degrees)", type=float, default=180.0)
+    parser.add_argument("--slices", help="Number of slices to reconstruct (all by default)", type=int)
+    parser.add_argument("--serial_slices", help="Number of slices reconstructed by the serial loop of iradon", type=int, default=8)
+    parser.add_argument("--workers", help="Number of processes/threads (one per core by default)", type=int)
+    return parser.parse_args()
+
+
+def measure(label, function):
+    start = time.time()
+    result = function()
+    runtime = time.time() - start
+    print("{:<40} {:>10.3f} s".format(label, runtime))
+    return result, runtime
+
+
+args = processCmdLine()
+
+# Load the projections and store them as sinograms
+projections = sitk.GetArrayFromImage(sitk.ReadImage(args.input)).astype(np.float32)
+sinograms = np.ascontiguousarray(np.swapaxes(projections, 0, 1))
+if args.slices is not None:
+    sinograms = sinograms[:args.slices]
+
+number_of_slices, number_of_angles, detector_width = sinograms.shape
+theta = np.linspace(0.0, args.last_angle, num=number_of_angles, endpoint=False)
+
+print(number_of_slices, "sinograms of", number_of_angles, "angles x", detector_width, "pixels")
+
+def reconstructSlice(sinogram):
+    return iradon(sinogram.T, theta=theta, circle=True)
+
+# skimage, one slice at a time on one core (extrapolated to the volume)
+serial_slices = min(args.serial_slices, number_of_slices)
+recon_serial, runtime = measure("skimage (serial, " + str(serial_slices) + " slices)",
+    lambda: np.array([reconstructSlice(sinogram) for sinogram in sinograms[:serial_slices]]))
+print("{:<40} {:>10.3f} s".format("skimage (serial, extrapolated)", runtime * number_of_slices / serial_slices))
+
+# skimage, slices spread across the cores
+recon_skimage, runtime_skimage = measure("skimage (process pool)",
+    lambda: reconstruction.reconstructSlices(sinograms, reconstructSlice, args.workers))
+
+# Batched NumPy FBP, with and without building the interpolation tables
+fbp.engine_cache.clear()
+recon_fbp, runtime_cold = measure("fbp.py (with the tables)",
+    lambda: fbp.reconstructFBP(sinograms, theta, number_of_threads=args.workers))
+recon_fbp, runtime_warm = measure("fbp.py (cached tables)",
+    lambda: fbp.reconstructFBP(sinograms, theta, number_of_threads=args.workers))
+
+error = np.abs(recon_fbp - recon_skimage).max() / np.abs(recon_skimage).max()
+print("fbp.py vs. skimage: maximum relative error", error)
+
+# tomopy (gridrec), if installed
+try:
+    import tomopy
+
+    recon_tomopy, runtime = measure("tomopy (gridrec)",
+        lambda: tomopy.recon(sinograms, np.deg2rad(theta), center=detector_width / 2, algorithm="gridrec",
+                             sinogram_order=True, ncore=args.workers))
+
+    # The scaling and the support of gridrec differ, compare the structures
+    size = min(recon_tomopy.shape[1], recon_fbp.shape[1])
+    correlation = np.corrcoef(recon_tomopy[:, :size, :size].ravel(), recon_fbp[:, :size, :size].ravel())[0, 1]
+    print("tomopy vs. fbp.py: correlation coefficient", correlation)
+
+except ImportError:
+    print("tomopy is not installed, skipped")
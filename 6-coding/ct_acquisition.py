@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
 
-import os, copy
+import os, sys, copy
 import numpy as np
 dir_path = os.path.dirname(os.path.realpath(__file__))
 
+# Export, poses of the scan and visualisation settings shared across the demos (at the top of the repository)
+sys.path.append(os.path.join(dir_path, ".."))
+import export
+import preview
+import trajectory
+
 import gvxrPython3 as gvxr
 import inp2stl
 
@@ -15,9 +21,12 @@ NoneType = type(None);
 print (gvxr.getVersionOfSimpleGVXR())
 print (gvxr.getVersionOfCoreGVXR())
 
-# Create an OpenGL context
+# Visualisation during the acquisition (see preview.py)
+settings = preview.loadSettings(os.path.join(dir_path, "acquisition.json"));
+
+# Create an OpenGL context (no visible window in headless mode)
 print("Create an OpenGL context")
-gvxr.createWindow();
+gvxr.createWindow(-1, not settings.headless, settings.renderer);
 gvxr.setWindowSize(512, 512);
 
 
@@ -94,21 +103,39 @@ gvxr.setElement("male_model", "H");
 gvxr.addPolygonMeshAsInnerSurface("male_model");
 
 # Compute an X-ray image, update the 3D visualisation, and rotate the object
-gvxr.renderLoop();
+if not settings.headless:
+    gvxr.renderLoop();
+
+# Poses of the model, 1 degree apart, all computed at once
+angles = trajectory.getAngles(180, final_angle=180);
+poses = trajectory.getCircularPoses(angles, (0, 0, -1));
+setPose = trajectory.PoseSetter(gvxr, "male_model");
+
+# The X-ray images are saved in the background, with the geometry set above (in mm)
+geometry = export.Geometry([0.5, 0.5], [-400.0, 0.0, 0.0], [400.0, 0.0, 0.0], source_shape="ParallelBeam", angles=angles);
+exporter = export.ProjectionExporter("male_model_projection_{:03d}.dcm", geometry);
+
+# Update the 3D visualisation (if any) and record the preview frames
+recorder = preview.PreviewRecorder(gvxr, settings, "ct_acquisition.gif");
 
 projections = [];
 for i in range(180):
+    # Rotate the model (absolute pose)
+    setPose(poses[i]);
+
     # Compute an X-ray image and add it to the list of projections
-    projections.append(gvxr.computeXRayImage());
+    projections.append(np.array(gvxr.computeXRayImage(), dtype=np.float32));
 
-    # Save the X-ray image
-    gvxr.saveLastXRayImage("male_model_projection_" + '{0:03d}'.format(i) + ".dcm");
+    # Save the X-ray image (by another thread)
+    exporter.submit(i, projections[-1]);
 
     # Update the 3D visualisation
-    gvxr.displayScene();
+    recorder.update(i);
+
+recorder.close();
 
-    # Rotate the model by 1 degree
-    gvxr.rotateNode("male_model", 1, 0, 0, -1);
+# Wait until all the X-ray images are saved
+exporter.close();
 
 # Display the 3D scene (no event loop)
 # Run an interactive loop
@@ -119,4 +146,5 @@ for i in range(180):
 # W: display the polygon meshes in solid or wireframe
 # N: display the X-ray image in negative or positive
 # H: display/hide the X-ray detector
-gvxr.renderLoop();
+if not settings.headless:
+    gvxr.renderLoop();
@@ -1,11 +1,20 @@
 #!/usr/bin/env python3
 
-import os, copy
+import os, sys, copy
 import numpy as np
 dir_path = os.path.dirname(os.path.realpath(__file__))
 
+# Projection writer, preprocessing, pipeline, poses of the scan, visualisation settings and reconstruction shared across the demos (at the top of the repository)
+sys.path.append(os.path.join(dir_path, ".."))
+import acquisition
+import pipeline
+import preprocessing
+import preview
+import reconstruction
+import trajectory
+
 import math
-from skimage.transform import iradon, iradon_sart
+from skimage.transform import iradon
 import SimpleITK as sitk
 
 import matplotlib
@@ -23,9 +32,12 @@ NoneType = type(None);
 print (gvxr.getVersionOfSimpleGVXR())
 print (gvxr.getVersionOfCoreGVXR())
 
-# Create an OpenGL context
+# Visualisation during the acquisition (see preview.py)
+settings = preview.loadSettings(os.path.join(dir_path, "acquisition.json"));
+
+# Create an OpenGL context (no visible window in headless mode)
 print("Create an OpenGL context")
-gvxr.createWindow();
+gvxr.createWindow(-1, not settings.headless, settings.renderer);
 gvxr.setWindowSize(512, 512);
 
 
@@ -114,27 +126,11 @@ gvxr.addPolygonMeshAsInnerSurface("male_model");
 # Compute an X-ray image, update the 3D visualisation, and rotate the object
 #gvxr.renderLoop();
 
-projections = [];
 theta = [];
 
 number_of_angles = 360;
 rotation_angle = 180 / number_of_angles;
 
-for i in range(number_of_angles):
-    # Compute an X-ray image and add it to the list of projections
-    projections.append(gvxr.computeXRayImage());
-
-    # Update the 3D visualisation
-    gvxr.displayScene();
-
-    # Rotate the model by 1 degree
-    gvxr.rotateNode("male_model", rotation_angle, 0, 0, -1);
-
-    theta.append(i * rotation_angle);
-
-# Convert the projections as a Numpy array
-projections = np.array(projections);
-
 # Retrieve the total energy
 energy_bins = gvxr.getEnergyBins("MeV");
 photon_count_per_bin = gvxr.getPhotonCountEnergyBins();
@@ -144,54 +140,87 @@ for energy, count in zip(energy_bins, photon_count_per_bin):
     print(energy, count)
     total_energy += energy * count;
 
-# Perform the flat-field correction of raw data
-dark = np.zeros(projections.shape);
-flat = np.ones(projections.shape) * total_energy;
-projections = (projections - dark) / (flat - dark);
+# Preallocate the stack of projections (in single precision), stored
+# as a sinogram stack for the slice-by-slice reconstruction, in a
+# memory-mapped file read by slabs during the reconstruction
+writer = acquisition.ProjectionWriter(number_of_angles, fname="sinograms-skimage.npy", sinogram_order=True);
 
-# Calculate  -log(projections)  to linearize transmission tomography data
-projections = -np.log(projections)
+# Perform the flat-field correction of raw data and
+# calculate  -log(projections)  to linearize transmission tomography data
+# (the dark field is null)
+def correct(index, image):
+    return preprocessing.preprocessProjections(image, flat=total_energy, dark=0.0, number_of_threads=1);
 
-volume = sitk.GetImageFromArray(projections);
-sitk.WriteImage(volume, 'projections-skimage.mhd');
+# The images are corrected and written by other threads
+# while the next ones are computed
+acquisition_pipeline = pipeline.AcquisitionPipeline([
+    pipeline.Stage("flat-field/log", correct, number_of_threads=2),
+    pipeline.Stage("write", writer.write)
+]);
+
+# Update the 3D visualisation (if any) and record the preview frames
+recorder = preview.PreviewRecorder(gvxr, settings, "ct_acquisition-skimage.gif");
 
-# Resample as a sinogram stack
-sinograms = np.swapaxes(projections, 0, 1);
+# Poses of the model, all computed at once
+poses = trajectory.getCircularPoses(np.arange(number_of_angles) * rotation_angle, (0, 0, -1));
+setPose = trajectory.PoseSetter(gvxr, "male_model");
+
+with acquisition_pipeline:
+    for i in range(number_of_angles):
+        # Rotate the model (absolute pose)
+        setPose(poses[i]);
+
+        # Compute an X-ray image and give it to the pipeline
+        acquisition_pipeline.render(i, gvxr.computeXRayImage);
+
+        # Update the 3D visualisation
+        recorder.update(i);
+
+        theta.append(i * rotation_angle);
+
+recorder.close();
+acquisition_pipeline.printStatistics();
+
+# Retrieve the sinograms as a Numpy array
+sinograms = writer.getSinograms();
+
+# The projections are a view of the sinogram stack
+projections = writer.getProjections();
+
+volume = sitk.GetImageFromArray(np.ascontiguousarray(projections));
+sitk.WriteImage(volume, 'projections-skimage.mhd');
 
 # Perform the reconstruction
-# Process slice by slice
-recon_fbp = [];
-recon_sart = [];
-slice_id = 0;
-for sinogram in sinograms:
-    slice_id+=1;
-    print("Reconstruct slice #", slice_id, "/", number_of_angles);
-    recon_fbp.append(iradon(sinogram.T, theta=theta, circle=True));
-
-    # Two iterations of SART
-    # recon_sart.append(iradon_sart(sinogram.T, theta=theta));
-    # recon_sart[-1] = iradon_sart(sinogram.T, theta=theta, image=recon_sart[-1]);
-
-recon_fbp = np.array(recon_fbp);
-# recon_sart = np.array(recon_sart);
+# Process slice by slice, the slices are spread across the cores
+def reconstructFBP(sinogram):
+    return iradon(sinogram.T, theta=theta, circle=True);
+
+# The volume is written slab by slab in recon-fbp-skimage.mhd (and .raw),
+# within the memory budget (2 GB by default)
+recon_fbp = reconstruction.reconstructSlicesOutOfCore(sinograms, reconstructFBP,
+    (sinograms.shape[2], sinograms.shape[2]),
+    'recon-fbp-skimage.mhd',
+    [spacing_in_mm, spacing_in_mm, spacing_in_mm],
+    verbose=1);
+
+# Ordered-subset SART of all the slices of a slab at once, from their FBP
+# (see sart.py), written slab by slab in recon-sart-skimage.mhd (and .raw)
+recon_sart = reconstruction.reconstructSARTOutOfCore(sinograms, theta,
+    'recon-sart-skimage.mhd',
+    [spacing_in_mm, spacing_in_mm, spacing_in_mm],
+    number_of_subsets=12,
+    max_iterations=5,
+    verbose=1);
 
 # Plot the slice in the middle of the volume
-plt.figure();
-plt.title("FBP")
-plt.imshow(recon_fbp[int(projections.shape[1]/2), :, :])
-# plt.figure();
-# plt.title("SART")
-# plt.imshow(recon_sart[int(projections.shape[1]/2), :, :])
-plt.show()
-
-# Save the volume
-volume = sitk.GetImageFromArray(recon_fbp);
-volume.SetSpacing([spacing_in_mm, spacing_in_mm, spacing_in_mm]);
-sitk.WriteImage(volume, 'recon-fbp-skimage.mhd');
-
-# volume = sitk.GetImageFromArray(recon_sart);
-# volume.SetSpacing([spacing_in_mm, spacing_in_mm, spacing_in_mm]);
-# sitk.WriteImage(volume, 'recon-sart-skimage.mhd');
+if not settings.headless:
+    plt.figure();
+    plt.title("FBP")
+    plt.imshow(recon_fbp[int(projections.shape[1]/2), :, :])
+    plt.figure();
+    plt.title("SART")
+    plt.imshow(recon_sart[int(projections.shape[1]/2), :, :])
+    plt.show()
 
 # Display the 3D scene (no event loop)
 # Run an interactive loop
@@ -202,4 +231,5 @@ sitk.WriteImage(volume, 'recon-fbp-skimage.mhd');
 # W: display the polygon meshes in solid or wireframe
 # N: display the X-ray image in negative or positive
 # H: display/hide the X-ray detector
-gvxr.renderLoop();
+if not settings.headless:
+    gvxr.renderLoop();
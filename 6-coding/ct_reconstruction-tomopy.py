@@ -1,9 +1,16 @@
 #!/usr/bin/env python3
 
-import os, copy
+import os, sys, copy
 import numpy as np
 dir_path = os.path.dirname(os.path.realpath(__file__))
 
+# Projection writer, preprocessing, poses of the scan and visualisation settings shared across the demos (at the top of the repository)
+sys.path.append(os.path.join(dir_path, ".."))
+import acquisition
+import preprocessing
+import preview
+import trajectory
+
 import math
 import tomopy
 import SimpleITK as sitk
@@ -23,9 +30,12 @@ NoneType = type(None);
 print (gvxr.getVersionOfSimpleGVXR())
 print (gvxr.getVersionOfCoreGVXR())
 
-# Create an OpenGL context
+# Visualisation during the acquisition (see preview.py)
+settings = preview.loadSettings(os.path.join(dir_path, "acquisition.json"));
+
+# Create an OpenGL context (no visible window in headless mode)
 print("Create an OpenGL context")
-gvxr.createWindow();
+gvxr.createWindow(-1, not settings.headless, settings.renderer);
 gvxr.setWindowSize(512, 512);
 
 
@@ -105,29 +115,37 @@ gvxr.addPolygonMeshAsInnerSurface("male_model");
 # Compute an X-ray image, update the 3D visualisation, and rotate the object
 #gvxr.renderLoop();
 
-projections = [];
 theta = [];
 
 number_of_angles = 360;
 rotation_angle = 180 / number_of_angles;
 
+# Preallocate the stack of projections (in single precision)
+writer = acquisition.ProjectionWriter(number_of_angles);
+
+# Update the 3D visualisation (if any) and record the preview frames
+recorder = preview.PreviewRecorder(gvxr, settings, "ct_acquisition-tomopy.gif");
+
+# Poses of the model, all computed at once
+poses = trajectory.getCircularPoses(np.arange(number_of_angles) * rotation_angle, (0, 0, -1));
+setPose = trajectory.PoseSetter(gvxr, "male_model");
+
 for i in range(number_of_angles):
-    # Compute an X-ray image and add it to the list of projections
-    projections.append(gvxr.computeXRayImage());
+    # Rotate the model (absolute pose)
+    setPose(poses[i]);
 
-    # Update the 3D visualisation
-    gvxr.displayScene();
+    # Compute an X-ray image and add it to the stack of projections
+    writer.append(gvxr.computeXRayImage());
 
-    # Rotate the model by 1 degree
-    gvxr.rotateNode("male_model", rotation_angle, 0, 0, -1);
+    # Update the 3D visualisation
+    recorder.update(i);
 
     theta.append(i * rotation_angle * math.pi / 180);
 
-# Convert the projections as a Numpy array
-projections = np.array(projections);
+recorder.close();
 
-# Perform the flat-field correction of raw data
-dark = np.zeros(projections.shape);
+# Retrieve the projections as a Numpy array
+projections = writer.getProjections();
 
 # Retrieve the total energy
 energy_bins = gvxr.getEnergyBins("MeV");
@@ -136,12 +154,11 @@ photon_count_per_bin = gvxr.getPhotonCountEnergyBins();
 total_energy = 0.0;
 for energy, count in zip(energy_bins, photon_count_per_bin):
     total_energy += energy * count;
-flat = np.ones(projections.shape) * total_energy;
-
-projections = tomopy.normalize(projections, flat, dark)
 
-# Calculate  -log(projections)  to linearize transmission tomography data
-projections = tomopy.minus_log(projections)
+# Perform the flat-field correction of raw data and
+# calculate  -log(projections)  to linearize transmission tomography data
+# (in place, the dark field is null)
+projections = preprocessing.preprocessProjections(projections, flat=total_energy, dark=0.0)
 
 volume = sitk.GetImageFromArray(projections);
 sitk.WriteImage(volume, 'projections-tomopy.mhd');
@@ -153,8 +170,9 @@ rot_center = int(projections.shape[2]/2);
 recon = tomopy.recon(projections, theta, center=rot_center, algorithm='gridrec', sinogram_order=False)
 
 # Plot the slice in the middle of the volume
-plt.imshow(recon[int(projections.shape[1]/2), :, :])
-plt.show()
+if not settings.headless:
+    plt.imshow(recon[int(projections.shape[1]/2), :, :])
+    plt.show()
 
 # Save the volume
 volume = sitk.GetImageFromArray(recon);
@@ -171,4 +189,5 @@ sitk.WriteImage(volume, 'recon-tomopy.mhd');
 # W: display the polygon meshes in solid or wireframe
 # N: display the X-ray image in negative or positive
 # H: display/hide the X-ray detector
-gvxr.renderLoop();
+if not settings.headless:
+    gvxr.renderLoop();
@@ -66,7 +66,13 @@ import viewscad # Use OpenSCAD to create STL files
 
 import gvxrPython3 as gvxr # Simulate X-ray images
 
+# Simulation set-up, projection writer, preprocessing and visualisation settings shared across the demos (at the top of the repository)
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import acquisition
 import json2gvxr # Set gVirtualXRay and the simulation up
+import preprocessing
+import preview
 
 
 # from matplotlib.cm import get_cmap
@@ -93,7 +99,6 @@ from skimage.transform import iradon
 # from skimage.transform import resize # Resample the images
 
 # from tifffile import imread, imsave # Load/Write TIFF files
-import imageio
 
 from scipy.ndimage import zoom
 
@@ -130,6 +135,10 @@ theta_deg = np.linspace(0.0, -angular_step * number_of_projections, num=number_o
 
 json2gvxr.initGVXR("notebook.json", "EGL")
 
+# Visualisation during the CT acquisition: none in headless mode, and
+# a frame of the GIF file every few projections
+settings = json2gvxr.loadConfig().acquisition
+
 
 # ## Create the 3D models
 #
@@ -400,66 +409,53 @@ plt.savefig("screenshot.png")
 
 # In[26]:
 
-if not os.path.exists("flat.mha"):
+# Memory-mapped stack of the raw projections, corrected in place and
+# removed once the sinograms are saved
+writer = None
 
-    raw_projections = [];
+if not os.path.exists("flat.mha"):
 
-    # Create a GIF file
-    writer = None
-    fname_gif = "CT_acquisition.gif"
+    # Preallocate the stack of projections (in single precision), in a
+    # memory-mapped file as it is large. If the job has been interrupted,
+    # only the projections missing from the file are computed.
+    writer = acquisition.ResumableProjectionWriter(theta_deg, "raw_projections.npy");
 
-    # if not os.path.exists(fname_gif):
-    writer = imageio.get_writer(fname_gif, mode='I')
+    # Create a GIF file (the frames are encoded in the background)
+    recorder = preview.PreviewRecorder(gvxr, settings, "CT_acquisition.gif")
 
     # Save the transformation matrix
     transformation_matrix_backup = gvxr.getSceneTransformationMatrix()
 
-    for angle_id in range(0, number_of_projections):
-
-        # Compute an X-ray image
-        xray_image = np.array(gvxr.computeXRayImage());
-
-        # Add to the set of projections
-        raw_projections.append(xray_image)
-
-        # Update the rendering
-        gvxr.displayScene();
-
-        # Take a screenshot
-        if writer is not None:
-            if not angle_id % 30:
-                screenshot = gvxr.takeScreenshot()
-
-                plt.figure(figsize= (10,10))
-                plt.title("Projection " + str(angle_id + 1) + "/" + str(number_of_projections))
-                plt.imshow(screenshot)
-                plt.axis('off')
+    # Rotate the sample around the Y axis, from the saved transformation
+    setAngle = acquisition.rotateSceneTo(gvxr, (0, 1, 0))
 
-                plt.tight_layout()
+    for angle_id in writer.getMissingIndices():
 
-                plt.savefig('temp.png')
-                plt.close()
+        # Rotate the sample (absolute angle)
+        setAngle(theta_deg[angle_id]);
 
+        # Compute an X-ray image and write it in the stack of projections
+        writer.write(angle_id, gvxr.computeXRayImage());
 
-                image = imageio.imread("temp.png")
-                writer.append_data(image)
-
-        # Rotate the sample
-        gvxr.rotateScene(-angular_step, 0, 1, 0);
+        # Update the rendering and take a screenshot if needed
+        recorder.update(angle_id);
 
     # Restore the transformation matrix
     gvxr.setSceneTransformationMatrix(transformation_matrix_backup)
 
     # Update the rendering
-    gvxr.displayScene();
+    if not settings.headless:
+        gvxr.displayScene();
+
+    # We're done with the GIF file
+    recorder.close()
 
-    # We're done with the writer
-    if writer is not None:
-        writer.close()
-        # os.remove(temp.tif)
+    # The projections are corrected in place below, the acquisition
+    # cannot be resumed from this file anymore
+    writer.removeProgress()
 
-    # Convert to numpy arrays
-    raw_projections = np.array(raw_projections)
+    # Retrieve the projections as a Numpy array
+    raw_projections = writer.getProjections()
 
 # In[27]:
 
@@ -475,12 +471,6 @@ if not os.path.exists("flat.mha"):
 
 if not os.path.exists("flat.mha"):
 
-    # Create a mock dark field image
-    dark_field_image = np.zeros(raw_projections.shape);
-
-    # Create a mock flat field image
-    flat_field_image = np.ones(raw_projections.shape);
-
     # Retrieve the total energy
     total_energy = 0.0;
     energy_bins = gvxr.getEnergyBins("MeV");
@@ -488,11 +478,13 @@ if not os.path.exists("flat.mha"):
 
     for energy, count in zip(energy_bins, photon_count_per_bin):
         total_energy += energy * count;
-    flat_field_image *= total_energy;
 
-    # Apply the actual flat-field correction on the raw projections
-    corrected_projections = (raw_projections - dark_field_image) / (flat_field_image - dark_field_image)
-    # corrected_projections = tomopy.normalize(raw_projections, flat_field_image, dark_field_image)
+    # Apply the actual flat-field correction on the raw projections,
+    # in place (the mock flat field is the total energy, the mock dark field is null)
+    corrected_projections = preprocessing.preprocessProjections(raw_projections,
+                                                                flat=total_energy,
+                                                                dark=0.0,
+                                                                minus_log=False)
 
     raw_projections = None # Not needed anymore
 
@@ -504,8 +496,6 @@ if not os.path.exists("flat.mha"):
 
 if not os.path.exists("flat.mha"):
 
-    corrected_projections = np.array(corrected_projections).astype(np.single)
-
     sitk_image = sitk.GetImageFromArray(corrected_projections)
     sitk_image.SetSpacing([pixel_width, pixel_height, angular_step])
     sitk.WriteImage(sitk_image, "flat.mha", useCompression=True)
@@ -520,32 +510,26 @@ else:
 
 
 if not os.path.exists("sinograms.mha"):
-    # Create a temporary image to hold the sinogram
-    minus_log_projs = np.copy(corrected_projections);
+    # Rescale the data taking into account the pixel size
+    pixel_spacing_in_mm = gvxr.getDetectorSize("mm")[0] / gvxr.getDetectorNumberOfPixels()[0]
+    pixel_spacing_in_cm = pixel_spacing_in_mm * (gvxr.getUnitOfLength("mm") / gvxr.getUnitOfLength("cm"))
 
+    # Apply the minus log normalisation in place, in single-precision
+    # floating-point numbers (the corrected projections are already saved).
     # Make sure no value is negative or null (because of the log function)
     # It should not be the case, however, when the Laplacian is used to simulate
     # phase contrast, negative values can be generated.
-    threshold = 0.000000001
-    minus_log_projs[minus_log_projs < threshold] = threshold;
-
-    # Apply the minus log normalisation
-    minus_log_projs = -np.log(minus_log_projs);
-
-    # Rescale the data taking into account the pixel size
-    pixel_spacing_in_mm = gvxr.getDetectorSize("mm")[0] / gvxr.getDetectorNumberOfPixels()[0]
-    minus_log_projs /= pixel_spacing_in_mm * (gvxr.getUnitOfLength("mm") / gvxr.getUnitOfLength("cm"));
-
-    # Make sure the data is in single-precision floating-point numbers
-    minus_log_projs = np.array(minus_log_projs).astype(np.single)
+    minus_log_projs = preprocessing.preprocessProjections(corrected_projections,
+                                                          pixel_size=pixel_spacing_in_cm,
+                                                          threshold=0.000000001)
 
 else:
     temp = sitk.ReadImage("sinograms.mha")
     minus_log_projs = sitk.GetArrayFromImage(temp)
 
 # Reformat the projections into a set of sinograms
+# (a view, the sinograms are only plotted)
 sinograms = np.swapaxes(minus_log_projs, 0, 1)
-sinograms = np.array(sinograms).astype(np.single)
 
 corrected_projections = None # Not needed anymore
 
@@ -560,6 +544,10 @@ if not os.path.exists("sinograms.mha"):
     sitk_image.SetSpacing([pixel_width, pixel_height, angular_step])
     sitk.WriteImage(sitk_image, "sinograms.mha", useCompression=True)
 
+# The raw projections file now holds the -log data saved in sinograms.mha
+if writer is not None:
+    writer.remove()
+
 
 # Plot some sinograms
 
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+"""
+Store CT projections as they are simulated.
+
+The stack of projections (angles, rows, columns) is allocated once, in
+single precision, either in memory or as a memory-mapped .npy file, and
+each X-ray image is written in place as soon as it is computed. There is
+no list of images to convert at the end of the scan.
+
+The stack can also be stored in sinogram order (rows, angles, columns),
+as expected by slice-by-slice reconstruction: the rows of each image are
+scattered into their sinograms as the image arrives, so the whole
+dataset does not have to be transposed before the reconstruction.
+
+A long acquisition can be resumed: each projection is marked as done in a
+progress index once it is on disk, and the pose of the sample is set from
+its absolute angle rather than by accumulating small rotations.
+"""
+
+import os
+
+import numpy as np
+
+import trajectory
+
+
+class ProjectionWriter:
+
+    def __init__(self, number_of_projections, shape = None, fname = None, dtype = np.float32, sinogram_order = False):
+        """number_of_projections images of shape (rows, columns) are stored in memory, or in fname (.npy) if given.
+
+        If shape is None, the stack is allocated when the first image is written.
+        With sinogram_order, the stack is stored as (rows, angles, columns).
+        """
+
+        self.number_of_projections = number_of_projections
+        self.fname = fname
+        self.sinogram_order = sinogram_order
+        self.dtype = np.dtype(dtype)
+        self.stack = None
+        self.count = 0
+
+        if shape is not None:
+            self.allocate(shape)
+
+    def allocate(self, shape):
+        rows, columns = shape
+        if self.sinogram_order:
+            shape = (rows, self.number_of_projections, columns)
+        else:
+            shape = (self.number_of_projections, rows, columns)
+
+        if self.fname is not None:
+            self.stack = np.lib.format.open_memmap(self.fname, mode="w+", dtype=self.dtype, shape=shape)
+        else:
+            self.stack = np.empty(shape, dtype=self.dtype)
+
+    def write(self, index, image):
+        """Store the image of the index-th angle (a NumPy array or the list returned by gvxr.computeXRayImage)."""
+
+        if self.stack is None:
+            self.allocate(np.shape(image))
+
+        # Converted directly into the stack, without a temporary copy in double precision
+        if self.sinogram_order:
+            self.stack[:, index] = image
+        else:
+            self.stack[index] = image
+
+    def append(self, image):
+        if self.count >= self.number_of_projections:
+            raise IndexError("The stack already holds " + str(self.number_of_projections) + " projections")
+
+        self.write(self.count, image)
+        self.count += 1
+
+    def flush(self):
+        if isinstance(self.stack, np.memmap):
+            self.stack.flush()
+
+    def getStack(self):
+        """Return the stack as it is stored."""
+
+        if self.stack is None:
+            raise ValueError("No projection has been written")
+
+        self.flush()
+        return self.stack
+
+    def getProjections(self):
+        """Return the stack as (angles, rows, columns), a view if it is stored in sinogram order."""
+
+        if self.sinogram_order:
+            return np.swapaxes(self.getStack(), 0, 1)
+        return self.getStack()
+
+    def getSinograms(self):
+        """Return the stack as (rows, angles, columns), a view if it is stored in projection order."""
+
+        if self.sinogram_order:
+            return self.getStack()
+        return np.swapaxes(self.getStack(), 0, 1)
+
+
+
+class ResumableProjectionWriter(ProjectionWriter):
+
+    def __init__(self, angles, fname, shape = None, dtype = np.float32, sinogram_order = False):
+        """Memory-mapped stack (fname) of the projections at the given angles, that can be resumed.
+
+        The angle of each projection is recorded in a progress index
+        (e.g. projections-progress.npy for projections.npy) once the
+        projection is on disk, NaN meaning missing. If both files exist,
+        the acquisition is resumed: the angles must be the same.
+        """
+
+        self.angles = np.asarray(angles, dtype=np.float64).ravel()
+        self.progress_fname = os.path.splitext(fname)[0] + "-progress.npy"
+        self.progress = None
+
+        ProjectionWriter.__init__(self, len(self.angles), None, fname, dtype, sinogram_order)
+
+        if os.path.exists(fname) and os.path.exists(self.progress_fname):
+            self.resume(shape)
+        elif shape is not None:
+            self.allocate(shape)
+
+    def resume(self, shape):
+        self.stack = np.load(self.fname, mmap_mode="r+")
+        self.progress = np.load(self.progress_fname, mmap_mode="r+")
+
+        if self.sinogram_order:
+            rows, number_of_projections, columns = self.stack.shape
+        else:
+            number_of_projections, rows, columns = self.stack.shape
+
+        done = ~np.isnan(self.progress)
+        if (self.stack.dtype != self.dtype or number_of_projections != len(self.angles) or
+                (shape is not None and tuple(shape) != (rows, columns)) or
+                self.progress.shape != self.angles.shape or
+                not np.array_equal(self.progress[done], self.angles[done])):
+            raise IOError("The acquisition in " + self.fname + " does not match, remove it and " + self.progress_fname + " to restart")
+
+        self.count = int(np.count_nonzero(done))
+
+    def allocate(self, shape):
+        ProjectionWriter.allocate(self, shape)
+
+        self.progress = np.lib.format.open_memmap(self.progress_fname, mode="w+", dtype=np.float64, shape=self.angles.shape)
+        self.progress[:] = np.nan
+        self.progress.flush()
+
+    def write(self, index, image):
+        ProjectionWriter.write(self, index, image)
+
+        # The projection must be on disk before it is marked as done
+        self.stack.flush()
+        if np.isnan(self.progress[index]):
+            self.count += 1
+        self.progress[index] = self.angles[index]
+        self.progress.flush()
+
+    def append(self, image):
+        """Store the image of the first missing angle."""
+
+        missing_indices = self.getMissingIndices()
+        if not len(missing_indices):
+            raise IndexError("The stack already holds " + str(len(self.angles)) + " projections")
+
+        self.write(missing_indices[0], image)
+
+    def getMissingIndices(self):
+        if self.progress is None:
+            return np.arange(len(self.angles))
+        return np.flatnonzero(np.isnan(self.progress))
+
+    def isComplete(self):
+        return self.count == len(self.angles)
+
+    def removeProgress(self):
+        """Remove the progress index, e.g. before the stack is modified in place (it cannot be resumed anymore)."""
+
+        self.progress = None
+        if os.path.exists(self.progress_fname):
+            os.remove(self.progress_fname)
+
+    def remove(self):
+        """Remove the files of the stack and of the progress index, e.g. once the projections are saved elsewhere.
+
+        The stack already mapped in memory stays readable until it is released.
+        """
+
+        self.removeProgress()
+        if os.path.exists(self.fname):
+            os.remove(self.fname)
+
+
+def rotateNodeTo(gvxr, node, axis = (0, 0, -1)):
+    """Return a function that rotates the node by an absolute angle (in degrees) from its current transformation."""
+    setPose = trajectory.PoseSetter(gvxr, node)
+    return lambda angle: setPose(trajectory.getCircularPoses([angle], axis)[0])
+
+
+def rotateSceneTo(gvxr, axis = (0, 1, 0)):
+    """Return a function that rotates the scene by an absolute angle (in degrees) from its current transformation."""
+    setPose = trajectory.PoseSetter(gvxr, None)
+    return lambda angle: setPose(trajectory.getCircularPoses([angle], axis)[0])
+
+
+def acquireProjections(gvxr, angles, fname, setAngle, shape = None, sinogram_order = False, display = False, verbose = 0):
+    """Compute the projections at the given absolute angles, resuming a previous acquisition in fname if any.
+
+    setAngle(angle) sets the pose of the sample, e.g. rotateNodeTo(gvxr, "root").
+    Return the ResumableProjectionWriter.
+    """
+
+    writer = ResumableProjectionWriter(angles, fname, shape, sinogram_order=sinogram_order)
+    missing_indices = writer.getMissingIndices()
+
+    if verbose > 0 and writer.count:
+        print("Resume the acquisition:", writer.count, "/", len(writer.angles), "projections already computed")
+
+    for index in missing_indices:
+        setAngle(writer.angles[index])
+        writer.write(index, gvxr.computeXRayImage())
+
+        if display:
+            gvxr.displayScene()
+
+        if verbose > 0:
+            print("Projection", index + 1, "/", len(writer.angles))
+
+    return writer
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+"""
+Export CT projections as a series of DICOM, TIFF or MHA/MHD files.
+
+The images are written by a pool of threads (SimpleITK releases the GIL
+while it writes), so the acquisition loop does not wait for the disk,
+e.g. on a network filesystem. The number of images waiting to be written
+is bounded to limit the memory used when the disk is slower than the
+simulation. The images come either one at a time, as they are simulated,
+or from a stack of projections already in memory.
+
+The pixel spacing, the distances of the source and the detector, the
+voltage and the angle of each projection are copied in the DICOM tags
+(and the spacing in the TIFF and MHA files).
+"""
+
+import os
+import time
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import SimpleITK as sitk
+
+
+# Root of the UIDs generated by ITK/SimpleITK
+UID_ROOT = "1.2.826.0.1.3680043.2.1125."
+
+uid_counter = itertools.count(1)
+
+FORMATS = {
+    ".dcm": "DICOM",
+    ".tif": "TIFF",
+    ".tiff": "TIFF",
+    ".mha": "MHA",
+    ".mhd": "MHA"
+}
+
+
+class Geometry:
+    # Acquisition geometry copied in the metadata, lengths in mm
+
+    def __init__(self, pixel_spacing, source_position = None, detector_position = None,
+                 centre_of_rotation = (0.0, 0.0, 0.0), source_shape = None, kvp = None, angles = None):
+
+        self.pixel_spacing = [float(value) for value in pixel_spacing]
+        self.source_position = source_position
+        self.detector_position = detector_position
+        self.centre_of_rotation = centre_of_rotation
+        self.source_shape = source_shape
+        self.kvp = kvp
+        self.angles = None if angles is None else np.asarray(angles, dtype=np.float64).ravel()
+
+    def getSourceToDetectorDistance(self):
+        if self.source_position is None or self.detector_position is None:
+            return None
+        return float(np.linalg.norm(np.subtract(self.detector_position, self.source_position)))
+
+    def getSourceToObjectDistance(self):
+        if self.source_position is None:
+            return None
+        return float(np.linalg.norm(np.subtract(self.centre_of_rotation, self.source_position)))
+
+
+def getGeometry(config):
+    """Geometry of a json2gvxr.SimulationConfig (with its "Source", "Detector" and optional "Scan")."""
+
+    if config.detector_position is None:
+        raise IOError("No 'Detector' in the configuration")
+
+    centre = (0.0, 0.0, 0.0)
+    angles = None
+    if config.scan_type in ["Circular", "Helical"]:
+        centre = config.scan_centre
+        angles = config.scan_angles
+
+    kvp = None
+    if config.spectrum_type == "kvp":
+        kvp = config.kvp
+
+    return Geometry(config.pixel_spacing, config.source_position, config.detector_position,
+                    centre, config.source_shape, kvp, angles)
+
+
+def generateUID():
+    # Unique enough for the series written by one process (at most 64
+    # characters, with the index of the image appended)
+    return UID_ROOT + time.strftime("%Y%m%d%H%M%S") + "." + str(os.getpid()) + "." + str(next(uid_counter))
+
+
+def formatNumber(value):
+    # Decimal strings of the DICOM tags are limited to 16 characters
+    return "{:.10g}".format(value)[:16]
+
+
+class ProjectionExporter:
+
+    def __init__(self, pattern, geometry = None, number_of_threads = 4, max_pending = None, description = "Simulated projections"):
+        """Write the index-th projection in pattern.format(index), e.g. "projection_{:03d}.dcm".
+
+        The format is given by the extension. At most max_pending images
+        (by default, twice the number of threads) wait to be written.
+        """
+
+        self.pattern = pattern
+        extension = os.path.splitext(pattern)[1].lower()
+        if extension not in FORMATS:
+            raise IOError("Unknown file format: " + str(extension) + " (expected one of " + str(sorted(FORMATS)) + ")")
+        self.format = FORMATS[extension]
+
+        self.geometry = geometry
+        self.description = description
+        self.study_uid = generateUID()
+        self.series_uid = generateUID()
+
+        if max_pending is None:
+            max_pending = 2 * number_of_threads
+
+        self.executor = ThreadPoolExecutor(max_workers=number_of_threads)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.errors = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        self.close()
+
+    def submit(self, index, image):
+        """Write the image of the index-th projection (e.g. returned by gvxr.computeXRayImage) in the background.
+
+        The image is copied (in single precision) unless it is already a
+        float32 array, which must then not change until it is written.
+        """
+
+        if len(self.errors):
+            self.close()
+
+        if not isinstance(image, np.ndarray) or image.dtype != np.float32:
+            image = np.array(image, dtype=np.float32)
+
+        # Wait until there is room for one more image
+        self.slots.acquire()
+        future = self.executor.submit(self.write, index, image)
+        future.add_done_callback(self.done)
+
+    def exportStack(self, stack, indices = None):
+        """Write the projections of an (angles, rows, columns) stack."""
+
+        if indices is None:
+            indices = range(len(stack))
+
+        for index in indices:
+            self.submit(index, stack[index])
+
+    def done(self, future):
+        self.slots.release()
+        if future.exception() is not None:
+            self.errors.append(future.exception())
+
+    def getFileName(self, index):
+        return self.pattern.format(index)
+
+    def write(self, index, image):
+
+        if self.format == "DICOM":
+            sitk_image, tags = self.getDICOM(index, image)
+        else:
+            sitk_image = sitk.GetImageFromArray(image)
+            tags = {}
+
+        if self.geometry is not None:
+            sitk_image.SetSpacing(self.geometry.pixel_spacing)
+
+        for key, value in tags.items():
+            sitk_image.SetMetaData(key, value)
+
+        writer = sitk.ImageFileWriter()
+        writer.SetFileName(self.getFileName(index))
+        if self.format == "DICOM":
+            # Use the UIDs of the series
+            writer.KeepOriginalImageUIDOn()
+        writer.Execute(sitk_image)
+
+    def getDICOM(self, index, image):
+
+        # Stored as unsigned 16-bit integers, the values are restored by
+        # the rescale slope and intercept. GDCM only accepts them with
+        # floating-point pixels, which it converts itself.
+        minimum = float(np.min(image))
+        maximum = float(np.max(image))
+        slope = (maximum - minimum) / 65535.0
+        if slope <= 0.0:
+            slope = 1.0
+
+        sitk_image = sitk.GetImageFromArray(image)
+
+        date = time.strftime("%Y%m%d")
+        tags = {
+            "0008|0008": "DERIVED\\SECONDARY",
+            "0008|0016": "1.2.840.10008.5.1.4.1.1.7", # Secondary capture image storage
+            "0008|0018": self.series_uid + "." + str(index + 1),
+            "0008|0020": date,
+            "0008|0021": date,
+            "0008|0060": "OT",
+            "0008|103e": self.description,
+            "0020|000d": self.study_uid,
+            "0020|000e": self.series_uid,
+            "0020|0011": "1",
+            "0020|0013": str(index + 1),
+            "0028|0100": "16", # Bits allocated
+            "0028|0101": "16", # Bits stored
+            "0028|0102": "15", # High bit
+            "0028|0103": "0", # Unsigned pixels
+            "0028|1052": formatNumber(minimum),
+            "0028|1053": formatNumber(slope),
+            "0028|1054": "US"
+        }
+
+        geometry = self.geometry
+        if geometry is not None:
+            # Row spacing first
+            spacing = formatNumber(geometry.pixel_spacing[1]) + "\\" + formatNumber(geometry.pixel_spacing[0])
+            tags["0028|0030"] = spacing
+            tags["0018|1164"] = spacing
+
+            if geometry.source_shape != "ParallelBeam":
+                distance = geometry.getSourceToDetectorDistance()
+                if distance is not None:
+                    tags["0018|1110"] = formatNumber(distance)
+                distance = geometry.getSourceToObjectDistance()
+                if distance is not None:
+                    tags["0018|1111"] = formatNumber(distance)
+
+            if geometry.kvp is not None:
+                tags["0018|0060"] = formatNumber(geometry.kvp)
+
+            if geometry.angles is not None and index < len(geometry.angles):
+                tags["0018|1510"] = formatNumber(geometry.angles[index])
+
+        return sitk_image, tags
+
+    def close(self):
+        """Wait until all the images are written, and raise the first error if any."""
+
+        self.executor.shutdown(wait=True)
+
+        if len(self.errors):
+            raise IOError("Cannot export the projections: " + str(self.errors[0])) from self.errors[0]
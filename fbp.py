@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+
+"""
+Filtered back-projection (parallel beam) of a whole stack of sinograms.
+
+The geometry is the same for every row of the detector, so the work that
+skimage.transform.iradon repeats for each slice is done once here:
+
+- the ramp filter is built once, and all the sinograms are filtered by one
+  batched real FFT along the detector axis;
+- for each angle, the position of every pixel of the output grid on the
+  detector is turned once into an index and a linear interpolation weight.
+  These tables are cached for the (angles, detector width, output grid),
+  and are then applied to many slices at once.
+
+The conventions (centre of rotation, orientation, scaling, filters) are
+those of iradon with linear interpolation, so the slices match those of
+skimage up to the rounding errors of single precision.
+"""
+
+import os
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+# The interpolation tables are cached if they are smaller than this,
+# otherwise they are recomputed for each angle at each call
+DEFAULT_TABLE_SIZE_IN_BYTES = 1024 * 1024 * 1024
+
+# Size of the slabs of output slices processed at once by a thread
+DEFAULT_CHUNK_SIZE_IN_BYTES = 16 * 1024 * 1024
+
+FILTERS = ["ramp", "shepp-logan", "cosine", "hamming", "hann", None]
+
+
+def getFourierFilter(size, filter_name = "ramp"):
+    """Filter of the rfft of a zero-padded projection of the given size (as in skimage)."""
+
+    if filter_name not in FILTERS:
+        raise ValueError("Unknown filter: " + str(filter_name) + " (expected one of " + str(FILTERS) + ")")
+
+    if filter_name is None:
+        return np.ones(size // 2 + 1)
+
+    # Ramp filter built in the spatial domain, to avoid its offset
+    n = np.concatenate((np.arange(1, size / 2 + 1, 2, dtype=int),
+                        np.arange(size / 2 - 1, 0, -2, dtype=int)))
+    f = np.zeros(size)
+    f[0] = 0.25
+    f[1::2] = -1 / (np.pi * n) ** 2
+    fourier_filter = 2 * np.real(np.fft.fft(f))
+
+    if filter_name == "shepp-logan":
+        omega = np.pi * np.fft.fftfreq(size)[1:]
+        fourier_filter[1:] *= np.sin(omega) / omega
+    elif filter_name == "cosine":
+        frequencies = np.linspace(0, np.pi, size, endpoint=False)
+        fourier_filter *= np.fft.fftshift(np.sin(frequencies))
+    elif filter_name == "hamming":
+        fourier_filter *= np.fft.fftshift(np.hamming(size))
+    elif filter_name == "hann":
+        fourier_filter *= np.fft.fftshift(np.hanning(size))
+
+    # Only the even part of the filter changes the real part of the
+    # filtered projections (the windows are not even), its first half is
+    # enough for rfft
+    fourier_filter = (fourier_filter + np.roll(fourier_filter[::-1], 1)) / 2
+    return fourier_filter[:size // 2 + 1]
+
+
+class FBP:
+
+    def __init__(self, angles, detector_width, output_size = None, circle = True, filter_name = "ramp",
+                 max_table_size = DEFAULT_TABLE_SIZE_IN_BYTES):
+        """Reconstruction of sinograms of detector_width pixels at the given angles (in degrees).
+
+        The slices are output_size x output_size pixels (by default, as in
+        iradon). With circle, only the pixels inside the reconstruction
+        circle are computed, the others are null.
+        """
+
+        self.angles = np.asarray(angles, dtype=np.float64).ravel()
+        self.detector_width = int(detector_width)
+
+        if output_size is None:
+            if circle:
+                output_size = self.detector_width
+            else:
+                output_size = int(np.floor(np.sqrt(self.detector_width ** 2 / 2.0)))
+        self.output_size = int(output_size)
+        self.circle = circle
+
+        # As in iradon, with circle, the projections are first padded to
+        # the diagonal of the square containing the reconstruction circle
+        self.filtered_width = self.detector_width
+        self.offset = 0
+        if circle:
+            self.filtered_width = int(np.ceil(np.sqrt(2) * self.detector_width))
+            self.offset = self.filtered_width // 2 - self.detector_width // 2
+
+        # Zero-padding of the projections before the FFT
+        self.padded_size = max(64, int(2 ** math.ceil(math.log2(2 * self.filtered_width))))
+        self.fourier_filter = getFourierFilter(self.padded_size, filter_name)
+
+        # Coordinates of the pixels of the output grid
+        radius = self.output_size // 2
+        xpr, ypr = np.mgrid[:self.output_size, :self.output_size] - radius
+
+        if circle:
+            self.pixels = np.flatnonzero((xpr ** 2 + ypr ** 2) <= radius ** 2)
+        else:
+            self.pixels = np.arange(self.output_size ** 2)
+
+        self.xpr = xpr.ravel()[self.pixels].astype(np.float64)
+        self.ypr = ypr.ravel()[self.pixels].astype(np.float64)
+
+        # Tables of all the angles (int32 indices and float32 weights)
+        self.tables = None
+        if len(self.angles) * len(self.pixels) * 8 <= max_table_size:
+            self.tables = [self.computeTable(angle_id) for angle_id in range(len(self.angles))]
+
+    def computeTable(self, angle_id):
+        # Index of the (filtered) detector pixel on the left of each pixel
+        # of the grid, and weight of the detector pixel on its right
+        angle = np.deg2rad(self.angles[angle_id])
+        position = self.ypr * np.cos(angle) - self.xpr * np.sin(angle) + self.filtered_width // 2
+
+        indices = np.floor(position)
+        weights = (position - indices).astype(np.float32)
+        indices = indices.astype(np.int32)
+
+        # Outside the detector, both neighbours are the zero padding
+        outside = (position < 0) | (position > self.filtered_width - 1)
+        indices[outside] = self.filtered_width
+        weights[outside] = 0
+
+        return indices, weights
+
+    def getTable(self, angle_id):
+        if self.tables is not None:
+            return self.tables[angle_id]
+        return self.computeTable(angle_id)
+
+    def checkSinograms(self, sinograms):
+        if sinograms.ndim != 3 or sinograms.shape[1:] != (len(self.angles), self.detector_width):
+            raise ValueError("The sinograms " + str(sinograms.shape) + " do not match (rows, " +
+                             str(len(self.angles)) + ", " + str(self.detector_width) + ")")
+
+    def filter(self, sinograms):
+        """Return the filtered (rows, angles, width + 2) sinograms in single precision.
+
+        width is the detector width, or the diagonal with circle. The two
+        null columns on the right are used by the interpolation tables.
+        """
+
+        padded = np.zeros(sinograms.shape[:-1] + (self.padded_size,), dtype=np.float32)
+        padded[..., self.offset:self.offset + self.detector_width] = sinograms
+
+        spectrum = np.fft.rfft(padded, axis=-1)
+        spectrum *= self.fourier_filter
+
+        filtered = np.zeros(sinograms.shape[:-1] + (self.filtered_width + 2,), dtype=np.float32)
+        filtered[..., :self.filtered_width] = np.fft.irfft(spectrum, n=self.padded_size, axis=-1)[..., :self.filtered_width]
+        return filtered
+
+    def backProject(self, filtered, out):
+        """Back-project filtered sinograms (see filter) into out (rows, size, size)."""
+
+        rows = filtered.shape[0]
+        accumulator = np.zeros((rows, len(self.pixels)), dtype=np.float32)
+        difference = np.empty((rows, self.filtered_width + 2), dtype=np.float32)
+        temp = np.empty_like(accumulator)
+
+        for angle_id in range(len(self.angles)):
+            indices, weights = self.getTable(angle_id)
+            projection = filtered[:, angle_id]
+
+            # f[i] + w * (f[i + 1] - f[i])
+            np.subtract(projection[:, 1:], projection[:, :-1], out=difference[:, :-1])
+            np.take(projection, indices, axis=1, out=temp)
+            accumulator += temp
+            np.take(difference, indices, axis=1, out=temp)
+            temp *= weights
+            accumulator += temp
+
+        accumulator *= np.float32(np.pi / (2 * len(self.angles)))
+
+        if self.circle:
+            slices = np.zeros((rows, self.output_size ** 2), dtype=np.float32)
+            slices[:, self.pixels] = accumulator
+        else:
+            slices = accumulator
+        out[...] = slices.reshape(out.shape)
+
+    def reconstruct(self, sinograms, out = None, chunk_size = None, number_of_threads = None):
+        """Reconstruct (rows, angles, columns) sinograms into a (rows, size, size) volume in single precision.
+
+        The sinograms are filtered and back-projected by slabs of
+        chunk_size rows, processed by several threads (NumPy releases the
+        GIL). out can be a preallocated (e.g. memory-mapped) volume.
+        """
+
+        self.checkSinograms(sinograms)
+        number_of_slices = sinograms.shape[0]
+
+        if out is None:
+            out = np.empty((number_of_slices, self.output_size, self.output_size), dtype=np.float32)
+        elif out.shape != (number_of_slices, self.output_size, self.output_size):
+            raise ValueError("The output volume " + str(out.shape) + " does not match the sinograms")
+
+        if chunk_size is None:
+            chunk_size = max(1, DEFAULT_CHUNK_SIZE_IN_BYTES // max(1, 4 * len(self.pixels)))
+
+        chunks = [slice(start, start + chunk_size) for start in range(0, number_of_slices, chunk_size)]
+
+        def process(rows):
+            self.backProject(self.filter(sinograms[rows]), out[rows])
+
+        if number_of_threads is None:
+            number_of_threads = os.cpu_count() or 1
+        number_of_threads = max(1, min(number_of_threads, len(chunks)))
+
+        if number_of_threads == 1:
+            for chunk in chunks:
+                process(chunk)
+        else:
+            with ThreadPoolExecutor(max_workers=number_of_threads) as executor:
+                list(executor.map(process, chunks))
+
+        return out
+
+
+# Engines already built, with their interpolation tables
+engine_cache = {}
+
+
+def getFBP(angles, detector_width, output_size = None, circle = True, filter_name = "ramp"):
+    """Return the FBP engine of this geometry, built once."""
+
+    angles = np.asarray(angles, dtype=np.float64).ravel()
+    key = (angles.tobytes(), int(detector_width), output_size, circle, filter_name)
+
+    if key not in engine_cache:
+        # Keep the tables of the last geometry only
+        engine_cache.clear()
+        engine_cache[key] = FBP(angles, detector_width, output_size, circle, filter_name)
+
+    return engine_cache[key]
+
+
+def reconstructFBP(sinograms, angles, output_size = None, circle = True, filter_name = "ramp",
+                   out = None, chunk_size = None, number_of_threads = None):
+    """FBP of (rows, angles, columns) sinograms, angles in degrees (see FBP.reconstruct)."""
+
+    engine = getFBP(angles, np.shape(sinograms)[2], output_size, circle, filter_name)
+    return engine.reconstruct(sinograms, out, chunk_size, number_of_threads)
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+
+"""
+Cone-beam CT reconstruction (FDK) of projections simulated with a point
+source, with the geometry of a json2gvxr configuration.
+
+The source-to-object and source-to-detector distances, the pixel pitch and
+the orientation of the detector (its up vector) come from the "Source" and
+"Detector" sections, and the views from the "Scan" section: each view is
+the pose of trajectory.getCircularPoses, i.e. the rotation applied to the
+sample during the simulation.
+
+- The projections are weighted by the cosine of the angle of each ray with
+  the central ray, and filtered row by row with one batched real FFT along
+  the detector rows (the ramp filter of fbp.py, scaled to the isocentre).
+- The volume is back-projected voxel by voxel, with bilinear interpolation
+  on the detector and the 1/distance^2 weight of each voxel, by slabs of
+  slices processed by several threads (NumPy releases the GIL). When the
+  rotation axis is parallel to the detector up vector (the usual case),
+  the columns hit by the voxels are the same for all the slices.
+
+The scan is assumed to cover a full rotation (no short-scan weights). The
+projections must be the line integrals (see preprocessing.py), in which
+case the volume is the linear attenuation coefficients in mm-1.
+"""
+
+import os
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import fbp # Ramp filter
+import trajectory
+
+
+# Size of the chunks of projections filtered at once by a thread
+DEFAULT_CHUNK_SIZE_IN_BYTES = 16 * 1024 * 1024
+
+# Size of the slabs of voxels back-projected at once by a thread
+DEFAULT_SLAB_SIZE_IN_VOXELS = 1024 * 1024
+
+
+def normalise(vector):
+    vector = np.asarray(vector, dtype=np.float64)
+    return vector / np.linalg.norm(vector)
+
+
+class ConeBeamGeometry:
+
+    def __init__(self, source_position, detector_position, detector_up, pixel_spacing, number_of_pixels, angles,
+                 rotation_axis = (0, 0, -1), centre_of_rotation = (0, 0, 0)):
+        """Circular cone-beam scan, lengths in mm and angles in degrees.
+
+        The detector is centred on detector_position and faces the source.
+        number_of_pixels and pixel_spacing are given as (columns, rows) like
+        in json2gvxr. The rows of the images go against the up vector, and
+        the columns along (beam direction x up vector).
+        """
+
+        self.source_position = np.asarray(source_position, dtype=np.float64)
+        self.detector_position = np.asarray(detector_position, dtype=np.float64)
+        self.pixel_spacing = [float(value) for value in pixel_spacing]
+        self.number_of_columns, self.number_of_rows = [int(value) for value in number_of_pixels]
+
+        self.angles = np.asarray(angles, dtype=np.float64).ravel()
+        self.rotation_axis = normalise(rotation_axis)
+        self.centre_of_rotation = np.asarray(centre_of_rotation, dtype=np.float64)
+
+        # Axes of the detector
+        self.beam = normalise(self.detector_position - self.source_position)
+        self.up = normalise(detector_up)
+        if abs(np.dot(self.beam, self.up)) > 1e-6:
+            raise ValueError("The detector up vector must be orthogonal to the beam")
+        self.right = np.cross(self.beam, self.up)
+
+        self.sdd = float(np.linalg.norm(self.detector_position - self.source_position))
+        self.sod = float(np.dot(self.centre_of_rotation - self.source_position, self.beam))
+        if self.sod <= 0 or self.sod >= self.sdd:
+            raise ValueError("The centre of rotation must be between the source and the detector")
+
+        # Poses of the sample, as during the simulation
+        self.poses = trajectory.getCircularPoses(self.angles, self.rotation_axis, self.centre_of_rotation)
+
+    def getMagnification(self):
+        return self.sdd / self.sod
+
+
+def getGeometry(config, angles = None):
+    """Geometry of a json2gvxr.SimulationConfig, the angles come from its circular "Scan" if not given."""
+
+    if config.source_position is None or config.detector_position is None:
+        raise IOError("Both 'Source' and 'Detector' are needed for a cone-beam reconstruction")
+
+    if config.source_shape != "PointSource":
+        raise IOError("The source is not a point source, use a parallel-beam reconstruction (see fbp.py)")
+
+    rotation_axis = (0, 0, -1)
+    centre = (0, 0, 0)
+    if config.scan_type is not None:
+        if config.scan_type != "Circular":
+            raise IOError("Only circular scans can be reconstructed with FDK, not: " + str(config.scan_type))
+        rotation_axis = config.scan_axis
+        centre = config.scan_centre
+        if angles is None:
+            angles = config.scan_angles
+
+    if angles is None:
+        raise IOError("No 'Scan' in the configuration, the angles must be given")
+
+    return ConeBeamGeometry(config.source_position, config.detector_position, config.detector_up,
+                            config.pixel_spacing, config.detector_number_of_pixels, angles,
+                            rotation_axis, centre)
+
+
+class FDK:
+
+    def __init__(self, geometry, volume_shape = None, voxel_size = None, filter_name = "ramp"):
+        """Reconstruction of a (slices, rows, columns) volume along the Z, Y and X axes, centred on the centre of rotation.
+
+        By default, the voxels are the size of the pixels at the isocentre,
+        and the volume has as many slices as the detector has rows, and as
+        many rows and columns as the detector has columns.
+        """
+
+        self.geometry = geometry
+
+        if voxel_size is None:
+            voxel_size = geometry.pixel_spacing[0] / geometry.getMagnification()
+        self.voxel_size = float(voxel_size)
+
+        if volume_shape is None:
+            volume_shape = (geometry.number_of_rows, geometry.number_of_columns, geometry.number_of_columns)
+        self.volume_shape = tuple(int(value) for value in volume_shape)
+
+        # Coordinates of the voxels (in mm) along the X, Y and Z axes
+        self.coordinates = [(np.arange(size) - (size - 1) / 2.0) * self.voxel_size + geometry.centre_of_rotation[axis]
+                            for axis, size in enumerate(self.volume_shape[::-1])]
+
+        # Cosine weights (rows, columns)
+        rows, columns = geometry.number_of_rows, geometry.number_of_columns
+        u = (np.arange(columns) - (columns - 1) / 2.0) * geometry.pixel_spacing[0]
+        v = ((rows - 1) / 2.0 - np.arange(rows)) * geometry.pixel_spacing[1]
+        self.cosine_weights = (geometry.sdd / np.sqrt(geometry.sdd ** 2 + u[np.newaxis] ** 2 + v[:, np.newaxis] ** 2)).astype(np.float32)
+
+        # Ramp filter, with the pixel pitch at the isocentre
+        self.padded_size = max(64, int(2 ** np.ceil(np.log2(2 * columns))))
+        pitch = geometry.pixel_spacing[0] / geometry.getMagnification()
+        self.fourier_filter = fbp.getFourierFilter(self.padded_size, filter_name) / (2.0 * pitch)
+
+    def checkProjections(self, projections):
+        geometry = self.geometry
+        expected = (len(geometry.angles), geometry.number_of_rows, geometry.number_of_columns)
+        if tuple(projections.shape) != expected:
+            raise ValueError("The projections " + str(projections.shape) + " do not match the geometry " + str(expected))
+
+    def filter(self, projections, out):
+        """Weight and filter (angles, rows, columns) projections into out (angles, rows + 2, columns + 2)."""
+
+        columns = self.geometry.number_of_columns
+        weighted = projections * self.cosine_weights
+
+        spectrum = np.fft.rfft(weighted, n=self.padded_size, axis=-1)
+        spectrum *= self.fourier_filter
+
+        # The two null rows and columns are used by the interpolation
+        out[:, -2:] = 0
+        out[:, :, -2:] = 0
+        out[:, :-2, :-2] = np.fft.irfft(spectrum, n=self.padded_size, axis=-1)[..., :columns]
+
+    def backProject(self, filtered, slices, out):
+        """Back-project all the filtered projections into the slices (a slice object) of the volume, stored in out."""
+
+        geometry = self.geometry
+        rows, columns = geometry.number_of_rows, geometry.number_of_columns
+        width = columns + 2
+
+        x, y, z = self.coordinates
+        x = x[np.newaxis, np.newaxis]
+        y = y[np.newaxis, :, np.newaxis]
+        z = z[slices, np.newaxis, np.newaxis]
+
+        accumulator = np.zeros(out.shape, dtype=np.float32)
+
+        for angle_id, pose in enumerate(geometry.poses):
+            projection = filtered[angle_id].ravel()
+
+            # Position of the voxels relative to the source once the sample
+            # is posed, along the axes of the detector (affine in x, y, z)
+            rotation = pose[:3, :3]
+            translation = pose[:3, 3] - geometry.source_position
+
+            def getCoordinate(axis):
+                coefficients = axis @ rotation
+                coordinate = coefficients[0] * x + coefficients[1] * y + np.dot(axis, translation)
+                # Same for all the slices if the axis is orthogonal to the rotation axis
+                if abs(coefficients[2]) > 1e-9:
+                    coordinate = coordinate + coefficients[2] * z
+                return coordinate.astype(np.float32)
+
+            depth = getCoordinate(geometry.beam)
+            scale = np.float32(geometry.sdd) / depth
+
+            column = getCoordinate(geometry.right) * scale / np.float32(geometry.pixel_spacing[0]) + np.float32((columns - 1) / 2.0)
+            row = np.float32((rows - 1) / 2.0) - getCoordinate(geometry.up) * scale / np.float32(geometry.pixel_spacing[1])
+            row, column = np.broadcast_arrays(row, column)
+
+            # Bilinear interpolation, outside the detector in the null rows and columns
+            row_index = np.floor(row)
+            column_index = np.floor(column)
+            row_weight = row - row_index
+            column_weight = column - column_index
+
+            outside = (row < 0) | (row > rows - 1) | (column < 0) | (column > columns - 1)
+            row_index[outside] = rows
+            column_index[outside] = columns
+
+            index = row_index.astype(np.int32) * width + column_index.astype(np.int32)
+
+            top = np.take(projection, index)
+            top += column_weight * (np.take(projection, index + 1) - top)
+            bottom = np.take(projection, index + width)
+            bottom += column_weight * (np.take(projection, index + width + 1) - bottom)
+            top += row_weight * (bottom - top)
+
+            # 1 / distance^2 weight
+            weight = np.float32(geometry.sod) / depth
+            top *= weight * weight
+            accumulator += top
+
+        out[...] = accumulator * np.float32(np.pi / len(geometry.angles))
+
+    def reconstruct(self, projections, out = None, number_of_threads = None, verbose = 0):
+        """Reconstruct (angles, rows, columns) projections into a volume in single precision.
+
+        out can be a preallocated (e.g. memory-mapped) volume.
+        """
+
+        self.checkProjections(projections)
+        geometry = self.geometry
+
+        if number_of_threads is None:
+            number_of_threads = os.cpu_count() or 1
+
+        if out is None:
+            out = np.empty(self.volume_shape, dtype=np.float32)
+        elif tuple(out.shape) != self.volume_shape:
+            raise ValueError("The output volume " + str(out.shape) + " does not match " + str(self.volume_shape))
+
+        start = time.time()
+
+        # Weight and filter all the projections, by chunks
+        filtered = np.empty((len(geometry.angles), geometry.number_of_rows + 2, geometry.number_of_columns + 2), dtype=np.float32)
+        chunk_size = max(1, DEFAULT_CHUNK_SIZE_IN_BYTES // max(1, 8 * self.padded_size * geometry.number_of_rows))
+        chunks = [slice(index, index + chunk_size) for index in range(0, len(geometry.angles), chunk_size)]
+
+        def filterChunk(chunk):
+            self.filter(np.asarray(projections[chunk], dtype=np.float32), filtered[chunk])
+
+        with ThreadPoolExecutor(max_workers=max(1, min(number_of_threads, len(chunks)))) as executor:
+            list(executor.map(filterChunk, chunks))
+
+        if verbose:
+            print("Filtered", len(geometry.angles), "projections in", round(time.time() - start, 3), "s")
+
+        # Back-project by slabs of slices
+        slab_size = max(1, DEFAULT_SLAB_SIZE_IN_VOXELS // (self.volume_shape[1] * self.volume_shape[2]))
+        slabs = [slice(index, min(index + slab_size, self.volume_shape[0])) for index in range(0, self.volume_shape[0], slab_size)]
+
+        def backProjectSlab(slab):
+            self.backProject(filtered, slab, out[slab])
+            return slab.stop - slab.start
+
+        done = 0
+        with ThreadPoolExecutor(max_workers=max(1, min(number_of_threads, len(slabs)))) as executor:
+            for count in executor.map(backProjectSlab, slabs):
+                done += count
+                if verbose:
+                    print("Reconstructed", done, "/", self.volume_shape[0], "slices in", round(time.time() - start, 3), "s")
+
+        return out
+
+
+def reconstructFDK(projections, geometry, volume_shape = None, voxel_size = None, filter_name = "ramp",
+                   out = None, number_of_threads = None, verbose = 0):
+    """FDK reconstruction of (angles, rows, columns) projections (see FDK.reconstruct)."""
+
+    return FDK(geometry, volume_shape, voxel_size, filter_name).reconstruct(projections, out, number_of_threads, verbose)
+
+
+def processCmdLine():
+    parser = argparse.ArgumentParser(description="Reconstruct cone-beam projections (FDK) with the geometry of a JSON file.")
+    parser.add_argument("--input", help="JSON file with the source, the detector and the scan", required=True)
+    parser.add_argument("--projections", help="Projections after the flat-field correction and minus log (.npy, angles x rows x columns)", required=True)
+    parser.add_argument("--output", help="Reconstructed volume (.mhd, with its .raw file)", required=True)
+    parser.add_argument("--shape", help="Number of slices, rows and columns of the volume", type=int, nargs=3)
+    parser.add_argument("--voxel_size", help="Size of the voxels in mm (pixel size at the isocentre by default)", type=float)
+    parser.add_argument("--threads", help="Number of threads (one per core by default)", type=int)
+    parser.add_argument("--verbose", help="Print the progress", type=int, default=1)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    import json2gvxr
+    import reconstruction
+
+    args = processCmdLine()
+
+    geometry = getGeometry(json2gvxr.loadConfig(args.input))
+    projections = np.load(args.projections, mmap_mode="r")
+
+    # The volume is written directly in a memory-mapped file
+    reconstructor = FDK(geometry, args.shape, args.voxel_size)
+    volume = reconstruction.createVolume(args.output, reconstructor.volume_shape, [reconstructor.voxel_size] * 3)
+    reconstructor.reconstruct(projections, volume, args.threads, args.verbose)
+    volume.flush()
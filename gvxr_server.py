@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+
+"""
+Keep a gvxr context and its scene warm in a long-lived process, and
+simulate X-ray images on request over a local Unix socket.
+
+The requests and replies are JSON objects, one per line:
+
+    {"command": "info"}
+    {"command": "config", "config": "simulation.json"}
+    {"command": "config", "delta": {"Source": {"Position": [0, -50, 0, "cm"]}}}
+    {"command": "render", "angles": [0, 0.5, 1], "node": "root", "axis": [0, 0, -1]}
+    {"command": "render", "matrices": [[1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1]]}
+    {"command": "shutdown"}
+
+A render request may also carry "config" or "delta", which is applied
+before the images are computed. Only the differences with the current
+configuration are applied (see json2gvxr.applyConfig). The images are not
+sent over the socket: they are written in a shared memory block owned by
+the server, and the reply gives its name, shape and data type.
+
+Use SimulationClient to talk to the server from Python.
+"""
+
+import os
+import json
+import time
+import copy
+import socket
+import asyncio
+import argparse
+import traceback
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+import json2gvxr
+import trajectory
+
+
+DEFAULT_SOCKET = os.path.join(os.environ.get("XDG_RUNTIME_DIR", "/tmp"), "gvxr-server.sock")
+
+
+def mergeParameters(parameters, delta):
+    """Return a copy of parameters updated with delta.
+
+    The dictionaries are merged recursively, any other value (including the
+    lists, e.g. "Samples") is replaced.
+    """
+
+    parameters = copy.deepcopy(parameters)
+    for key, value in delta.items():
+        if isinstance(value, dict) and isinstance(parameters.get(key), dict):
+            parameters[key] = mergeParameters(parameters[key], value)
+        else:
+            parameters[key] = copy.deepcopy(value)
+    return parameters
+
+
+def attachSharedMemory(name):
+    try:
+        # Python >= 3.13
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        memory = shared_memory.SharedMemory(name=name)
+
+        # Older versions also track the blocks they attach to, and would
+        # remove the block of the server when the client exits
+        resource_tracker.unregister(memory._name, "shared_memory")
+        return memory
+
+
+class SimulationServer:
+
+    def __init__(self, config_fname, socket_path = DEFAULT_SOCKET, renderer = "EGL", verbose = 0):
+        self.config_fname = config_fname
+        self.socket_path = socket_path
+        self.renderer = renderer
+        self.verbose = verbose
+        self.lock = None
+        self.stopped = None
+
+    def initialise(self):
+        start = time.time()
+
+        json2gvxr.initGVXR(self.config_fname, self.renderer)
+        json2gvxr.initSourceGeometry()
+        json2gvxr.initSpectrum(verbose=self.verbose)
+        json2gvxr.initDetector()
+        json2gvxr.initSamples(verbose=self.verbose)
+
+        if self.verbose > 0:
+            print("Scene ready in", round(time.time() - start, 3), "s")
+
+    def applyConfig(self, request):
+        if "config" in request:
+            config = request["config"]
+        elif "delta" in request:
+            config = mergeParameters(json2gvxr.params, request["delta"])
+        else:
+            return []
+
+        return json2gvxr.applyConfig(config, self.verbose)
+
+    def getPoses(self, request):
+        # Poses relative to the initial transformation of the node
+        if "matrices" in request:
+            return np.asarray(request["matrices"], dtype=np.float64).reshape((-1, 4, 4))
+        elif "angles" in request:
+            return trajectory.getCircularPoses(request["angles"], request.get("axis", [0, 0, -1]))
+        return np.identity(4)[np.newaxis]
+
+    def render(self, request, buffers):
+        changes = self.applyConfig(request)
+
+        poses = self.getPoses(request)
+        if not len(poses):
+            raise ValueError("No pose to render")
+
+        setPose = trajectory.PoseSetter(json2gvxr.gvxr, request.get("node", "root"))
+
+        images = None
+        try:
+            for pose_id, pose in enumerate(poses):
+                setPose(pose)
+                image = np.asarray(json2gvxr.gvxr.computeXRayImage(), dtype=np.float32)
+
+                if images is None:
+                    images = buffers.getArray((len(poses),) + image.shape, np.float32)
+                images[pose_id] = image
+        finally:
+            # Leave the scene as it was for the next request
+            setPose.restore()
+
+        return {
+            "changes": changes,
+            "shared_memory": buffers.memory.name,
+            "shape": list(images.shape),
+            "dtype": images.dtype.str
+        }
+
+    def process(self, request, buffers):
+        command = request.get("command")
+
+        if command == "info":
+            config = json2gvxr.simulation_config
+            return {
+                "config": config.fname,
+                "number_of_pixels": config.detector_number_of_pixels,
+                "version": json2gvxr.gvxr.getVersionOfSimpleGVXR()
+            }
+
+        elif command == "config":
+            return {"changes": self.applyConfig(request)}
+
+        elif command == "render":
+            return self.render(request, buffers)
+
+        elif command == "shutdown":
+            self.stopped.set()
+            return {}
+
+        raise ValueError("Invalid command: " + str(command))
+
+    async def handleClient(self, reader, writer):
+
+        # Each client has its own shared memory block
+        buffers = SharedBuffers()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                start = time.time()
+                try:
+                    request = json.loads(line)
+
+                    # Requests of several clients are processed one after the other.
+                    # gVirtualXRay is called from the thread of the event loop,
+                    # i.e. the one that owns the OpenGL context.
+                    async with self.lock:
+                        reply = self.process(request, buffers)
+                    reply["status"] = "ok"
+                except Exception as error:
+                    reply = {"status": "error", "message": str(error)}
+                    if self.verbose > 0:
+                        traceback.print_exc()
+
+                reply["time"] = time.time() - start
+                writer.write((json.dumps(reply) + "\n").encode("utf-8"))
+                await writer.drain()
+        except (asyncio.CancelledError, ConnectionError):
+            pass # The server is shutting down, or the client has gone
+        finally:
+            writer.close()
+            buffers.close()
+
+    async def serve(self):
+        self.lock = asyncio.Lock()
+        self.stopped = asyncio.Event()
+
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+        server = await asyncio.start_unix_server(self.handleClient, path=self.socket_path)
+        if self.verbose > 0:
+            print("Listening on", self.socket_path)
+
+        await self.stopped.wait()
+
+        # The connections still open are cancelled when the loop stops
+        server.close()
+
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def run(self):
+        self.initialise()
+        asyncio.run(self.serve())
+
+
+class SharedBuffers:
+    # Shared memory block where the images of a client are written,
+    # reallocated only when it is too small
+
+    def __init__(self):
+        self.memory = None
+
+    def getArray(self, shape, dtype):
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+
+        if self.memory is None or self.memory.size < size:
+            self.close()
+            self.memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+
+        return np.ndarray(shape, dtype=dtype, buffer=self.memory.buf)
+
+    def close(self):
+        if self.memory is not None:
+            self.memory.close()
+            self.memory.unlink()
+            self.memory = None
+
+
+class SimulationClient:
+
+    def __init__(self, socket_path = DEFAULT_SOCKET, timeout = None):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(socket_path)
+        self.stream = self.socket.makefile("rwb")
+        self.memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def send(self, request):
+        self.stream.write((json.dumps(request) + "\n").encode("utf-8"))
+        self.stream.flush()
+
+        line = self.stream.readline()
+        if not line:
+            raise IOError("The server has closed the connection")
+
+        reply = json.loads(line)
+        if reply["status"] != "ok":
+            raise RuntimeError("The server could not process the request: " + reply["message"])
+        return reply
+
+    def info(self):
+        return self.send({"command": "info"})
+
+    def applyConfig(self, config = None, delta = None):
+        """Apply a JSON file or dictionary (config), or a partial dictionary (delta). Return the changes."""
+        request = {"command": "config"}
+        if config is not None:
+            request["config"] = config
+        if delta is not None:
+            request["delta"] = delta
+        return self.send(request)["changes"]
+
+    def render(self, angles = None, matrices = None, node = "root", axis = (0, 0, -1), config = None, delta = None, copy = True):
+        """Return the X-ray images (poses, rows, columns) for the angles (in degrees) or 4x4 matrices.
+
+        With copy=False, the images are a view of the shared memory block,
+        valid until the next request.
+        """
+
+        request = {"command": "render", "node": node}
+        if angles is not None:
+            request["angles"] = [float(angle) for angle in angles]
+            request["axis"] = [float(value) for value in axis]
+        if matrices is not None:
+            request["matrices"] = np.asarray(matrices, dtype=np.float64).reshape((-1, 16)).tolist()
+        if config is not None:
+            request["config"] = config
+        if delta is not None:
+            request["delta"] = delta
+
+        reply = self.send(request)
+
+        if self.memory is None or self.memory.name.lstrip("/") != reply["shared_memory"].lstrip("/"):
+            self.closeMemory()
+            self.memory = attachSharedMemory(reply["shared_memory"])
+
+        images = np.ndarray(reply["shape"], dtype=np.dtype(reply["dtype"]), buffer=self.memory.buf)
+        if copy:
+            images = images.copy()
+        return images
+
+    def shutdown(self):
+        self.send({"command": "shutdown"})
+
+    def closeMemory(self):
+        if self.memory is not None:
+            self.memory.close()
+            self.memory = None
+
+    def close(self):
+        self.closeMemory()
+        self.stream.close()
+        self.socket.close()
+
+
+def processCmdLine():
+    parser = argparse.ArgumentParser(description='Keep a gvxr simulation warm and serve X-ray images over a Unix socket.')
+    parser.add_argument('--input', help='JSON file of the simulation.', type=str, required=True)
+    parser.add_argument('--socket', help='Path of the Unix socket.', type=str, default=DEFAULT_SOCKET)
+    parser.add_argument('--renderer', help='OpenGL renderer (OPENGL or EGL).', type=str, default="EGL")
+    parser.add_argument('--verbose', help='Print what is being set up.', type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = processCmdLine()
+
+    json2gvxr.setVerbosity(args.verbose)
+    SimulationServer(args.input, args.socket, args.renderer, args.verbose).run()
+
+    json2gvxr.gvxr.destroyAllWindows()
@@ -4,457 +4,1106 @@
 import numpy as np
 # # dir_path = os.path.dirname(os.path.realpath(__file__))
 # #
+import os
 import sys
 #
 # import math # for pi
 # # import tomopy
 #
 #
-import matplotlib
+# import matplotlib
 # matplotlib.use("TkAgg")
 # import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors
 #
 # import imageio
 import json # Load the JSON file
-import gvxrPython3 as gvxr # Simulate X-ray images
+import importlib
+import mesh_cache # Parallel and cached loading of STL files
+import spectrum_tools # Merge the energy bins
+import spectrum_cache # Cache the spectra generated by SpekPy (only imported on a cache miss)
+import transformations # 4x4 transformation matrices
+import preview # Headless acquisition and preview frames
+
+
+class LazyModule:
+    # Import a module the first time one of its attributes is used, so that
+    # importing json2gvxr stays cheap (e.g. to read a configuration)
+
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+
+    def __getattr__(self, attribute):
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return getattr(self.module, attribute)
+
+
+# Simulate X-ray images (GVXR_MODULE can name a replacement module, e.g. a stub
+# on machines without a GPU)
+gvxr = LazyModule(os.environ.get("GVXR_MODULE", "gvxrPython3"))
+
 # Define the NoneType
 NoneType = type(None);
 params  = None;
+simulation_config = None;
 context_created = False
-# Print the libraries' version
-print (gvxr.getVersionOfSimpleGVXR())
-print (gvxr.getVersionOfCoreGVXR())
 
+# The configuration currently set in gVirtualXRay, section by section
+applied_config = {"Window": None, "Source": None, "Spectrum": None, "Detector": None, "Samples": None}
+
+# Print what is being set up if > 0 (see setVerbosity)
+verbosity = int(os.environ.get("JSON2GVXR_VERBOSITY", 0))
+
+# Colours of the meshes (matplotlib's TABLEAU_COLORS)
+COLOURS = [tuple(int(colour[i:i + 2], 16) / 255 for i in (1, 3, 5)) for colour in [
+    "#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd",
+    "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22", "#17becf"
+]]
+
+
+def setVerbosity(level):
+    global verbosity;
+    verbosity = level
+
+
+def log(*args):
+    if verbosity > 0:
+        print(*args)
+
+
+# Conversion factors to the internal units of gVirtualXRay (mm and keV)
+LENGTH_UNITS = {
+    "um": 0.001,
+    "mm": 1.0,
+    "cm": 10.0,
+    "dm": 100.0,
+    "m": 1000.0,
+    "km": 1000000.0
+}
+
+ENERGY_UNITS = {
+    "eV": 0.001,
+    "keV": 1.0,
+    "MeV": 1000.0
+}
+
+MATERIAL_TYPES = ["ELEMENT", "MIXTURE", "COMPOUND", "HU", "MU"]
+
+
+def convertLength(value, unit):
+    if unit not in LENGTH_UNITS:
+        raise IOError("Unknown unit of length: " + str(unit))
+    return float(value) * LENGTH_UNITS[unit]
+
+
+def convertEnergy(value, unit):
+    if unit not in ENERGY_UNITS:
+        raise IOError("Unknown unit of energy: " + str(unit))
+    return float(value) * ENERGY_UNITS[unit]
+
+
+def getPositionInMM(position, what):
+    if type(position) != list or len(position) != 4:
+        raise IOError("Invalid " + what + " (expected [x, y, z, unit]): " + str(position))
+    return [convertLength(position[0], position[3]),
+            convertLength(position[1], position[3]),
+            convertLength(position[2], position[3])]
+
+
+def parseTransforms(transforms):
+    # e.g. [["Rotation", angle, x, y, z], ["Translation", x, y, z, unit], ["Scaling", x, y, z]]
+    # -> [("Rotation", [angle, x, y, z]), ("Translation", [x, y, z] in mm), ("Scaling", [x, y, z])]
+    chain = []
+    for transform in transforms:
+        if transform[0] == "Rotation":
+            if len(transform) != 5:
+                raise IOError("Invalid rotation: " + str(transform))
+            chain.append(("Rotation", [float(value) for value in transform[1:5]]))
+        elif transform[0] == "Translation":
+            if len(transform) != 5:
+                raise IOError("Invalid translation: " + str(transform))
+            chain.append(("Translation", [convertLength(value, transform[4]) for value in transform[1:4]]))
+        elif transform[0] == "Scaling":
+            if len(transform) != 4:
+                raise IOError("Invalid scaling: " + str(transform))
+            chain.append(("Scaling", [float(value) for value in transform[1:4]]))
+        else:
+            raise IOError("Invalid transformation: " + str(transform))
+    return chain
+
+
+class SampleConfig:
+    # A validated entry of "Samples" (or "SceneGraph"/"Samples").
+    # Lengths are stored in mm, the material type is upper-cased and
+    # the transformations are checked once so that initSamples does
+    # not fail half way through the scene.
+
+    def __init__(self, mesh, index, has_scenegraph = False):
+
+        if type(mesh) != dict or "Label" not in mesh:
+            raise IOError("Sample #" + str(index) + " has no label")
+
+        self.label = mesh["Label"]
+
+        # Geometry
+        self.geometry = None
+        self.geometry_parameters = []
+        self.path = None
+        self.unit = "mm"
+
+        if "Cube" in mesh:
+            if len(mesh["Cube"]) != 2:
+                raise IOError("Invalid cube for " + self.label + " (expected [size, unit]): " + str(mesh["Cube"]))
+            self.geometry = "Cube"
+            self.geometry_parameters = [convertLength(mesh["Cube"][0], mesh["Cube"][1])]
+        elif "Cylinder" in mesh:
+            if len(mesh["Cylinder"]) != 4:
+                raise IOError("Invalid cylinder for " + self.label + " (expected [sectors, height, radius, unit]): " + str(mesh["Cylinder"]))
+            self.geometry = "Cylinder"
+            self.geometry_parameters = [int(mesh["Cylinder"][0]),
+                                        convertLength(mesh["Cylinder"][1], mesh["Cylinder"][3]),
+                                        convertLength(mesh["Cylinder"][2], mesh["Cylinder"][3])]
+        elif "Path" in mesh:
+            if "Unit" not in mesh:
+                raise IOError("No unit of length for " + self.label)
+            if mesh["Unit"] not in LENGTH_UNITS:
+                raise IOError("Unknown unit of length for " + self.label + ": " + str(mesh["Unit"]))
+            self.geometry = "Path"
+            self.path = mesh["Path"]
+            self.unit = mesh["Unit"]
+        elif not has_scenegraph:
+            raise IOError("Cannot find the geometry of Mesh " + self.label)
+
+        # Material
+        self.material_type = None
+        self.material_value = None
+        self.elements = None
+        self.weights = None
+
+        if "Material" in mesh:
+            material = mesh["Material"]
+            if type(material) != list or len(material) != 2:
+                raise IOError("Invalid material for " + self.label + ": " + str(material))
+
+            self.material_type = material[0].upper()
+            self.material_value = material[1]
+
+            if self.material_type not in MATERIAL_TYPES:
+                raise IOError("Unknown material type: " + material[0])
+
+            if self.material_type == "MIXTURE" and type(material[1]) != str:
+                if len(material[1]) % 2:
+                    raise IOError("Invalid mixture for " + self.label + " (expected Z, weight pairs)")
+                self.elements = list(material[1][0::2])
+                self.weights = [float(weight) for weight in material[1][1::2]]
+
+            if self.material_type in ["HU", "MU"]:
+                self.material_value = float(material[1])
+
+        self.density = None
+        if "Density" in mesh:
+            self.density = float(mesh["Density"])
+
+        # Local transformations, translations are converted in mm.
+        # The chain is composed into one matrix by SimulationConfig.
+        self.transform_matrix = None
+        self.transforms = parseTransforms(mesh.get("Transform", []))
+
+        self.type = mesh.get("Type", "inner")
+        if self.type not in ["inner", "outer"]:
+            raise IOError("Invalid type for " + self.label + ": " + str(self.type))
+
+        self.opacity = float(mesh.get("Opacity", 1.0))
+
+    def getGeometryKey(self):
+        # Changing any of these requires the mesh to be rebuilt
+        return (self.label, self.geometry, tuple(self.geometry_parameters), self.path, self.unit, self.type)
+
+    def getMaterialKey(self):
+        if self.elements is not None:
+            return (self.material_type, tuple(self.elements), tuple(self.weights))
+        return (self.material_type, self.material_value)
+
+
+class SimulationConfig:
+    # A JSON file parsed and validated once.
+    # All the lengths are in mm and all the energies in keV.
+    # The raw dictionary is kept in "params" for the notebooks that
+    # still read it directly.
+
+    def __init__(self, parameters, fname = ""):
+
+        self.params = parameters
+        self.fname = fname
+        self.mtime = None
+        if fname != "":
+            self.mtime = os.path.getmtime(fname)
+
+        # Window
+        self.window_size = None
+        if "WindowSize" in parameters:
+            if len(parameters["WindowSize"]) != 2:
+                raise IOError("Invalid window size: " + str(parameters["WindowSize"]))
+            self.window_size = [int(parameters["WindowSize"][0]), int(parameters["WindowSize"][1])]
+
+        # Source
+        self.source_position = None
+        self.source_shape = None
+        self.spectrum_type = None
+        self.max_bins = None
+        self.tolerance = None
+
+        if "Source" in parameters:
+            self.parseSource(parameters["Source"])
+
+        # Detector
+        self.detector_position = None
+
+        if "Detector" in parameters:
+            self.parseDetector(parameters["Detector"])
+
+        # CT scan (see trajectory.getPoses)
+        self.scan_type = None
+
+        if "Scan" in parameters:
+            self.parseScan(parameters["Scan"])
+
+        # Visualisation during the acquisition (see preview.AcquisitionSettings)
+        self.acquisition = preview.AcquisitionSettings(parameters.get("Acquisition", None))
+
+        # Samples
+        self.scenegraph_path = None
+        self.scenegraph_unit = None
+        self.samples = None
+        self.samples_from_scenegraph = False
+
+        if "SceneGraph" in parameters:
+            scenegraph = parameters["SceneGraph"]
+            for key in ["Path", "Unit", "Samples"]:
+                if key not in scenegraph:
+                    raise IOError("No '" + key + "' in the scenegraph")
+            if scenegraph["Unit"] not in LENGTH_UNITS:
+                raise IOError("Unknown unit of length for the scenegraph: " + str(scenegraph["Unit"]))
+            self.scenegraph_path = scenegraph["Path"]
+            self.scenegraph_unit = scenegraph["Unit"]
+
+        if "Samples" in parameters:
+            mesh_source = parameters["Samples"]
+        elif "SceneGraph" in parameters:
+            mesh_source = parameters["SceneGraph"]["Samples"]
+            self.samples_from_scenegraph = True
+        else:
+            mesh_source = None
+
+        if mesh_source is not None:
+            self.samples = [SampleConfig(mesh, i, "SceneGraph" in parameters) for i, mesh in enumerate(mesh_source)]
+
+            labels = [sample.label for sample in self.samples]
+            if len(labels) != len(set(labels)):
+                raise IOError("Sample labels must be unique: " + str(labels))
+
+            # Compose the transformation chains of all the samples at once
+            matrices = transformations.composeTransformChains([sample.transforms for sample in self.samples])
+            for sample, matrix in zip(self.samples, matrices):
+                if len(sample.transforms):
+                    sample.transform_matrix = matrix
+
+    def parseSource(self, source):
+
+        if "Position" not in source:
+            raise IOError("No position for the source")
+        self.source_position = getPositionInMM(source["Position"], "source position")
+
+        self.source_shape = source.get("Shape", None)
+        if self.source_shape not in ["ParallelBeam", "PointSource"]:
+            raise IOError("Unknown source shape: " + str(self.source_shape))
+
+        if "Beam" not in source:
+            return
+
+        beam = source["Beam"]
+
+        # Optional rebinning of the spectrum into fewer energy groups
+        self.max_bins = None
+        self.tolerance = None
+        if type(beam) == dict:
+            if "MaxBins" in beam:
+                self.max_bins = int(beam["MaxBins"])
+                if self.max_bins < 1:
+                    raise IOError("Invalid number of energy bins: " + str(beam["MaxBins"]))
+            if "Tolerance" in beam:
+                self.tolerance = float(beam["Tolerance"])
+                if self.tolerance <= 0:
+                    raise IOError("Invalid tolerance of the spectrum rebinning: " + str(beam["Tolerance"]))
+
+        # Monochromatic or polychromatic beam listed in the JSON file (in keV)
+        if type(beam) == list:
+            self.spectrum_type = "list"
+            self.spectrum_energies = []
+            self.spectrum_counts = []
+            for energy_channel in beam:
+                for key in ["Energy", "Unit", "PhotonCount"]:
+                    if key not in energy_channel:
+                        raise IOError("No '" + key + "' in energy channel: " + str(energy_channel))
+                self.spectrum_energies.append(convertEnergy(energy_channel["Energy"], energy_channel["Unit"]))
+                self.spectrum_counts.append(float(energy_channel["PhotonCount"]))
+
+        # Spectrum stored in a file
+        elif "GateMacro" in beam or "TextFile" in beam:
+            if "GateMacro" in beam:
+                self.spectrum_type = "GateMacro"
+            else:
+                self.spectrum_type = "TextFile"
+
+            if "Unit" not in beam:
+                raise IOError("No unit of energy for the spectrum file")
+            if beam["Unit"] not in ENERGY_UNITS:
+                raise IOError("Unknown unit of energy: " + str(beam["Unit"]))
+
+            self.spectrum_file = beam[self.spectrum_type]
+            self.spectrum_unit = beam["Unit"]
+
+        # Spectrum generated by SpekPy
+        elif "kvp" in beam:
+            self.spectrum_type = "kvp"
+            self.kvp = float(beam["kvp"])
+            self.tube_angle = float(beam.get("tube angle", 12))
+            self.filters = []
+            for beam_filter in beam.get("filter", []):
+                if len(beam_filter) != 2:
+                    raise IOError("Invalid filter (expected [material, thickness in mm]): " + str(beam_filter))
+                self.filters.append((beam_filter[0], float(beam_filter[1])))
+
+        else:
+            raise IOError("Invalid beam spectrum in JSON file")
+
+    def parseDetector(self, detector):
+
+        for key in ["Position", "UpVector", "NumberOfPixels"]:
+            if key not in detector:
+                raise IOError("No '" + key + "' for the detector")
+
+        self.detector_position = getPositionInMM(detector["Position"], "detector position")
+
+        if len(detector["UpVector"]) != 3:
+            raise IOError("Invalid detector up vector: " + str(detector["UpVector"]))
+        self.detector_up = [float(value) for value in detector["UpVector"]]
+
+        if len(detector["NumberOfPixels"]) != 2:
+            raise IOError("Invalid detector number of pixels: " + str(detector["NumberOfPixels"]))
+        self.detector_number_of_pixels = [int(value) for value in detector["NumberOfPixels"]]
+
+        # "Spacing" takes precedence over "Size" when both are given
+        if "Spacing" in detector:
+            spacing = detector["Spacing"]
+            if len(spacing) != 3:
+                raise IOError("Invalid pixel spacing (expected [x, y, unit]): " + str(spacing))
+            self.pixel_spacing = [convertLength(spacing[0], spacing[2]),
+                                  convertLength(spacing[1], spacing[2])]
+        elif "Size" in detector:
+            size = detector["Size"]
+            if len(size) != 3:
+                raise IOError("Invalid detector size (expected [width, height, unit]): " + str(size))
+            self.pixel_spacing = [convertLength(size[0], size[2]) / self.detector_number_of_pixels[0],
+                                  convertLength(size[1], size[2]) / self.detector_number_of_pixels[1]]
+        else:
+            raise IOError("Either 'Spacing' or 'Size' is needed for the detector")
+
+        self.energy_response_file = None
+        self.energy_response_unit = None
+        if "Energy response" in detector:
+            energy_response = detector["Energy response"]
+            if "File" not in energy_response or "Energy" not in energy_response:
+                raise IOError("Invalid detector energy response: " + str(energy_response))
+            if energy_response["Energy"] not in ENERGY_UNITS:
+                raise IOError("Unknown unit of energy: " + str(energy_response["Energy"]))
+            self.energy_response_file = energy_response["File"]
+            self.energy_response_unit = energy_response["Energy"]
+
+    def parseScan(self, scan):
+
+        # Poses of the sample, relative to its initial transformation:
+        # - "Poses": a transformation chain per view (see "Transform" in "Samples"),
+        # - "Pitch": helical scan ([translation along the axis per turn, unit]),
+        # - otherwise, circular scan.
+        # The angles are either listed in "Angles" or evenly spaced.
+        self.scan_node = scan.get("Node", "root")
+        self.scan_angles = None
+        self.scan_transforms = None
+
+        if "Poses" in scan:
+            self.scan_type = "Poses"
+            self.scan_transforms = [parseTransforms(transforms) for transforms in scan["Poses"]]
+            if not len(self.scan_transforms):
+                raise IOError("No pose in the scan")
+            return
+
+        if "Angles" in scan:
+            self.scan_angles = [float(angle) for angle in scan["Angles"]]
+        elif "NumberOfProjections" in scan:
+            number_of_projections = int(scan["NumberOfProjections"])
+            first_angle = float(scan.get("FirstAngle", 0.0))
+            final_angle = float(scan.get("FinalAngle", 360.0))
+            include_final_angle = bool(scan.get("IncludeFinalAngle", False))
+            self.scan_angles = np.linspace(first_angle, final_angle, num=number_of_projections, endpoint=include_final_angle).tolist()
+        else:
+            raise IOError("Either 'Angles', 'NumberOfProjections' or 'Poses' is needed for the scan")
+
+        if not len(self.scan_angles):
+            raise IOError("No angle in the scan")
+
+        self.scan_axis = [float(value) for value in scan.get("RotationAxis", [0, 0, -1])]
+        if len(self.scan_axis) != 3 or not any(self.scan_axis):
+            raise IOError("Invalid rotation axis: " + str(scan.get("RotationAxis")))
+
+        self.scan_centre = [0.0, 0.0, 0.0]
+        if "CentreOfRotation" in scan:
+            self.scan_centre = getPositionInMM(scan["CentreOfRotation"], "centre of rotation")
+
+        self.scan_type = "Circular"
+        self.scan_pitch = None
+        if "Pitch" in scan:
+            pitch = scan["Pitch"]
+            if type(pitch) != list or len(pitch) != 2:
+                raise IOError("Invalid pitch (expected [translation per turn, unit]): " + str(pitch))
+            self.scan_type = "Helical"
+            self.scan_pitch = convertLength(pitch[0], pitch[1])
+
+    def getSourceKey(self):
+        if self.source_position is None:
+            return None
+        return (tuple(self.source_position), self.source_shape)
+
+    def getSpectrumKey(self):
+        if self.spectrum_type == "list":
+            return ("list", tuple(self.spectrum_energies), tuple(self.spectrum_counts))
+        elif self.spectrum_type in ["GateMacro", "TextFile"]:
+            key = (self.spectrum_type, self.spectrum_file, self.spectrum_unit, self.max_bins, self.tolerance)
+        elif self.spectrum_type == "kvp":
+            key = ("kvp", self.kvp, self.tube_angle, tuple(self.filters), self.max_bins, self.tolerance)
+        else:
+            return None
+
+        # With a tolerance, the spectrum is rebinned for the materials of the samples
+        if self.tolerance is not None and self.samples is not None:
+            key += (tuple(sample.getMaterialKey() for sample in self.samples if sample.material_type is not None),)
+        return key
+
+    def getSamplesKey(self):
+        # The structure of the scene, i.e. what needs a full reload when changed
+        if self.samples is None:
+            return None
+        return (self.scenegraph_path, self.scenegraph_unit, self.samples_from_scenegraph,
+                tuple(sample.getGeometryKey() for sample in self.samples))
+
+    def getFiles(self):
+        # All the files the simulation reads
+        files = []
+        if self.spectrum_type in ["GateMacro", "TextFile"]:
+            files.append(self.spectrum_file)
+        if self.detector_position is not None and self.energy_response_file is not None:
+            files.append(self.energy_response_file)
+        if self.scenegraph_path is not None:
+            files.append(self.scenegraph_path)
+        if self.samples is not None and not self.samples_from_scenegraph:
+            for sample in self.samples:
+                if sample.geometry == "Path":
+                    files.append(sample.path)
+        return files
+
+    def checkFiles(self):
+        missing_files = [fname for fname in self.getFiles() if not os.path.exists(fname)]
+        if len(missing_files):
+            raise IOError("Missing file(s): " + ", ".join(missing_files))
+
+
+def loadConfig(config = "", check_files = False):
+    global params, simulation_config;
+
+    # Compile the JSON file, or reuse the configuration already loaded
+    if isinstance(config, SimulationConfig):
+        simulation_config = config
+    elif type(config) == dict:
+        simulation_config = SimulationConfig(config)
+    elif config != "":
+        if simulation_config is None or simulation_config.fname != config or simulation_config.mtime != os.path.getmtime(config):
+            with open(config) as f:
+                simulation_config = SimulationConfig(json.load(f), config)
+    elif simulation_config is None:
+        raise IOError("No JSON file has been loaded")
+
+    params = simulation_config.params
+
+    if check_files:
+        simulation_config.checkFiles()
+
+    return simulation_config
+
+
+def initGVXR(config, renderer = "OPENGL"):
+    global context_created;
 
-def initGVXR(fname, renderer = "OPENGL"):
-    global params;
     # Load the JSON file
-    with open(fname) as f:
-        params = json.load(f)
-        
+    config = loadConfig(config)
+
     # Create an OpenGL context
-    window_size = params["WindowSize"];
-    print("Create an OpenGL context:",
+    window_size = config.window_size;
+    if window_size is None:
+        raise IOError("No 'WindowSize' in the JSON file")
+
+    # Print the libraries' version
+    log(gvxr.getVersionOfSimpleGVXR())
+    log(gvxr.getVersionOfCoreGVXR())
+
+    log("Create an OpenGL context:",
         str(window_size[0]) + "x" + str(window_size[1])
     );
-    
+
     if not context_created:
         if renderer == "OPENGL":
             visibility = True
         else:
             visibility = False
 
+        # No visible window in headless mode
         gvxr.createWindow(-1,
-            True,
+            not config.acquisition.headless,
             renderer)
-        
+        context_created = True
+
     gvxr.setWindowSize(
         window_size[0],
         window_size[1]
     );
+    applied_config["Window"] = config
+
+def initSourceGeometry(config = ""):
 
-def initSourceGeometry(fname = ""):
-    global params;
     # Load the JSON file
-    if fname != "":
-        with open(fname) as f:
-            params = json.load(f)
+    config = loadConfig(config)
+    if config.source_position is None:
+        raise IOError("No 'Source' in the JSON file")
+
     # Set up the beam
-    print("Set up the beam")
-    source_position = params["Source"]["Position"];
-    print("\tSource position:", source_position)
+    log("Set up the beam")
+    source_position = config.source_position;
+    log("\tSource position:", source_position, "mm")
     gvxr.setSourcePosition(
         source_position[0],
         source_position[1],
         source_position[2],
-        source_position[3]
+        "mm"
     );
-    source_shape = params["Source"]["Shape"]
-    print("\tSource shape:", source_shape);
+    source_shape = config.source_shape
+    log("\tSource shape:", source_shape);
     if source_shape == "ParallelBeam":
         gvxr.useParallelBeam();
     elif source_shape == "PointSource":
         gvxr.usePointSource();
-    else:
-        raise "Unknown source shape:" + source_shape;
-        
-        
-def initSpectrum(fname = "", verbose = 0):
-    global params;
 
-    min_energy = sys.float_info.max
-    max_energy = -sys.float_info.max
+    applied_config["Source"] = config
+
+
+def initSpectrum(config = "", verbose = 0):
 
-    gvxr.resetBeamSpectrum()
-    spectrum = {};
     # Load the JSON file
-    if fname != "":
-        with open(fname) as f:
-            params = json.load(f)
-    if type(params["Source"]["Beam"]) == list:
-        k = []
-        f = []
-        for energy_channel in params["Source"]["Beam"]:
-            energy = energy_channel["Energy"];
-            unit = energy_channel["Unit"];
-            count = energy_channel["PhotonCount"];
-            spectrum[energy] = count;
-            if verbose > 0:
-                if count == 1:
-                    print("\t", str(count), "photon of", energy, unit);
-                else:
-                    print("\t", str(count), "photons of", energy, unit);
-            gvxr.addEnergyBinToSpectrum(energy, unit, count);
-            k.append(energy)
-            f.append(count)
-        k = np.array(k)
-        f = np.array(f)
+    config = loadConfig(config)
+    if config.spectrum_type is None:
+        raise IOError("Invalid beam spectrum in JSON file")
+
+    unit = "keV"
+
+    if config.spectrum_type == "list":
+        k = np.array(config.spectrum_energies)
+        f = np.array(config.spectrum_counts)
+        counts = f
     else:
-        if "GateMacro" in params["Source"]["Beam"]:
-            k = []
-            f = []
-            unit = params["Source"]["Beam"]["Unit"]
-            # Read the file
-            gate_macro_file = open(params["Source"]["Beam"]["GateMacro"], 'r')
-            lines = gate_macro_file.readlines()
-            # Process every line
-            for line in lines:
-                # Check if this is a comment or not
-                comment = True
-                index_first_non_space_character = len(line) - len(line.lstrip())
-                if index_first_non_space_character >= 0 and index_first_non_space_character < len(line):
-                    if line[index_first_non_space_character] != '#':
-                        comment = False
-                # This is not a comment
-                if not comment:
-                    x = line.split()
-                energy = float(x[1])
-                count = float(x[2])
-                spectrum[energy] = count
-                if verbose > 0:
-                    if count == 1:
-                        print("\t", str(count), "photon of", energy, unit);
-                    else:
-                        print("\t", str(count), "photons of", energy, unit);
-                gvxr.addEnergyBinToSpectrum(energy, unit, count);
-                k.append(energy)
-                f.append(count)
-
-            k = np.array(k)
-            f = np.array(f)
-        elif "TextFile" in params["Source"]["Beam"]:
-            k = []
-            f = []
-            unit = params["Source"]["Beam"]["Unit"]
-
-            # Read the file
-            gate_macro_file = open(params["Source"]["Beam"]["TextFile"], 'r')
-            lines = gate_macro_file.readlines()
-
-            # Process every line
-            for line in lines:
-
-                # Check if this is a comment or not
-                comment = True
-                index_first_non_space_character = len(line) - len(line.lstrip())
-                if index_first_non_space_character >= 0 and index_first_non_space_character < len(line):
-                    if line[index_first_non_space_character] != '#':
-                        comment = False
-
-                # This is not a comment
-                if not comment:
-                    x = line.split()
-
-                energy = float(x[0])
-                count = float(x[1])
-                spectrum[energy] = count
-
-                if verbose > 0:
-                    if count == 1:
-                        print("\t", str(count), "photon of", energy, unit);
-                    else:
-                        print("\t", str(count), "photons of", energy, unit);
-
-                gvxr.addEnergyBinToSpectrum(energy, unit, count);
-                k.append(energy)
-                f.append(count)
-
-            k = np.array(k)
-            f = np.array(f)
-        elif "kvp" in params["Source"]["Beam"]:
-            kvp_in_kV = params["Source"]["Beam"]["kvp"];
-            th_in_deg = 12
-
-            if "tube angle" in params["Source"]["Beam"]:
-                th_in_deg = params["Source"]["Beam"]["tube angle"];
-
-            import spekpy as sp
+        if config.spectrum_type == "GateMacro":
+            k, f = spectrum_tools.readGateMacro(config.spectrum_file)
+            k *= ENERGY_UNITS[config.spectrum_unit]
+        elif config.spectrum_type == "TextFile":
+            k, f = spectrum_tools.readTextFile(config.spectrum_file)
+            k *= ENERGY_UNITS[config.spectrum_unit]
+        elif config.spectrum_type == "kvp":
+            kvp_in_kV = config.kvp;
+            th_in_deg = config.tube_angle
 
             if verbose > 0:
                 print("kVp (kV):", kvp_in_kV)
                 print("tube angle (degrees):", th_in_deg)
 
-            s = sp.Spek(kvp=kvp_in_kV, th=th_in_deg) # Generate a spectrum (80 kV, 12 degree tube angle)
+                for filter_material, filter_thickness_in_mm in config.filters:
+                    print("Filter", filter_thickness_in_mm, "mm of", filter_material)
 
-            if "filter" in params["Source"]["Beam"]:
-                print('params["Source"]["Beam"]', params["Source"]["Beam"])
-                for beam_filter in params["Source"]["Beam"]["filter"]:
-                    print(beam_filter)
+            # Generate the spectrum with SpekPy, or read it from the cache
+            k, f = spectrum_cache.getSpekPySpectrum(kvp_in_kV, th_in_deg, config.filters)
 
-                    filter_material = beam_filter[0]
-                    filter_thickness_in_mm = beam_filter[1]
+        # SpekPy gives a fluence, use whole numbers of photons
+        if config.spectrum_type == "kvp":
+            counts = np.round(f)
+        else:
+            counts = f
 
-                    if verbose > 0:
-                        print("Filter", filter_thickness_in_mm, "mm of", filter_material)
+    # Merge the bins of identical energies into one sorted histogram
+    energies, counts = spectrum_tools.mergeBins(k, counts)
+    if not len(energies):
+        raise IOError("The beam spectrum is empty")
 
-                    s.filter(filter_material, filter_thickness_in_mm)
+    # Fewer energy bins means fewer attenuation passes per projection
+    if config.max_bins is not None or config.tolerance is not None:
+        number_of_bins = len(energies)
+        energies, counts, error = spectrum_tools.rebinSpectrum(energies, counts,
+                                                               config.max_bins,
+                                                               config.tolerance,
+                                                               config.samples)
 
+        log("Rebin the spectrum from", number_of_bins, "to", len(energies), "energy bins")
+        if error is not None:
+            log("\tEstimated transmission error:", str(round(100 * error, 3)) + "%")
+            if error > config.tolerance:
+                print("\tWARNING: the tolerance (" + str(100 * config.tolerance) + "%) cannot be met with", config.max_bins, "bins")
 
+    # Give the spectrum to gVirtualXRay (once per bin)
+    gvxr.resetBeamSpectrum()
+    for energy, count in zip(energies, counts):
+        gvxr.addEnergyBinToSpectrum(float(energy), unit, float(count));
 
-            unit = "keV"
-            k, f = s.get_spectrum(edges=True) # Get the spectrum
+    spectrum = dict(zip(energies.tolist(), counts.tolist()))
 
-            for energy, count in zip(k, f):
-                count = round(count)
-                if count > 0:
-                    max_energy = max(max_energy, energy)
-                    min_energy = min(min_energy, energy)
-                    if energy in spectrum.keys():
-                        spectrum[energy] += count
-                    else:
-                        spectrum[energy] = count
-        else:
-            raise IOError("Invalid beam spectrum in JSON file")
-        if verbose > 0:
-            print("/gate/source/mybeam/gps/emin", min_energy, "keV")
-            print("/gate/source/mybeam/gps/emax", max_energy, "keV")
-        for energy in spectrum.keys():
-            count = spectrum[energy]
-            gvxr.addEnergyBinToSpectrum(energy, unit, count);
-            if verbose > 0:
-                print("/gate/source/mybeam/gps/histpoint", energy / 1000, count)
+    log("Set up the spectrum")
+    log("\tNumber of energy bins:", len(energies))
+    log("\tTotal energy:", spectrum_tools.getTotalEnergy(energies, counts), unit)
+
+    if verbose > 0:
+        print("/gate/source/mybeam/gps/emin", energies[0], "keV")
+        print("/gate/source/mybeam/gps/emax", energies[-1], "keV")
+        for energy, count in zip(energies, counts):
+            print("/gate/source/mybeam/gps/histpoint", energy / 1000, count)
+
+    applied_config["Spectrum"] = config
     return spectrum, unit, k, f;
 
 
-def initDetector(fname = ""):
-    global params;
+def initDetector(config = ""):
+
     # Load the JSON file
-    if fname != "":
-        with open(fname) as f:
-            params = json.load(f);
+    config = loadConfig(config)
+    if config.detector_position is None:
+        raise IOError("No 'Detector' in the JSON file")
+
+    # The detector is only partly set up until the end
+    applied_config["Detector"] = None
+
     # Set up the detector
-    print("Set up the detector");
-    detector_position = params["Detector"]["Position"];
-    print("\tDetector position:", detector_position)
+    log("Set up the detector");
+    detector_position = config.detector_position;
+    log("\tDetector position:", detector_position, "mm")
     gvxr.setDetectorPosition(
         detector_position[0],
         detector_position[1],
         detector_position[2],
-        detector_position[3]
+        "mm"
     );
-    detector_up = params["Detector"]["UpVector"];
-    print("\tDetector up vector:", detector_up)
+    detector_up = config.detector_up;
+    log("\tDetector up vector:", detector_up)
     gvxr.setDetectorUpVector(
         detector_up[0],
         detector_up[1],
         detector_up[2]
     );
-    detector_number_of_pixels = params["Detector"]["NumberOfPixels"];
-    print("\tDetector number of pixels:", detector_number_of_pixels)
+    detector_number_of_pixels = config.detector_number_of_pixels;
+    log("\tDetector number of pixels:", detector_number_of_pixels)
     gvxr.setDetectorNumberOfPixels(
         detector_number_of_pixels[0],
         detector_number_of_pixels[1]
     );
-    if "Spacing" in params["Detector"].keys() == list and "Size" in params["Detector"].keys():
-        raise "Cannot use both 'Spacing' and 'Size' for the detector";
-    if "Spacing" in params["Detector"].keys():
-        pixel_spacing = params["Detector"]["Spacing"];
-    elif "Size" in params["Detector"].keys():
-        detector_size = params["Detector"]["Size"];
-        pixel_spacing = [];
-        pixel_spacing.append(detector_size[0] / detector_number_of_pixels[0]);
-        pixel_spacing.append(detector_size[1] / detector_number_of_pixels[1]);
-        pixel_spacing.append(detector_size[2]);
-        
-    if "Energy response" in params["Detector"].keys():
-        print("\tEnergy response:", params["Detector"]["Energy response"]["File"], "in", params["Detector"]["Energy response"]["Energy"])
+
+    if config.energy_response_file is not None:
+        log("\tEnergy response:", config.energy_response_file, "in", config.energy_response_unit)
         gvxr.clearDetectorEnergyResponse()
-        gvxr.loadDetectorEnergyResponse(params["Detector"]["Energy response"]["File"],
-                                        params["Detector"]["Energy response"]["Energy"])
-    print("\tPixel spacing:", pixel_spacing)
+        gvxr.loadDetectorEnergyResponse(config.energy_response_file,
+                                        config.energy_response_unit)
+
+    pixel_spacing = config.pixel_spacing;
+    log("\tPixel spacing:", pixel_spacing, "mm")
     gvxr.setDetectorPixelSize(
         pixel_spacing[0],
         pixel_spacing[1],
-        pixel_spacing[2]
+        "mm"
     );
-    
-    
-def initSamples(fname = "", verbose = 0):
-    global params; 
-    
-    gvxr.removePolygonMeshesFromXRayRenderer()
-    gvxr.removePolygonMeshesFromSceneGraph()
-    
-    # Load the JSON file
-    if fname != "":
-        with open(fname) as f:
-            params = json.load(f);
+    applied_config["Detector"] = config
+
+
+def setMaterial(sample, verbose = 0):
+
+    if sample.material_type == "ELEMENT":
+        gvxr.setElement(
+            sample.label,
+            sample.material_value
+        );
+    elif sample.material_type == "MIXTURE":
+        if sample.elements is None:
+            gvxr.setMixture(
+                sample.label,
+                sample.material_value
+            );
+        else:
+            if verbose == 2:
+                print(sample.label + ":",
+                      "d="+str(sample.density), "g/cm3 ;",
+                      "n=" + str(len(sample.elements)),
+                      "; state=solid");
+                for Z, weight in zip(sample.elements, sample.weights):
+                    print("        +el: name="+gvxr.getElementName(Z) + " ; f=" +str(weight) )
+                print()
+            gvxr.setMixture(
+                sample.label,
+                sample.elements,
+                sample.weights
+            );
+    elif sample.material_type == "COMPOUND":
+        gvxr.setCompound(
+            sample.label,
+            sample.material_value
+        );
+    elif sample.material_type == "HU":
+        gvxr.setHounsfieldValue(
+            sample.label,
+            sample.material_value
+        );
+    elif sample.material_type == "MU":
+        gvxr.setLinearAttenuationCoefficient(
+            sample.label,
+            sample.material_value,
+            "cm-1"
+        );
+    if sample.density is not None:
+        gvxr.setDensity(
+            sample.label,
+            sample.density,
+            "g/cm3"
+        );
+
+
+def applyTransformMatrix(label, matrix):
+
+    # Right-multiply the whole transformation chain onto the local
+    # transformation of the node (e.g. given by the scenegraph), like
+    # gvxr.rotateNode, in one call, and apply it to the vertices
+    local_matrix = np.asarray(gvxr.getLocalTransformationMatrix(label), dtype=np.float64).reshape((4, 4)).T
+    gvxr.setLocalTransformationMatrix(label, transformations.toColumnMajorList(local_matrix @ matrix))
+    gvxr.applyCurrentLocalTransformation(label)
+
+
+def initSamples(config = "", verbose = 0, use_cache = True, number_of_threads = None):
+
+    # Load the JSON file and make sure all the meshes can be loaded
+    # before the current scene is destroyed
+    config = loadConfig(config)
+    if config.samples is None:
+        raise IOError("No 'Samples' in the JSON file")
+
+    for sample in config.samples:
+        if sample.material_type is None:
+            raise IOError("No material for " + sample.label)
+
+    config.checkFiles()
+
     # Load the data
     if verbose > 0:
         print("Load the 3D data\n");
-    colours = list(mcolors.TABLEAU_COLORS);
+
+    # Decode all the STL files at once in a thread pool (or read them from the cache)
+    mesh_buffers = {}
+    if not config.samples_from_scenegraph:
+        mesh_buffers = mesh_cache.loadMeshes(
+            [(sample.label, sample.path, sample.unit) for sample in config.samples if sample.geometry == "Path"],
+            number_of_threads,
+            use_cache = use_cache,
+            verbose = verbose
+        )
+
+    # The scene is incomplete until all the samples are set up
+    applied_config["Samples"] = None
+
+    gvxr.removePolygonMeshesFromXRayRenderer()
+    gvxr.removePolygonMeshesFromSceneGraph()
+
+    colours = COLOURS;
     colour_id = 0;
-    
-    mesh_source = None
-    mesh_unit = None
-    
-    if "SceneGraph" in params:
-        mesh_source = params["SceneGraph"]["Samples"]
-        gvxr.loadSceneGraph(params["SceneGraph"]["Path"], params["SceneGraph"]["Unit"])
+
+    if config.scenegraph_path is not None:
+        gvxr.loadSceneGraph(config.scenegraph_path, config.scenegraph_unit)
         if verbose > 0:
-            print("Load the 3D objects from a scenegraph (" + params["SceneGraph"]["Path"] + ")")
-            
-            for i, mesh in enumerate(mesh_source):
-                print(i, mesh["Label"])
+            print("Load the 3D objects from a scenegraph (" + config.scenegraph_path + ")")
 
+            for i, sample in enumerate(config.samples):
+                print(i, sample.label)
 
-    if "Samples" in params:
-        mesh_source = params["Samples"]
-    
-    for mesh in mesh_source:
-        if "Cube" in mesh:
+    for sample in config.samples:
+        if sample.geometry == "Cube":
             if verbose == 1:
-                print(mesh["Label"] + " is a cube")
-            
-            gvxr.makeCube(mesh["Label"], mesh["Cube"][0], mesh["Cube"][1]);
-                
-        elif "Cylinder" in mesh:
+                print(sample.label + " is a cube")
+
+            gvxr.makeCube(sample.label, sample.geometry_parameters[0], "mm");
+
+        elif sample.geometry == "Cylinder":
             if verbose == 1:
-                print(mesh["Label"] + " is a cylinder")
-                
-            gvxr.makeCylinder(mesh["Label"], mesh["Cylinder"][0], mesh["Cylinder"][1], mesh["Cylinder"][2], mesh["Cylinder"][3]);
-        elif "Path" in mesh and "Samples" in params:
+                print(sample.label + " is a cylinder")
+
+            gvxr.makeCylinder(sample.label, sample.geometry_parameters[0], sample.geometry_parameters[1], sample.geometry_parameters[2], "mm");
+        elif sample.label in mesh_buffers:
+            vertices, indices = mesh_buffers[sample.label]
+            gvxr.makeTriangularMesh(
+                sample.label,
+                vertices.ravel(),
+                indices.ravel(),
+                sample.unit
+            );
+        elif sample.geometry == "Path" and not config.samples_from_scenegraph:
             if verbose > 0:
-                print("\tLoad", mesh["Label"], "in", mesh["Path"], "using", mesh["Unit"]);
+                print("\tLoad", sample.label, "in", sample.path, "using", sample.unit);
             gvxr.loadMeshFile(
-                mesh["Label"],
-                mesh["Path"],
-                mesh["Unit"],
+                sample.label,
+                sample.path,
+                sample.unit,
                 False
             );
-        elif "SceneGraph" not in params:
-            raise IOError("Cannot find the geometry of Mesh " + mesh["Label"])
-
-        material = mesh["Material"];
-        if material[0].upper() == "ELEMENT":
-            gvxr.setElement(
-                mesh["Label"],
-                material[1]
-            );
-        elif material[0].upper() == "MIXTURE":
-            if type(material[1]) == str:
-                gvxr.setMixture(
-                    mesh["Label"],
-                    material[1]
-                );
-            else:
-                elements = [];
-                weights = [];
-                if verbose == 2:
-                    print(mesh["Label"] + ":",
-                          "d="+str(mesh["Density"]), "g/cm3 ;",
-                          "n=" + str(len(material[1][0::2])),
-                          "; state=solid");
-                for Z, weight in zip(material[1][0::2], material[1][1::2]):
-                    elements.append(Z);
-                    weights.append(weight);
-                    if verbose == 2:
-                        print("        +el: name="+gvxr.getElementName(Z) + " ; f=" +str(weight) )
-                if verbose == 2:
-                    print()
-                gvxr.setMixture(
-                    mesh["Label"],
-                    elements,
-                    weights
-                );
-        elif material[0].upper() == "COMPOUND":
-            gvxr.setCompound(
-                mesh["Label"],
-                material[1]
-            );
-        elif material[0].upper() == "HU":
-            gvxr.setHounsfieldValue(
-                mesh["Label"],
-                material[1]
-            );
-        elif material[0].upper() == "MU":
-            gvxr.setLinearAttenuationCoefficient(
-                mesh["Label"],
-                material[1],
-                "cm-1"
-            );
-        else:
-            raise IOError("Unknown material type: " + material[0]);
-        if "Density" in mesh.keys():
-            gvxr.setDensity(
-                mesh["Label"],
-                mesh["Density"],
-                "g/cm3"
-            );
 
-        if "Transform" in mesh.keys():
-            for transform in mesh["Transform"]:
-                if transform[0] == "Rotation":
-                    if len(transform) == 5:
-                        gvxr.rotateNode(mesh["Label"],
-                                        transform[1],
-                                        transform[2],
-                                        transform[3],
-                                        transform[4])
-                    else:
-                        raise IOError("Invalid rotation:", transform)
-                elif transform[0] == "Translation":
-                    if len(transform) == 5:
-                        gvxr.translateNode(mesh["Label"],
-                                        transform[1],
-                                        transform[2],
-                                        transform[3],
-                                        transform[4])
-                    else:
-                        raise IOError("Invalid translation:", transform)
-                elif transform[0] == "Scaling":
-                    if len(transform) == 4:
-                        gvxr.scaleNode(mesh["Label"],
-                                        transform[1],
-                                        transform[2],
-                                        transform[3])
-                    else:
-                        raise IOError("Invalid scaling:", transform)
-                else:
-                    raise IOError("Invalid transformation:", transform)
-
-            gvxr.applyCurrentLocalTransformation(mesh["Label"])
+        setMaterial(sample, verbose)
+
+        if sample.transform_matrix is not None:
+            applyTransformMatrix(sample.label, sample.transform_matrix)
 
         # Add the mesh to the simulation
-        if "Type" in mesh.keys():
-            if mesh["Type"] == "inner":
-                gvxr.addPolygonMeshAsInnerSurface(mesh["Label"]);
-            elif mesh["Type"] == "outer":
-                # gvxr.addPolygonMeshAsInnerSurface(mesh["Label"]);
-                gvxr.addPolygonMeshAsOuterSurface(mesh["Label"]);
-        else:
-            gvxr.addPolygonMeshAsInnerSurface(mesh["Label"]);
-        
+        if sample.type == "inner":
+            gvxr.addPolygonMeshAsInnerSurface(sample.label);
+        elif sample.type == "outer":
+            gvxr.addPolygonMeshAsOuterSurface(sample.label);
+
         # Change the colour
-        colour = mcolors.to_rgb(colours[colour_id]);
-        
+        colour = colours[colour_id];
+
         # Get the opacity
-        opacity = 1.0
-        if "Opacity" in mesh.keys():
-            opacity = mesh["Opacity"]
-        
-        gvxr.setColour(mesh["Label"], colour[0], colour[1], colour[2], opacity);
+        opacity = sample.opacity
+
+        gvxr.setColour(sample.label, colour[0], colour[1], colour[2], opacity);
         colour_id += 1;
         if colour_id == len(colours):
-            colour_id = 0;
\ No newline at end of file
+            colour_id = 0;
+
+    applied_config["Samples"] = config
+
+
+def applyConfig(config, verbose = 0):
+
+    # Only update what differs from the configuration already set in
+    # gVirtualXRay. The meshes are reloaded only if the structure of the
+    # scene changes (labels, geometry, files, inner/outer surfaces).
+    config = loadConfig(config)
+    changes = []
+
+    # Window
+    previous = applied_config["Window"]
+    if config.window_size is not None and (previous is None or previous.window_size != config.window_size):
+        gvxr.setWindowSize(
+            config.window_size[0],
+            config.window_size[1]
+        );
+        applied_config["Window"] = config
+        changes.append("window size")
+
+    # Source
+    previous = applied_config["Source"]
+    if config.source_position is not None and (previous is None or previous.getSourceKey() != config.getSourceKey()):
+        initSourceGeometry(config)
+        changes.append("source")
+
+    # Spectrum
+    previous = applied_config["Spectrum"]
+    if config.spectrum_type is not None and (previous is None or previous.getSpectrumKey() != config.getSpectrumKey()):
+        initSpectrum(config, verbose)
+        changes.append("spectrum")
+
+    # Detector
+    previous = applied_config["Detector"]
+    if config.detector_position is not None:
+        if previous is None:
+            initDetector(config)
+            changes.append("detector")
+        else:
+            # If an update fails, the detector is set up again by the next call
+            applied_config["Detector"] = None
+
+            if previous.detector_position != config.detector_position:
+                gvxr.setDetectorPosition(
+                    config.detector_position[0],
+                    config.detector_position[1],
+                    config.detector_position[2],
+                    "mm"
+                );
+                changes.append("detector position")
+
+            if previous.detector_up != config.detector_up:
+                gvxr.setDetectorUpVector(
+                    config.detector_up[0],
+                    config.detector_up[1],
+                    config.detector_up[2]
+                );
+                changes.append("detector up vector")
+
+            if previous.detector_number_of_pixels != config.detector_number_of_pixels:
+                gvxr.setDetectorNumberOfPixels(
+                    config.detector_number_of_pixels[0],
+                    config.detector_number_of_pixels[1]
+                );
+                changes.append("detector number of pixels")
+
+            if previous.pixel_spacing != config.pixel_spacing:
+                gvxr.setDetectorPixelSize(
+                    config.pixel_spacing[0],
+                    config.pixel_spacing[1],
+                    "mm"
+                );
+                changes.append("pixel spacing")
+
+            if (previous.energy_response_file, previous.energy_response_unit) != (config.energy_response_file, config.energy_response_unit):
+                gvxr.clearDetectorEnergyResponse()
+                if config.energy_response_file is not None:
+                    gvxr.loadDetectorEnergyResponse(config.energy_response_file,
+                                                    config.energy_response_unit)
+                changes.append("energy response")
+
+            applied_config["Detector"] = config
+
+    # Samples
+    previous = applied_config["Samples"]
+    if config.samples is not None:
+        if previous is None or previous.getSamplesKey() != config.getSamplesKey():
+            initSamples(config, verbose)
+            changes.append("samples")
+        else:
+            colours = COLOURS;
+
+            # If an update fails, the scene is reloaded by the next call
+            applied_config["Samples"] = None
+
+            for colour_id, (old_sample, sample) in enumerate(zip(previous.samples, config.samples)):
+
+                if old_sample.getMaterialKey() != sample.getMaterialKey() or old_sample.density != sample.density:
+                    if sample.material_type is None:
+                        raise IOError("No material for " + sample.label)
+                    setMaterial(sample, verbose)
+                    changes.append("material of " + sample.label)
+
+                if old_sample.transforms != sample.transforms:
+                    # The previous transformation is already applied to the
+                    # vertices, undo it and apply the new one in one go
+                    matrix = np.identity(4)
+                    if sample.transform_matrix is not None:
+                        matrix = sample.transform_matrix
+                    if old_sample.transform_matrix is not None:
+                        matrix = matrix @ np.linalg.inv(old_sample.transform_matrix)
+                    applyTransformMatrix(sample.label, matrix)
+                    changes.append("transformation of " + sample.label)
+
+                if old_sample.opacity != sample.opacity:
+                    colour = colours[colour_id % len(colours)];
+                    gvxr.setColour(sample.label, colour[0], colour[1], colour[2], sample.opacity);
+                    changes.append("opacity of " + sample.label)
+
+            applied_config["Samples"] = config
+
+    if verbose > 0:
+        if len(changes):
+            print("Changes applied:", ", ".join(changes))
+        else:
+            print("No change to apply")
+
+    return changes
+
+
+def runBatch(configs, output_directory, renderer = "EGL", verbose = 0):
+
+    # Simulate one X-ray image per JSON file using the same context.
+    # Only the differences between consecutive configurations are applied
+    # (see applyConfig). Each image is saved as soon as it is computed,
+    # and a line is appended to manifest.jsonl in the output directory.
+    import glob
+    import time
+
+    if type(configs) == str:
+        configs = [configs]
+
+    fnames = []
+    for pattern in configs:
+        matches = sorted(glob.glob(pattern))
+        if not len(matches):
+            raise IOError("No JSON file matches " + pattern)
+        fnames += matches
+
+    os.makedirs(output_directory, exist_ok=True)
+    manifest_fname = os.path.join(output_directory, "manifest.jsonl")
+
+    manifest = []
+    for run_id, fname in enumerate(fnames):
+        record = {"run": run_id, "config": fname}
+        start = time.time()
+
+        try:
+            config = loadConfig(fname, check_files = True)
+
+            if not context_created:
+                initGVXR(config, renderer)
+
+            record["changes"] = applyConfig(config, verbose)
+
+            xray_image = np.array(gvxr.computeXRayImage(), dtype=np.float32)
+
+            image_fname = str(run_id).zfill(5) + "-" + os.path.splitext(os.path.basename(fname))[0] + ".npy"
+            np.save(os.path.join(output_directory, image_fname), xray_image)
+
+            record["image"] = image_fname
+            record["shape"] = list(xray_image.shape)
+        except Exception as error:
+            # Carry on with the next configuration, which is then set up
+            # from scratch as the scene may be partly updated
+            for section in applied_config:
+                applied_config[section] = None
+
+            record["error"] = str(error)
+            print("Cannot simulate", fname + ":", error)
+
+        record["time"] = time.time() - start
+        log("Run", run_id + 1, "/", len(fnames), "(" + fname + ") in", round(record["time"], 3), "s")
+
+        with open(manifest_fname, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+        manifest.append(record)
+
+    return manifest
+
+
+def processCmdLine():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Simulate one X-ray image per JSON file, reusing the same context.')
+    parser.add_argument('configs', help='JSON files or glob patterns (e.g. "sweep/*.json").', nargs='+', type=str)
+    parser.add_argument('--output', help='Directory where the images and manifest.jsonl are written.', type=str, required=True)
+    parser.add_argument('--renderer', help='OpenGL renderer (OPENGL or EGL).', type=str, default="EGL")
+    parser.add_argument('--verbose', help='Print what is being set up.', type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = processCmdLine()
+
+    setVerbosity(args.verbose)
+    manifest = runBatch(args.configs, args.output, args.renderer, args.verbose)
+
+    gvxr.destroyAllWindows()
+
+    if any("error" in record for record in manifest):
+        sys.exit(1)
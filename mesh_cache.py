@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+"""
+Load STL files in parallel into NumPy vertex and index buffers.
+
+The buffers are cached on disk as .npy files (memory-mapped when they are
+read back) and keyed by the path, modification time, size and unit of the
+mesh file, so that a warm cache skips the parsing entirely. The buffers are
+then given to gvxr.makeTriangularMesh.
+"""
+
+import os
+import re
+import hashlib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+# Increase when the layout of the cached buffers changes
+CACHE_VERSION = 1
+
+# Default location of the cache, can be changed with GVXR_MESH_CACHE
+DEFAULT_CACHE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "gvxr-demos", "meshes")
+
+# Record of a binary STL file (normal, 3 vertices, attribute byte count)
+STL_RECORD = np.dtype([
+    ("normal", "<f4", (3,)),
+    ("vertices", "<f4", (3, 3)),
+    ("attribute", "<u2")
+])
+
+ASCII_VERTEX = re.compile(rb"vertex\s+(\S+)\s+(\S+)\s+(\S+)")
+
+
+def getCacheDirectory(cache_directory = None):
+    if cache_directory is None:
+        cache_directory = os.environ.get("GVXR_MESH_CACHE", DEFAULT_CACHE_DIRECTORY)
+    return cache_directory
+
+
+def isSupported(fname):
+    return fname.lower().endswith(".stl")
+
+
+def readSTLFile(fname):
+    """Read a binary or ASCII STL file, return the triangle corners as a (n, 3, 3) float32 array."""
+
+    with open(fname, "rb") as f:
+        data = f.read()
+
+    # A binary file may also start with "solid", rely on its size instead
+    if len(data) >= 84:
+        number_of_triangles = int(np.frombuffer(data, dtype="<u4", count=1, offset=80)[0])
+        if len(data) == 84 + number_of_triangles * STL_RECORD.itemsize:
+            records = np.frombuffer(data, dtype=STL_RECORD, count=number_of_triangles, offset=84)
+            return np.array(records["vertices"], dtype=np.float32)
+
+    if not data.lstrip().startswith(b"solid"):
+        raise IOError("Invalid STL file: " + fname)
+
+    vertices = np.array(ASCII_VERTEX.findall(data), dtype="S").astype(np.float32)
+    if vertices.shape[0] % 3:
+        raise IOError("Invalid STL file (incomplete triangle): " + fname)
+
+    return vertices.reshape((-1, 3, 3))
+
+
+def indexTriangles(triangles):
+    """Merge the duplicated corners, return the vertex (n, 3) and index (m, 3) buffers."""
+
+    corners = triangles.reshape((-1, 3))
+    vertices, indices = np.unique(corners, axis=0, return_inverse=True)
+    return (np.ascontiguousarray(vertices, dtype=np.float32),
+            np.ascontiguousarray(indices.reshape((-1, 3)), dtype=np.int32))
+
+
+def getCacheKey(fname, unit):
+    stat = os.stat(fname)
+    key = "|".join([os.path.abspath(fname), str(stat.st_mtime_ns), str(stat.st_size), unit, str(CACHE_VERSION)])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def saveArray(fname, array):
+    # Write then rename, so that concurrent jobs never read a partial file
+    file_descriptor, temp_fname = tempfile.mkstemp(dir=os.path.dirname(fname), suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, "wb") as f:
+            np.save(f, array)
+        os.replace(temp_fname, fname)
+    except BaseException:
+        if os.path.exists(temp_fname):
+            os.remove(temp_fname)
+        raise
+
+
+def loadMesh(fname, unit, cache_directory = None, use_cache = True):
+    """Return the vertex and index buffers of an STL file, using the cache when possible."""
+
+    if use_cache:
+        cache_directory = getCacheDirectory(cache_directory)
+        key = getCacheKey(fname, unit)
+        vertex_fname = os.path.join(cache_directory, key + "-vertices.npy")
+        index_fname = os.path.join(cache_directory, key + "-indices.npy")
+
+        if os.path.exists(vertex_fname) and os.path.exists(index_fname):
+            try:
+                return (np.load(vertex_fname, mmap_mode="r"),
+                        np.load(index_fname, mmap_mode="r"))
+            except (IOError, ValueError):
+                pass # Corrupted entry, parse the file again
+
+    vertices, indices = indexTriangles(readSTLFile(fname))
+
+    if use_cache:
+        try:
+            os.makedirs(cache_directory, exist_ok=True)
+            saveArray(vertex_fname, vertices)
+            saveArray(index_fname, indices)
+        except OSError as error:
+            print("Cannot cache", fname + ":", error)
+
+    return vertices, indices
+
+
+def loadMeshes(meshes, number_of_threads = None, cache_directory = None, use_cache = True, verbose = 0):
+    """Load a list of (label, fname, unit) in a thread pool.
+
+    Return a dictionary label -> (vertices, indices). Files that are not STL
+    files are not in the dictionary and must be loaded by gVirtualXRay.
+    """
+
+    meshes = [mesh for mesh in meshes if isSupported(mesh[1])]
+    if not len(meshes):
+        return {}
+
+    if number_of_threads is None:
+        number_of_threads = min(len(meshes), os.cpu_count() or 1)
+
+    def load(mesh):
+        label, fname, unit = mesh
+        if verbose > 0:
+            print("\tLoad", label, "in", fname, "using", unit)
+        return label, loadMesh(fname, unit, cache_directory, use_cache)
+
+    with ThreadPoolExecutor(max_workers=number_of_threads) as executor:
+        return dict(executor.map(load, meshes))
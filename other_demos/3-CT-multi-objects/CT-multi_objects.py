@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
 
-# import os, copy
+import os, sys
 import numpy as np
-# dir_path = os.path.dirname(os.path.realpath(__file__))
-#
+dir_path = os.path.dirname(os.path.realpath(__file__))
+
+# Projection writer, preprocessing and poses of the scan shared across the demos (at the top of the repository)
+sys.path.append(os.path.join(dir_path, "..", ".."))
+import acquisition
+import preprocessing
+import trajectory
+
 import math # for pi
 import tomopy # For CT reconstruction
 import SimpleITK as sitk # To save the image
@@ -176,29 +182,33 @@ x_ray_image = gvxr.computeXRayImage();
 # Update the 3D visualisation
 gvxr.displayScene();
 
-projections = [];
 theta = [];
 
 number_of_angles = 1900;
 rotation_angle = 180.0 / number_of_angles;
 
+# Preallocate the stack of projections (in single precision), in a
+# memory-mapped file as it is large
+writer = acquisition.ProjectionWriter(number_of_angles, fname="projections.npy");
+
+# Poses of the model, all computed at once
+poses = trajectory.getCircularPoses(np.arange(number_of_angles) * rotation_angle, (0, 0, -1));
+setPose = trajectory.PoseSetter(gvxr, "root");
+
 for i in range(number_of_angles):
-    # Compute an X-ray image and add it to the list of projections
-    projections.append(gvxr.computeXRayImage());
+    # Rotate the model (absolute pose)
+    setPose(poses[i]);
+
+    # Compute an X-ray image and write it in the stack of projections
+    writer.append(gvxr.computeXRayImage());
 
     # Update the 3D visualisation
     gvxr.displayScene();
 
-    # Rotate the model by 1 degree
-    gvxr.rotateNode("root", rotation_angle, 0, 0, -1);
-
     theta.append(i * rotation_angle * math.pi / 180);
 
-# Convert the projections as a Numpy array
-projections = np.array(projections);
-
-# Perform the flat-field correction of raw data
-dark = np.zeros(projections.shape);
+# Retrieve the projections as a Numpy array
+projections = writer.getProjections();
 
 # Retrieve the total energy
 energy_bins = gvxr.getEnergyBins("MeV");
@@ -207,18 +217,18 @@ photon_count_per_bin = gvxr.getPhotonCountEnergyBins();
 total_energy = 0.0;
 for energy, count in zip(energy_bins, photon_count_per_bin):
     total_energy += energy * count;
-flat = np.ones(projections.shape) * total_energy;
 
-projections = tomopy.normalize(projections, flat, dark)
+# Perform the flat-field correction of raw data (in place, the dark field is null)
+projections = preprocessing.preprocessProjections(projections, flat=total_energy, dark=0.0, minus_log=False)
 
-volume = sitk.GetImageFromArray(projections.astype(np.single));
+volume = sitk.GetImageFromArray(projections);
 volume.SetSpacing([pixel_spacing[0] / gvxr.getUnitOfLength(pixel_spacing[2]),
     pixel_spacing[1] / gvxr.getUnitOfLength(pixel_spacing[2]),
     rotation_angle]);
 sitk.WriteImage(volume, 'projections-tomopy.mhd');
 
-# Calculate  -log(projections)  to linearize transmission tomography data
-projections = tomopy.minus_log(projections)
+# Calculate  -log(projections)  to linearize transmission tomography data (in place)
+projections = preprocessing.preprocessProjections(projections)
 
 # Set the rotation centre
 rot_center = int(projections.shape[2]/2);
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+"""
+Overlap the simulation of X-ray images with their post-processing.
+
+The thread that owns the OpenGL context only computes the images and
+puts them in a bounded queue. The other stages (flat-field correction,
+minus log, compression, writing to disk, frames of an animation...) run
+in their own threads, each stage feeding the next one through another
+bounded queue, so the GPU does not wait for the CPU. The queues limit
+the number of images in memory.
+
+The time spent in each stage is recorded to find the bottleneck.
+"""
+
+import time
+import queue
+import threading
+
+
+# Marks the end of the stream in the queues
+END = None
+
+
+class Stage:
+
+    def __init__(self, name, function, number_of_threads = 1, ordered = False):
+        """function(index, data) returns the data given to the next stage.
+
+        With ordered, the items are processed one at a time in the order
+        they were submitted (e.g. to append frames to an animation).
+        """
+
+        self.name = name
+        self.function = function
+        self.number_of_threads = 1 if ordered else number_of_threads
+        self.ordered = ordered
+
+        self.lock = threading.Lock()
+        self.count = 0
+        self.busy_time = 0.0
+
+    def record(self, runtime):
+        with self.lock:
+            self.count += 1
+            self.busy_time += runtime
+
+    def getStatistics(self):
+        time_per_item = self.busy_time / self.count if self.count else 0.0
+        throughput = self.number_of_threads / time_per_item if time_per_item > 0 else float("inf")
+        return {
+            "stage": self.name,
+            "items": self.count,
+            "threads": self.number_of_threads,
+            "time_per_item": time_per_item,
+            "throughput": throughput
+        }
+
+
+class AcquisitionPipeline:
+
+    def __init__(self, stages, queue_size = 8):
+        self.stages = stages
+        self.render_stage = Stage("render", None)
+        self.queues = [queue.Queue(maxsize=queue_size) for stage in stages]
+        self.threads = []
+        self.errors = []
+        self.aborted = threading.Event()
+        self.sequence = 0
+        self.start_time = None
+        self.runtime = None
+
+    def start(self):
+        self.start_time = time.time()
+
+        for stage_id, stage in enumerate(self.stages):
+            stage.remaining_threads = stage.number_of_threads
+            stage.pending = {}
+            stage.next_sequence = 0
+
+            for thread_id in range(stage.number_of_threads):
+                thread = threading.Thread(target=self.work, args=(stage_id,), name=stage.name + "-" + str(thread_id), daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exception_type, exception, traceback):
+        if exception_type is not None:
+            self.aborted.set()
+        self.close()
+
+    def put(self, stage_id, item):
+        # Blocks while the queue is full, unless the pipeline has been aborted
+        while True:
+            if self.aborted.is_set() and item is not END:
+                return
+            try:
+                self.queues[stage_id].put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def submit(self, index, data):
+        """Give an image (e.g. returned by gvxr.computeXRayImage) to the first stage."""
+
+        self.checkErrors()
+        if len(self.stages):
+            self.put(0, (self.sequence, index, data))
+        self.sequence += 1
+
+    def render(self, index, compute):
+        """Call compute() (in this thread) and submit its result, e.g. render(i, gvxr.computeXRayImage)."""
+
+        start = time.time()
+        data = compute()
+        self.render_stage.record(time.time() - start)
+
+        self.submit(index, data)
+
+    def process(self, stage_id, item):
+        stage = self.stages[stage_id]
+        sequence, index, data = item
+
+        start = time.time()
+        data = stage.function(index, data)
+        stage.record(time.time() - start)
+
+        if stage_id + 1 < len(self.stages):
+            self.put(stage_id + 1, (sequence, index, data))
+
+    def work(self, stage_id):
+        stage = self.stages[stage_id]
+        input_queue = self.queues[stage_id]
+
+        while True:
+            item = input_queue.get()
+            if item is END:
+                break
+
+            # Once aborted, the items are only drained
+            if self.aborted.is_set():
+                continue
+
+            try:
+                if stage.ordered:
+                    # Process the items in the order they were submitted
+                    stage.pending[item[0]] = item
+                    while stage.next_sequence in stage.pending:
+                        self.process(stage_id, stage.pending.pop(stage.next_sequence))
+                        stage.next_sequence += 1
+                else:
+                    self.process(stage_id, item)
+
+            except Exception as error:
+                with stage.lock:
+                    self.errors.append((stage.name, error))
+                self.aborted.set()
+
+        # The last thread of the stage ends the next stage
+        with stage.lock:
+            stage.remaining_threads -= 1
+            last_thread = stage.remaining_threads == 0
+
+        if last_thread and stage_id + 1 < len(self.stages):
+            for thread_id in range(self.stages[stage_id + 1].number_of_threads):
+                self.put(stage_id + 1, END)
+
+    def checkErrors(self):
+        if len(self.errors):
+            stage, error = self.errors[0]
+            raise RuntimeError("Stage '" + stage + "' failed: " + str(error)) from error
+
+    def close(self):
+        """Wait until all the images have been processed by all the stages."""
+
+        if len(self.stages):
+            for thread_id in range(self.stages[0].number_of_threads):
+                self.put(0, END)
+
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+        if self.start_time is not None and self.runtime is None:
+            self.runtime = time.time() - self.start_time
+
+        self.checkErrors()
+
+    def getStatistics(self):
+        return [stage.getStatistics() for stage in [self.render_stage] + self.stages]
+
+    def printStatistics(self):
+        statistics = self.getStatistics()
+
+        if self.runtime is not None:
+            print("Pipeline:", self.sequence, "images in", round(self.runtime, 3), "s")
+
+        for record in statistics:
+            print("\t{:<16} {:>6} items {:>10.3f} ms/item {:>10.1f} items/s ({} thread(s))".format(
+                record["stage"],
+                record["items"],
+                record["time_per_item"] * 1000.0,
+                record["throughput"],
+                record["threads"]))
+
+        # The stage with the lowest throughput limits the whole pipeline
+        measured = [record for record in statistics if record["items"]]
+        if len(measured):
+            print("\tBottleneck:", min(measured, key=lambda record: record["throughput"])["stage"])
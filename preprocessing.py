@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+"""
+Prepare simulated projections for CT reconstruction, in place.
+
+The flat-field correction, the clipping of the small values, the minus log
+and the scaling by the pixel size are applied in one pass over chunks of
+projections, in single precision, without allocating full-size flat or
+dark fields nor intermediate copies of the stack. The chunks can be
+processed by several threads, as NumPy releases the GIL.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+# Size of the chunks processed at once by a thread
+DEFAULT_CHUNK_SIZE_IN_BYTES = 16 * 1024 * 1024
+
+
+def getField(value, image_shape):
+    # Scalar or per-pixel (rows, columns) field, in single precision
+    field = np.asarray(value, dtype=np.float32)
+    try:
+        shape = np.broadcast_shapes(field.shape, image_shape)
+    except ValueError:
+        shape = None
+
+    if field.ndim > 2 or shape != tuple(image_shape):
+        raise ValueError("The shape of the flat/dark field " + str(field.shape) + " does not match the projections " + str(tuple(image_shape)))
+    return field
+
+
+def preprocessProjections(projections, flat = 1.0, dark = 0.0, minus_log = True, pixel_size = None, threshold = 1e-9,
+                          chunk_size = None, number_of_threads = None, sinogram_order = False):
+    """Compute -log((projections - dark) / (flat - dark)) / pixel_size in place and return the projections.
+
+    projections is a (angles, rows, columns) stack (e.g. a memory-mapped
+    array). It is converted to single precision first if needed, in which
+    case a new array is returned. flat and dark are scalars or (rows, columns)
+    images. The values below threshold are clipped before the log (they may
+    be null or negative, e.g. with phase contrast); use None to disable it.
+    Without minus_log, only the flat-field correction is applied. pixel_size
+    is given in the unit of length expected by the reconstruction (e.g. cm
+    to reconstruct linear attenuation coefficients in cm-1). With
+    sinogram_order, projections is a (rows, angles, columns) stack and it is
+    processed in chunks of rows.
+    """
+
+    if not isinstance(projections, np.ndarray) or projections.dtype != np.float32 or not projections.flags.writeable:
+        projections = np.array(projections, dtype=np.float32)
+
+    stack = projections
+    if projections.ndim == 2:
+        stack = projections[np.newaxis]
+
+    if sinogram_order:
+        image_shape = (stack.shape[0], stack.shape[2])
+    else:
+        image_shape = stack.shape[1:]
+
+    dark = getField(dark, image_shape)
+    flat = getField(flat, image_shape)
+
+    # Skip the operations that would not change anything
+    subtract_dark = np.any(dark != 0)
+    scale = None
+    if np.any(flat - dark != 1):
+        scale = np.float32(1) / (flat - dark)
+
+    if minus_log and pixel_size is not None:
+        log_scale = np.float32(-1.0 / pixel_size)
+    else:
+        log_scale = np.float32(-1.0)
+
+    if sinogram_order:
+        # One row of the fields per sinogram, e.g. (rows, 1, columns)
+        if dark.ndim == 2:
+            dark = dark[:, np.newaxis]
+        if scale is not None and scale.ndim == 2:
+            scale = scale[:, np.newaxis]
+
+    def getRows(field, rows):
+        # Part of a field used by the chunk of sinograms
+        if sinogram_order and field.ndim == 3:
+            return field[rows]
+        return field
+
+    def process(rows):
+        chunk = stack[rows]
+
+        if subtract_dark:
+            np.subtract(chunk, getRows(dark, rows), out=chunk)
+
+        if scale is not None:
+            np.multiply(chunk, getRows(scale, rows), out=chunk)
+
+        if minus_log:
+            if threshold is not None:
+                np.maximum(chunk, np.float32(threshold), out=chunk)
+
+            np.log(chunk, out=chunk)
+            np.multiply(chunk, log_scale, out=chunk)
+
+    # Number of projections (or sinograms) per chunk
+    if chunk_size is None:
+        chunk_size = max(1, DEFAULT_CHUNK_SIZE_IN_BYTES // max(1, stack[0].nbytes))
+
+    chunks = [slice(start, start + chunk_size) for start in range(0, stack.shape[0], chunk_size)]
+
+    if number_of_threads is None:
+        number_of_threads = os.cpu_count() or 1
+    number_of_threads = max(1, min(number_of_threads, len(chunks)))
+
+    if number_of_threads == 1:
+        for chunk in chunks:
+            process(chunk)
+    else:
+        with ThreadPoolExecutor(max_workers=number_of_threads) as executor:
+            list(executor.map(process, chunks))
+
+    if isinstance(projections, np.memmap):
+        projections.flush()
+
+    return projections
+
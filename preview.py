@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+"""
+Visualisation during a CT acquisition: none at all in headless mode, and
+preview frames captured at a given cadence.
+
+The settings come from the optional "Acquisition" section of a JSON file:
+
+    "Acquisition": {
+        "Headless": true,
+        "PreviewEvery": 30,
+        "PreviewFile": "CT_acquisition.gif"
+    }
+
+In headless mode, the 3D scene is only rendered when a preview frame is
+captured. The frames are taken straight from gvxr.takeScreenshot() and
+appended to the GIF file by a background thread, so the acquisition loop
+does not wait for the encoder.
+"""
+
+import os
+import json
+
+import numpy as np
+
+import pipeline
+
+
+class AcquisitionSettings:
+
+    def __init__(self, acquisition = None):
+        """Parse the "Acquisition" section of a JSON file (a dictionary, or None for the defaults)."""
+
+        if acquisition is None:
+            acquisition = {}
+
+        self.headless = bool(acquisition.get("Headless", False))
+
+        # Renderer used to create the OpenGL context
+        self.renderer = acquisition.get("Renderer", "EGL" if self.headless else "OPENGL")
+        if self.renderer not in ["OPENGL", "EGL"]:
+            raise IOError("Unknown renderer: " + str(self.renderer))
+
+        # 0 to capture no preview frame
+        self.preview_every = int(acquisition.get("PreviewEvery", 0))
+        if self.preview_every < 0:
+            raise IOError("Invalid number of projections between preview frames: " + str(acquisition["PreviewEvery"]))
+
+        self.preview_fname = acquisition.get("PreviewFile", None)
+
+
+def loadSettings(fname):
+    """Read the "Acquisition" section of a JSON file, the defaults are used if the file does not exist."""
+
+    if not os.path.exists(fname):
+        return AcquisitionSettings()
+
+    with open(fname) as f:
+        return AcquisitionSettings(json.load(f).get("Acquisition", None))
+
+
+class PreviewRecorder:
+
+    def __init__(self, gvxr, settings, fname = None):
+        """Update the visualisation during the acquisition and record the preview frames in fname (or PreviewFile)."""
+
+        self.gvxr = gvxr
+        self.headless = settings.headless
+        self.every = settings.preview_every
+
+        self.fname = settings.preview_fname
+        if self.fname is None:
+            self.fname = fname
+
+        self.writer = None
+        self.pipeline = None
+
+        if self.fname is not None and self.every > 0:
+            import imageio
+
+            self.writer = imageio.get_writer(self.fname, mode="I")
+            self.pipeline = pipeline.AcquisitionPipeline([pipeline.Stage("preview", self.encode, ordered=True)], queue_size=4)
+            self.pipeline.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        self.close()
+
+    def update(self, index):
+        """Call after the index-th projection."""
+
+        capture = self.pipeline is not None and index % self.every == 0
+
+        # The scene is rendered for the preview frames only in headless mode
+        if not self.headless or capture:
+            self.gvxr.displayScene()
+
+        if capture:
+            self.pipeline.render(index, self.gvxr.takeScreenshot)
+
+    def encode(self, index, screenshot):
+        frame = np.asarray(screenshot)
+
+        # RGB values between 0 and 1
+        if frame.dtype != np.uint8:
+            frame = np.clip(np.rint(frame * 255.0), 0, 255).astype(np.uint8)
+
+        self.writer.append_data(frame)
+
+    def close(self):
+        if self.pipeline is not None:
+            try:
+                self.pipeline.close()
+            finally:
+                self.writer.close()
+                self.pipeline = None
+                self.writer = None
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+"""
+Compute projections with several processes, each owning its own gvxr
+context built from the same JSON file.
+
+The scheduler hands out chunks of angles (or configuration variants) to
+the workers and gathers the images into one projection stack, in memory
+or in a memory-mapped .npy file written directly by the workers.
+
+The workers are spawned (not forked) so that no OpenGL state is shared.
+Set GVXR_MODULE to use a stub of gvxrPython3 on machines without a GPU.
+"""
+
+import os
+import math
+import time
+import argparse
+import traceback
+import multiprocessing
+
+import numpy as np
+
+import json2gvxr # gvxrPython3 is only imported when first used, i.e. in the workers
+import trajectory
+
+
+# State of the current worker process
+worker_state = {}
+
+
+def initWorker(config_fname, renderer, gpus, node, output_fname, worker_ids):
+
+    # An exception in the initializer would make the pool restart the worker
+    # forever, it is raised by the first task instead
+    worker_state["error"] = None
+    try:
+        setUpWorker(config_fname, renderer, gpus, node, output_fname, worker_ids.get())
+    except Exception:
+        worker_state["error"] = traceback.format_exc()
+
+
+def setUpWorker(config_fname, renderer, gpus, node, output_fname, worker_id):
+
+    # Choose the GPU before gVirtualXRay is imported
+    if gpus is not None and len(gpus):
+        os.environ["CUDA_VISIBLE_DEVICES"] = str(gpus[worker_id % len(gpus)])
+
+    json2gvxr.initGVXR(config_fname, renderer)
+    json2gvxr.initSourceGeometry()
+    json2gvxr.initSpectrum()
+    json2gvxr.initDetector()
+    json2gvxr.initSamples()
+
+    worker_state["worker_id"] = worker_id
+    worker_state["gvxr"] = json2gvxr.gvxr
+    worker_state["set_pose"] = trajectory.PoseSetter(json2gvxr.gvxr, node)
+    worker_state["output"] = None
+
+    if output_fname is not None:
+        worker_state["output"] = np.load(output_fname, mmap_mode="r+")
+
+
+def checkWorker():
+    if worker_state["error"] is not None:
+        raise RuntimeError("The worker could not be initialised:\n" + worker_state["error"])
+
+
+def computeImage():
+    return np.array(worker_state["gvxr"].computeXRayImage(), dtype=np.float32)
+
+
+def storeImages(indices, images):
+    # Write into the shared file, or send the images back to the scheduler
+    output = worker_state["output"]
+    if output is None:
+        return indices, np.array(images)
+
+    for index, image in zip(indices, images):
+        output[index] = image
+    output.flush()
+    return indices, None
+
+
+def computePoses(task):
+
+    # The poses are absolute (relative to the initial transformation of
+    # the node), so the chunks can be computed in any order
+    checkWorker()
+    indices, poses = task
+
+    images = []
+    for pose in poses:
+        worker_state["set_pose"](pose)
+        images.append(computeImage())
+
+    return (worker_state["worker_id"],) + storeImages(indices, images)
+
+
+def computeVariants(task):
+
+    # Only the differences with the previous variant are applied
+    checkWorker()
+    indices, config_fnames = task
+
+    images = []
+    for config_fname in config_fnames:
+        json2gvxr.applyConfig(config_fname)
+        images.append(computeImage())
+
+    return (worker_state["worker_id"],) + storeImages(indices, images)
+
+
+def getImageShape(config_fname):
+    config = json2gvxr.loadConfig(config_fname)
+    if config.detector_position is None:
+        raise IOError("No 'Detector' in " + config_fname)
+    return (config.detector_number_of_pixels[1], config.detector_number_of_pixels[0])
+
+
+def runFarm(config_fname, tasks, function, number_of_images, number_of_workers = None, chunk_size = None,
+            renderer = "EGL", gpus = None, node = "root", output_fname = None, verbose = 0):
+
+    if number_of_workers is None:
+        number_of_workers = os.cpu_count() or 1
+
+    if chunk_size is None:
+        # A few chunks per worker to balance the load
+        chunk_size = max(1, math.ceil(number_of_images / (4 * number_of_workers)))
+
+    shape = (number_of_images,) + getImageShape(config_fname)
+
+    # The workers write directly in the output file
+    if output_fname is not None:
+        projections = np.lib.format.open_memmap(output_fname, mode="w+", dtype=np.float32, shape=shape)
+    else:
+        projections = np.zeros(shape, dtype=np.float32)
+
+    chunks = []
+    for start in range(0, number_of_images, chunk_size):
+        indices = list(range(start, min(start + chunk_size, number_of_images)))
+        chunks.append((indices, [tasks[index] for index in indices]))
+
+    context = multiprocessing.get_context("spawn")
+    start_time = time.time()
+    images_per_worker = [0] * number_of_workers
+
+    with context.Manager() as manager:
+        worker_ids = manager.Queue()
+        for worker_id in range(number_of_workers):
+            worker_ids.put(worker_id)
+
+        with context.Pool(number_of_workers,
+                          initializer=initWorker,
+                          initargs=(config_fname, renderer, gpus, node, output_fname, worker_ids)) as pool:
+
+            done = 0
+            for worker_id, indices, images in pool.imap_unordered(function, chunks):
+                if images is not None:
+                    projections[indices] = images
+
+                done += len(indices)
+                images_per_worker[worker_id] += len(indices)
+
+                if verbose > 0:
+                    print("Projections:", done, "/", number_of_images)
+
+    if output_fname is not None:
+        projections.flush()
+
+    if verbose > 0:
+        runtime = time.time() - start_time
+        print("Computed", number_of_images, "images in", round(runtime, 3), "s with", number_of_workers, "workers")
+        for worker_id, count in enumerate(images_per_worker):
+            print("\tWorker", worker_id, "computed", count, "images")
+
+    return projections
+
+
+def acquireProjections(config_fname, angles, number_of_workers = None, chunk_size = None, renderer = "EGL", gpus = None,
+                       node = "root", axis = (0, 0, -1), output_fname = None, verbose = 0):
+    """Compute one projection per angle (in degrees) and return the stack (angles, rows, columns)."""
+
+    poses = trajectory.getCircularPoses(angles, axis)
+    return acquireTrajectory(config_fname, poses, number_of_workers, chunk_size, renderer, gpus, node, output_fname, verbose)
+
+
+def acquireTrajectory(config_fname, poses = None, number_of_workers = None, chunk_size = None, renderer = "EGL", gpus = None,
+                      node = None, output_fname = None, verbose = 0):
+    """Compute one projection per 4x4 pose and return the stack (poses, rows, columns).
+
+    By default, the poses and the node are given by the "Scan" section of the configuration.
+    """
+
+    if poses is None or node is None:
+        config = json2gvxr.loadConfig(config_fname)
+        if poses is None:
+            poses = trajectory.getPoses(config)
+        if node is None:
+            node = config.scan_node if config.scan_type is not None else "root"
+
+    poses = np.asarray(poses, dtype=np.float64).reshape((-1, 4, 4))
+    return runFarm(config_fname, poses, computePoses, len(poses), number_of_workers, chunk_size,
+                   renderer, gpus, node, output_fname, verbose)
+
+
+def simulateVariants(config_fname, variant_fnames, number_of_workers = None, chunk_size = None, renderer = "EGL",
+                     gpus = None, output_fname = None, verbose = 0):
+    """Compute one image per configuration variant and return the stack (variants, rows, columns).
+
+    All the variants must use the same number of detector pixels as config_fname.
+    """
+
+    return runFarm(config_fname, list(variant_fnames), computeVariants, len(variant_fnames), number_of_workers,
+                   chunk_size, renderer, gpus, output_fname = output_fname, verbose = verbose)
+
+
+def processCmdLine():
+    parser = argparse.ArgumentParser(description='Compute a CT projection stack with several gvxr processes.')
+    parser.add_argument('--input', help='JSON file of the simulation.', type=str, required=True)
+    parser.add_argument('--output', help='Output .npy file (angles, rows, columns).', type=str, required=True)
+    parser.add_argument('--angles', help='Number of projections (by default, the "Scan" section of the JSON file is used).', type=int, default=None)
+    parser.add_argument('--last_angle', help='Last angle of the scan in degrees (excluded).', type=float, default=360.0)
+    parser.add_argument('--workers', help='Number of processes.', type=int, default=None)
+    parser.add_argument('--gpus', help='GPU IDs given to the workers in turn.', nargs='*', type=int, default=None)
+    parser.add_argument('--renderer', help='OpenGL renderer (OPENGL or EGL).', type=str, default="EGL")
+    parser.add_argument('--verbose', help='Print the progress.', type=int, default=1)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = processCmdLine()
+
+    if args.angles is not None:
+        angles = trajectory.getAngles(args.angles, final_angle=args.last_angle)
+        acquireProjections(args.input, angles, args.workers, renderer=args.renderer, gpus=args.gpus,
+                           output_fname=args.output, verbose=args.verbose)
+    else:
+        acquireTrajectory(args.input, number_of_workers=args.workers, renderer=args.renderer, gpus=args.gpus,
+                          output_fname=args.output, verbose=args.verbose)
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+
+"""
+Reconstruct a CT volume slice by slice with several processes.
+
+The sinograms are copied once into shared memory, and the workers write
+the slices they reconstruct directly into a volume preallocated in shared
+memory, so no image is sent through the pipes of the pool. The slices are
+handed out in chunks, and each slice is reconstructed by the same function
+on the same data as in a serial loop, so the volume is identical.
+
+The workers are forked when possible, so that the reconstruction function
+can be defined in the calling script.
+
+Volumes larger than the memory can be reconstructed out of core: slabs of
+sinograms are read from a memory-mapped file (the next slab is read while
+the current one is reconstructed, unless processes are forked), and the slices are written into a
+memory-mapped volume (a .raw file with its MHD header), so that only a few
+slabs are in memory at any time, within a given budget.
+"""
+
+import os
+import math
+import time
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import fbp # Engine of the out-of-core FBP
+import sart # Engine of the out-of-core SART
+
+
+# Memory used by the slabs of an out-of-core reconstruction by default
+DEFAULT_MEMORY_BUDGET_IN_BYTES = 2 * 1024 * 1024 * 1024
+
+METAIMAGE_TYPES = {
+    "uint8": "MET_UCHAR",
+    "int8": "MET_CHAR",
+    "uint16": "MET_USHORT",
+    "int16": "MET_SHORT",
+    "uint32": "MET_UINT",
+    "int32": "MET_INT",
+    "float32": "MET_FLOAT",
+    "float64": "MET_DOUBLE"
+}
+
+
+# State of the current worker process
+worker_state = {}
+
+
+def getContext():
+    # Forked workers inherit the functions of the calling script (which is
+    # not run again in each worker, as it would be if they were spawned)
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context("spawn")
+
+
+def createSharedArray(shape, dtype):
+    dtype = np.dtype(dtype)
+    memory = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+    return memory, np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+
+
+def attachSharedArray(name, shape, dtype):
+    # The pool shares the resource tracker of its parent, which unlinks the
+    # block, so the workers can attach to it as usual
+    memory = shared_memory.SharedMemory(name=name)
+    return memory, np.ndarray(shape, dtype=np.dtype(dtype), buffer=memory.buf)
+
+
+def initWorker(function, input_description, output_description):
+    worker_state["function"] = function
+    worker_state["input_memory"], worker_state["input"] = attachSharedArray(*input_description)
+    worker_state["output_memory"], worker_state["output"] = attachSharedArray(*output_description)
+
+
+def reconstructChunk(chunk):
+    start, stop = chunk
+    function = worker_state["function"]
+    sinograms = worker_state["input"]
+    volume = worker_state["output"]
+
+    for slice_id in range(start, stop):
+        volume[slice_id] = function(sinograms[slice_id])
+
+    return stop - start
+
+
+def reconstructSlices(sinograms, function, number_of_workers = None, chunk_size = None, verbose = 0):
+    """Return the volume made of function(sinograms[i]) for each sinogram.
+
+    sinograms is a (rows, angles, columns) stack (see
+    acquisition.ProjectionWriter with sinogram_order). The first slice is
+    reconstructed by the calling process to know the shape and type of the
+    slices. The other slices are reconstructed by number_of_workers
+    processes (by default, one per core), chunk_size slices at a time (by
+    default, about four chunks per worker).
+    """
+
+    sinograms = np.asarray(sinograms)
+    number_of_slices = len(sinograms)
+    if number_of_slices == 0:
+        raise ValueError("No sinogram to reconstruct")
+
+    if number_of_workers is None:
+        number_of_workers = os.cpu_count() or 1
+    number_of_workers = max(1, min(number_of_workers, number_of_slices - 1))
+
+    if chunk_size is None:
+        chunk_size = max(1, math.ceil((number_of_slices - 1) / (4 * number_of_workers)))
+
+    start_time = time.time()
+
+    # The first slice gives the shape and type of the volume
+    first_slice = np.asarray(function(sinograms[0]))
+
+    if number_of_workers == 1 or number_of_slices == 1:
+        volume = np.empty((number_of_slices,) + first_slice.shape, dtype=first_slice.dtype)
+        volume[0] = first_slice
+        for slice_id in range(1, number_of_slices):
+            volume[slice_id] = function(sinograms[slice_id])
+            if verbose:
+                print("Reconstructed slice", slice_id + 1, "/", number_of_slices)
+        return volume
+
+    input_memory, shared_sinograms = createSharedArray(sinograms.shape, sinograms.dtype)
+    output_memory, shared_volume = createSharedArray((number_of_slices,) + first_slice.shape, first_slice.dtype)
+
+    try:
+        shared_sinograms[:] = sinograms
+        shared_volume[0] = first_slice
+
+        chunks = [(start, min(start + chunk_size, number_of_slices)) for start in range(1, number_of_slices, chunk_size)]
+
+        context = getContext()
+        with context.Pool(number_of_workers, initWorker,
+                          (function,
+                           (input_memory.name, shared_sinograms.shape, shared_sinograms.dtype.str),
+                           (output_memory.name, shared_volume.shape, shared_volume.dtype.str))) as pool:
+
+            done = 1
+            for count in pool.imap_unordered(reconstructChunk, chunks):
+                done += count
+                if verbose:
+                    print("Reconstructed", done, "/", number_of_slices, "slices in", round(time.time() - start_time, 3), "s")
+
+        # Copy the volume out of the shared memory, which is released below
+        volume = np.array(shared_volume)
+
+    finally:
+        del shared_sinograms, shared_volume
+        for memory in [input_memory, output_memory]:
+            memory.close()
+            memory.unlink()
+
+    return volume
+
+
+def writeMetaImageHeader(fname, shape, dtype, spacing, data_fname):
+    """Write the MHD header of a (slices, rows, columns) raw volume, spacing along (X, Y, Z) in mm."""
+
+    dtype = np.dtype(dtype)
+    if dtype.name not in METAIMAGE_TYPES:
+        raise ValueError("Unsupported type for a MetaImage: " + dtype.name)
+
+    with open(fname, "w") as f:
+        f.write("ObjectType = Image\n")
+        f.write("NDims = 3\n")
+        f.write("BinaryData = True\n")
+        f.write("BinaryDataByteOrderMSB = " + str(dtype.byteorder == ">") + "\n")
+        f.write("CompressedData = False\n")
+        f.write("TransformMatrix = 1 0 0 0 1 0 0 0 1\n")
+        f.write("Offset = 0 0 0\n")
+        f.write("ElementSpacing = " + " ".join(str(float(value)) for value in spacing) + "\n")
+        f.write("DimSize = " + " ".join(str(int(value)) for value in shape[::-1]) + "\n")
+        f.write("ElementType = " + METAIMAGE_TYPES[dtype.name] + "\n")
+        f.write("ElementDataFile = " + os.path.basename(data_fname) + "\n")
+
+
+def createVolume(fname, shape, spacing = (1.0, 1.0, 1.0), dtype = np.float32):
+    """Create fname (.mhd) and its .raw file, and return the raw data memory-mapped as a (slices, rows, columns) array."""
+
+    data_fname = os.path.splitext(fname)[0] + ".raw"
+    writeMetaImageHeader(fname, shape, dtype, spacing, data_fname)
+    return np.memmap(data_fname, mode="w+", dtype=dtype, shape=tuple(shape))
+
+
+def reconstructOutOfCore(sinograms, reconstruct, slice_shape, output_fname, spacing = (1.0, 1.0, 1.0),
+                         memory_budget = DEFAULT_MEMORY_BUDGET_IN_BYTES, working_memory = 0,
+                         bytes_per_slice = 0, dtype = np.float32, prefetch = True, verbose = 0):
+    """Reconstruct the (rows, angles, columns) sinograms slab by slab into output_fname (.mhd and .raw).
+
+    sinograms is a memory-mapped array (or the name of a .npy file).
+    reconstruct(sinogram_slab, volume_slab) writes the slices of a slab
+    of sinograms into the given slab of the volume. The size of the slabs
+    is chosen so that two slabs of sinograms (the current one and the next
+    one, being read), a slab of slices and bytes_per_slice of working
+    memory per slice fit in memory_budget, besides working_memory used
+    whatever the size of the slabs. Without prefetch, the slabs are read
+    in turn, and no other thread runs during reconstruct (e.g. if it forks
+    processes). Return the memory-mapped volume.
+    """
+
+    if isinstance(sinograms, str):
+        sinograms = np.load(sinograms, mmap_mode="r")
+
+    number_of_slices = sinograms.shape[0]
+    volume = createVolume(output_fname, (number_of_slices,) + tuple(slice_shape), spacing, dtype)
+
+    slice_size = (2 * np.prod(sinograms.shape[1:]) * 4 +
+                  np.prod(slice_shape) * np.dtype(dtype).itemsize +
+                  bytes_per_slice)
+    slab_size = int(max(1, min(number_of_slices, (memory_budget - working_memory) // slice_size)))
+
+    if verbose:
+        print("Out-of-core reconstruction:", number_of_slices, "slices by slabs of", slab_size)
+
+    slabs = [slice(start, min(start + slab_size, number_of_slices)) for start in range(0, number_of_slices, slab_size)]
+
+    def readSlab(slab):
+        return np.array(sinograms[slab], dtype=np.float32)
+
+    def readSlabs():
+        if not prefetch:
+            for slab in slabs:
+                yield slab, readSlab(slab)
+            return
+
+        # The next slab is read while the current one is reconstructed
+        with ThreadPoolExecutor(max_workers=1) as reader:
+            next_slab = reader.submit(readSlab, slabs[0])
+
+            for slab_id, slab in enumerate(slabs):
+                sinogram_slab = next_slab.result()
+                if slab_id + 1 < len(slabs):
+                    next_slab = reader.submit(readSlab, slabs[slab_id + 1])
+                yield slab, sinogram_slab
+
+    start_time = time.time()
+
+    for slab, sinogram_slab in readSlabs():
+        reconstruct(sinogram_slab, volume[slab])
+        del sinogram_slab
+
+        # Write the slices to the disk to release their pages
+        volume.flush()
+
+        if verbose:
+            print("Reconstructed", slab.stop, "/", number_of_slices, "slices in", round(time.time() - start_time, 3), "s")
+
+    return volume
+
+
+def reconstructSlicesOutOfCore(sinograms, function, slice_shape, output_fname, spacing = (1.0, 1.0, 1.0),
+                               memory_budget = DEFAULT_MEMORY_BUDGET_IN_BYTES, number_of_workers = None,
+                               verbose = 0):
+    """Out-of-core reconstruction of (rows, angles, columns) sinograms by function(sinogram) in a process pool (see reconstructSlices).
+
+    The workers are forked, so the slabs are not read in the background.
+    """
+
+    if isinstance(sinograms, str):
+        sinograms = np.load(sinograms, mmap_mode="r")
+
+    # Copies of reconstructSlices: the sinograms and the slices in shared
+    # memory, and the slices returned (function may return them in double
+    # precision, e.g. iradon)
+    bytes_per_slice = np.prod(sinograms.shape[1:]) * 4 + 2 * np.prod(slice_shape) * 8
+
+    def reconstruct(sinogram_slab, volume_slab):
+        volume_slab[...] = reconstructSlices(sinogram_slab, function, number_of_workers)
+
+    return reconstructOutOfCore(sinograms, reconstruct, slice_shape, output_fname, spacing, memory_budget,
+                                bytes_per_slice=bytes_per_slice, prefetch=False, verbose=verbose)
+
+
+def reconstructFBPOutOfCore(sinograms, angles, output_fname, spacing = (1.0, 1.0, 1.0),
+                            memory_budget = DEFAULT_MEMORY_BUDGET_IN_BYTES, output_size = None, circle = True,
+                            filter_name = "ramp", number_of_threads = None, verbose = 0):
+    """Out-of-core FBP (see fbp.FBP) of memory-mapped (rows, angles, columns) sinograms, angles in degrees."""
+
+    if isinstance(sinograms, str):
+        sinograms = np.load(sinograms, mmap_mode="r")
+
+    if number_of_threads is None:
+        number_of_threads = os.cpu_count() or 1
+
+    # The interpolation tables use at most half of the budget
+    engine = fbp.FBP(angles, sinograms.shape[2], output_size, circle, filter_name,
+                     max_table_size=min(fbp.DEFAULT_TABLE_SIZE_IN_BYTES, memory_budget // 2))
+
+    working_memory = number_of_threads * 4 * fbp.DEFAULT_CHUNK_SIZE_IN_BYTES
+    if engine.tables is not None:
+        working_memory += len(engine.angles) * len(engine.pixels) * 8
+
+    def reconstruct(sinogram_slab, volume_slab):
+        engine.reconstruct(sinogram_slab, volume_slab, number_of_threads=number_of_threads)
+
+    return reconstructOutOfCore(sinograms, reconstruct, (engine.output_size, engine.output_size), output_fname, spacing,
+                                memory_budget, working_memory, verbose=verbose)
+
+
+def reconstructSARTOutOfCore(sinograms, angles, output_fname, spacing = (1.0, 1.0, 1.0),
+                             memory_budget = DEFAULT_MEMORY_BUDGET_IN_BYTES, output_size = None, circle = True,
+                             number_of_subsets = 10, max_iterations = 10, tolerance = 1e-3, relaxation = 1.0,
+                             clip = None, number_of_threads = None, verbose = 0):
+    """Out-of-core ordered-subset SART (see sart.SART) of memory-mapped (rows, angles, columns) sinograms, angles in degrees."""
+
+    if isinstance(sinograms, str):
+        sinograms = np.load(sinograms, mmap_mode="r")
+
+    if number_of_threads is None:
+        number_of_threads = os.cpu_count() or 1
+
+    # The matrices and the interpolation tables of the warm start use at
+    # most a quarter of the budget each
+    engine = sart.SART(angles, sinograms.shape[2], output_size, circle, number_of_subsets,
+                       max_matrix_size=min(sart.DEFAULT_MATRIX_SIZE_IN_BYTES, memory_budget // 4))
+
+    working_memory = engine.getMemorySize() + number_of_threads * 4 * sart.DEFAULT_CHUNK_SIZE_IN_BYTES
+
+    def reconstruct(sinogram_slab, volume_slab):
+        engine.reconstruct(sinogram_slab, volume_slab, max_iterations=max_iterations, tolerance=tolerance,
+                           relaxation=relaxation, clip=clip, number_of_threads=number_of_threads, verbose=verbose)
+
+    return reconstructOutOfCore(sinograms, reconstruct, (engine.output_size, engine.output_size), output_fname, spacing,
+                                memory_budget, working_memory, engine.getBytesPerSlice(), verbose=verbose)
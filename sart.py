@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+
+"""
+Iterative reconstruction (parallel beam) of a whole stack of sinograms by
+ordered-subset SART, or SIRT with a single subset.
+
+skimage.transform.iradon_sart updates one slice after each projection,
+and rebuilds the weights of each ray at each call. Here, the geometry is
+the same for every row of the detector, so:
+
+- the weights between the rays and the pixels of the output grid are
+  stored once in sparse matrices, one per subset of angles. They are the
+  linear interpolation weights of the back-projection of fbp.py, so the
+  back-projection is exactly the transpose of the projection;
+- each subset updates all the slices at once: the slices are the columns
+  of a dense matrix, multiplied by the sparse matrix of the subset.
+
+The iterations start from the FBP of the sinograms (see fbp.py), and stop
+when the residual does not decrease anymore (or after a given number of
+iterations). The run time and the residual of each iteration are kept in
+SART.history.
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import scipy.sparse
+
+import fbp # Grid of the slices and warm start
+
+
+# The matrices of the subsets are cached if they are smaller than this,
+# otherwise they are recomputed for each subset at each iteration
+DEFAULT_MATRIX_SIZE_IN_BYTES = 1024 * 1024 * 1024
+
+# Size of the slabs of slices updated at once by a thread
+DEFAULT_CHUNK_SIZE_IN_BYTES = 16 * 1024 * 1024
+
+
+class SART:
+
+    def __init__(self, angles, detector_width, output_size = None, circle = True, number_of_subsets = 10,
+                 filter_name = "ramp", max_matrix_size = DEFAULT_MATRIX_SIZE_IN_BYTES):
+        """Reconstruction of sinograms of detector_width pixels at the given angles (in degrees).
+
+        The grid of the slices is the one of fbp.FBP (and of iradon). The
+        angles are split in number_of_subsets interleaved subsets (SIRT if
+        there is only one). filter_name is the filter of the warm start.
+        The interpolation tables of the FBP are also cached if they are
+        smaller than max_matrix_size.
+        """
+
+        # FBP of the warm start, which gives the pixels of the grid
+        self.fbp = fbp.FBP(angles, detector_width, output_size, circle, filter_name, max_table_size=max_matrix_size)
+
+        self.angles = self.fbp.angles
+        self.detector_width = self.fbp.detector_width
+        self.output_size = self.fbp.output_size
+        self.circle = circle
+        self.pixels = self.fbp.pixels
+
+        number_of_subsets = max(1, min(int(number_of_subsets), len(self.angles)))
+        self.subsets = [np.arange(subset_id, len(self.angles), number_of_subsets) for subset_id in range(number_of_subsets)]
+
+        # Memory used by the matrices, two weights per pixel and per angle
+        # (float32 values and int32 indices)
+        self.matrix_size = len(self.angles) * len(self.pixels) * 2 * 8
+
+        # Inverse of the sums of the weights of each ray and of each pixel
+        self.matrices = []
+        self.ray_weights = []
+        self.pixel_weights = []
+        for subset_id in range(number_of_subsets):
+            matrix = self.computeMatrix(subset_id)
+            if self.matrix_size <= max_matrix_size:
+                self.matrices.append(matrix)
+            self.ray_weights.append(invert(np.asarray(matrix.sum(axis=1), dtype=np.float32).ravel()))
+            self.pixel_weights.append(invert(np.asarray(matrix.sum(axis=0), dtype=np.float32).ravel()))
+
+        if self.matrix_size > max_matrix_size:
+            # Only the matrix of the current subset is in memory
+            self.matrices = None
+            self.matrix_size = self.matrix_size // number_of_subsets
+
+        self.history = []
+
+    def computeMatrix(self, subset_id):
+        """Sparse (rays, pixels) matrix of the subset, the rays of each angle of the subset one after the other."""
+
+        subset = self.subsets[subset_id]
+
+        # Each pixel is shared, for each angle, between the detector pixels
+        # on its left and on its right, so the matrix is built column by
+        # column without sorting its entries (CSC format)
+        rows = np.empty((len(self.pixels), len(subset), 2), dtype=np.int32)
+        values = np.empty((len(self.pixels), len(subset), 2), dtype=np.float32)
+
+        for index, angle in enumerate(self.angles[subset]):
+
+            # Position of each pixel on the detector (see fbp.FBP.computeTable)
+            angle = np.deg2rad(angle)
+            position = self.fbp.ypr * np.cos(angle) - self.fbp.xpr * np.sin(angle) + self.detector_width // 2
+            left = np.floor(position)
+            weight = position - left
+            left = left.astype(np.int32)
+
+            for side, (detector_pixel, value) in enumerate([(left, 1.0 - weight), (left + 1, weight)]):
+                # Outside the detector, the weight is null
+                inside = (detector_pixel >= 0) & (detector_pixel < self.detector_width)
+                rows[:, index, side] = index * self.detector_width + np.clip(detector_pixel, 0, self.detector_width - 1)
+                values[:, index, side] = np.where(inside, value, 0.0)
+
+        shape = (len(subset) * self.detector_width, len(self.pixels))
+        pointers = np.arange(0, rows.size + 1, 2 * len(subset), dtype=np.int64)
+        return scipy.sparse.csc_matrix((values.ravel(), rows.ravel(), pointers), shape=shape)
+
+    def getMemorySize(self):
+        """Memory used by the matrices and the tables of the FBP, whatever the number of slices."""
+
+        memory_size = self.matrix_size
+        if self.fbp.tables is not None:
+            memory_size += len(self.angles) * len(self.pixels) * 8
+        return memory_size
+
+    def getBytesPerSlice(self):
+        """Memory used by reconstruct per slice, besides the sinograms and the output volume.
+
+        The slice of the warm start and its pixels, the pixels being
+        updated, and the sinogram copied by subset.
+        """
+
+        return 4 * (self.output_size ** 2 + 2 * len(self.pixels) + len(self.angles) * self.detector_width)
+
+    def getMatrix(self, subset_id):
+        if self.matrices is not None:
+            return self.matrices[subset_id]
+        return self.computeMatrix(subset_id)
+
+    def getInitialSlices(self, sinograms, initial, number_of_threads):
+        # (rows, pixels) values of the first estimate
+        if initial is None:
+            return np.zeros((sinograms.shape[0], len(self.pixels)), dtype=np.float32)
+
+        if isinstance(initial, str):
+            if initial != "fbp":
+                raise ValueError("Unknown initial estimate: " + initial + " (expected 'fbp', None or a volume)")
+            initial = self.fbp.reconstruct(sinograms, number_of_threads=number_of_threads)
+
+        initial = np.asarray(initial, dtype=np.float32)
+        if initial.shape != (sinograms.shape[0], self.output_size, self.output_size):
+            raise ValueError("The initial volume " + str(initial.shape) + " does not match the sinograms")
+
+        return initial.reshape(len(initial), -1)[:, self.pixels]
+
+    def reconstruct(self, sinograms, out = None, initial = "fbp", max_iterations = 10, tolerance = 1e-3,
+                    relaxation = 1.0, clip = None, chunk_size = None, number_of_threads = None, verbose = 0):
+        """Reconstruct (rows, angles, columns) sinograms into a (rows, size, size) volume in single precision.
+
+        initial is "fbp" (warm start), None (zero) or a volume. An
+        iteration goes once through all the subsets. The iterations stop
+        after max_iterations, or when the residual decreases by less than
+        tolerance (relative to the previous residual). The residual is the
+        norm of the differences between the sinograms and the projections
+        of the slices, computed during the updates, relative to the norm of
+        the sinograms. clip gives the (min, max) values of the pixels after
+        each update. The slabs of chunk_size slices are updated by several
+        threads (NumPy and SciPy release the GIL).
+        """
+
+        self.fbp.checkSinograms(sinograms)
+        number_of_slices = sinograms.shape[0]
+
+        if out is None:
+            out = np.empty((number_of_slices, self.output_size, self.output_size), dtype=np.float32)
+        elif out.shape != (number_of_slices, self.output_size, self.output_size):
+            raise ValueError("The output volume " + str(out.shape) + " does not match the sinograms")
+
+        if number_of_threads is None:
+            number_of_threads = os.cpu_count() or 1
+
+        if chunk_size is None:
+            chunk_size = max(1, DEFAULT_CHUNK_SIZE_IN_BYTES // max(1, 4 * len(self.pixels)))
+
+        chunks = [slice(start, min(start + chunk_size, number_of_slices)) for start in range(0, number_of_slices, chunk_size)]
+        number_of_threads = max(1, min(number_of_threads, len(chunks)))
+
+        start_time = time.time()
+
+        # The slices and the sinograms of each slab are stored as columns,
+        # (pixels, rows) and (rays, rows) for each subset
+        initial_slices = self.getInitialSlices(sinograms, initial, number_of_threads)
+        slices = [np.ascontiguousarray(initial_slices[chunk].T) for chunk in chunks]
+        del initial_slices
+
+        measurements = []
+        for chunk in chunks:
+            sinogram_slab = np.asarray(sinograms[chunk], dtype=np.float32)
+            measurements.append([np.ascontiguousarray(sinogram_slab[:, subset].reshape(len(sinogram_slab), -1).T)
+                                 for subset in self.subsets])
+
+        norm = np.sqrt(sum(np.sum(np.square(measurement, dtype=np.float64))
+                           for slab in measurements for measurement in slab))
+        if norm == 0.0:
+            norm = 1.0
+
+        if verbose:
+            print("SART:", number_of_slices, "slices,", len(self.subsets), "subsets, initialised in", round(time.time() - start_time, 3), "s")
+
+        self.history = []
+        previous_residual = None
+
+        with ThreadPoolExecutor(max_workers=number_of_threads) as executor:
+
+            for iteration in range(max_iterations):
+                iteration_start = time.time()
+                squared_residual = 0.0
+
+                for subset_id in range(len(self.subsets)):
+                    matrix = self.getMatrix(subset_id)
+                    transpose = matrix.T
+
+                    def update(chunk_id):
+                        return self.update(matrix, transpose, self.ray_weights[subset_id], self.pixel_weights[subset_id],
+                                           measurements[chunk_id][subset_id], slices[chunk_id], relaxation, clip)
+
+                    squared_residual += sum(executor.map(update, range(len(chunks))))
+
+                residual = np.sqrt(squared_residual) / norm
+                runtime = time.time() - iteration_start
+                self.history.append({"iteration": iteration + 1, "time": runtime, "residual": residual})
+
+                if verbose:
+                    print("SART iteration", iteration + 1, "residual", "{:.6g}".format(residual), "in", round(runtime, 3), "s")
+
+                if tolerance is not None and previous_residual is not None and \
+                   previous_residual - residual < tolerance * previous_residual:
+                    break
+                previous_residual = residual
+
+        for chunk, chunk_slices in zip(chunks, slices):
+            volume_slab = np.zeros((chunk.stop - chunk.start, self.output_size ** 2), dtype=np.float32)
+            volume_slab[:, self.pixels] = chunk_slices.T
+            out[chunk] = volume_slab.reshape(out[chunk].shape)
+
+        if verbose:
+            print("SART:", len(self.history), "iteration(s) in", round(time.time() - start_time, 3), "s")
+
+        return out
+
+    def update(self, matrix, transpose, ray_weights, pixel_weights, measurements, slices, relaxation, clip):
+        # One SART update of the (pixels, rows) slices with the rays of a
+        # subset, return the squared norm of the residual before the update
+        residual = measurements - matrix @ slices
+        squared_residual = float(np.sum(np.square(residual, dtype=np.float64)))
+
+        residual *= ray_weights[:, np.newaxis]
+        correction = transpose @ residual
+        correction *= (relaxation * pixel_weights)[:, np.newaxis]
+        slices += correction
+
+        if clip is not None:
+            np.clip(slices, clip[0], clip[1], out=slices)
+
+        return squared_residual
+
+    def getHistory(self):
+        return self.history
+
+    def printHistory(self):
+        for record in self.history:
+            print("\t{:>4} {:>14.6g} {:>10.3f} s".format(record["iteration"], record["residual"], record["time"]))
+
+
+def invert(weights):
+    # 1 / weights, 0 where the weight is null (rays and pixels outside the grid)
+    inverse = np.zeros_like(weights)
+    np.divide(1.0, weights, out=inverse, where=weights > 0.0)
+    return inverse
+
+
+# Engines already built, with their matrices
+engine_cache = {}
+
+
+def getSART(angles, detector_width, output_size = None, circle = True, number_of_subsets = 10, filter_name = "ramp"):
+    """Return the SART engine of this geometry, built once."""
+
+    angles = np.asarray(angles, dtype=np.float64).ravel()
+    key = (angles.tobytes(), int(detector_width), output_size, circle, number_of_subsets, filter_name)
+
+    if key not in engine_cache:
+        # Keep the matrices of the last geometry only
+        engine_cache.clear()
+        engine_cache[key] = SART(angles, detector_width, output_size, circle, number_of_subsets, filter_name)
+
+    return engine_cache[key]
+
+
+def reconstructSART(sinograms, angles, output_size = None, circle = True, number_of_subsets = 10, filter_name = "ramp",
+                    out = None, initial = "fbp", max_iterations = 10, tolerance = 1e-3, relaxation = 1.0, clip = None,
+                    chunk_size = None, number_of_threads = None, verbose = 0):
+    """Ordered-subset SART of (rows, angles, columns) sinograms, angles in degrees (see SART.reconstruct)."""
+
+    engine = getSART(angles, np.shape(sinograms)[2], output_size, circle, number_of_subsets, filter_name)
+    return engine.reconstruct(sinograms, out, initial, max_iterations, tolerance, relaxation, clip,
+                              chunk_size, number_of_threads, verbose)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+"""
+Persistent on-disk cache of X-ray spectra generated by SpekPy or xpecgen.
+
+An entry is keyed by the generator, its version and the beam parameters
+(kVp, tube angle, ordered list of filters...). It is stored as an
+uncompressed .npz file holding the arrays of the spectrum. The least
+recently used entries are removed when there are too many of them.
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+
+import numpy as np
+
+
+# Default location and size of the cache, can be changed with
+# GVXR_SPECTRUM_CACHE and GVXR_SPECTRUM_CACHE_SIZE
+DEFAULT_CACHE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "gvxr-demos", "spectra")
+DEFAULT_MAX_ENTRIES = 256
+
+
+def getCacheDirectory(cache_directory = None):
+    if cache_directory is None:
+        cache_directory = os.environ.get("GVXR_SPECTRUM_CACHE", DEFAULT_CACHE_DIRECTORY)
+    return cache_directory
+
+
+def getMaxEntries(max_entries = None):
+    if max_entries is None:
+        max_entries = int(os.environ.get("GVXR_SPECTRUM_CACHE_SIZE", DEFAULT_MAX_ENTRIES))
+    return max_entries
+
+
+def getLibraryVersion(distribution):
+    # Read the version from the package metadata, without importing the package
+    try:
+        from importlib import metadata
+        return metadata.version(distribution)
+    except Exception:
+        return "unknown"
+
+
+def getCacheKey(generator, parameters):
+    key = json.dumps([generator, getLibraryVersion(generator), parameters], sort_keys=True)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def evict(cache_directory, max_entries):
+    # Remove the least recently used entries (the modification time is
+    # updated each time an entry is read)
+    entries = []
+    for fname in os.listdir(cache_directory):
+        if fname.endswith(".npz"):
+            fname = os.path.join(cache_directory, fname)
+            try:
+                entries.append((os.path.getmtime(fname), fname))
+            except OSError:
+                pass # Removed by another process
+
+    entries.sort()
+    for mtime, fname in entries[:max(0, len(entries) - max_entries)]:
+        try:
+            os.remove(fname)
+        except OSError:
+            pass
+
+
+def getArrays(generator, parameters, compute, cache_directory = None, max_entries = None):
+    """Return the dictionary of arrays computed by compute(), reading it from the cache if possible.
+
+    parameters must be JSON-serialisable, e.g. [kvp, tube_angle, [[material, thickness], ...]].
+    """
+
+    cache_directory = getCacheDirectory(cache_directory)
+    fname = os.path.join(cache_directory, getCacheKey(generator, parameters) + ".npz")
+
+    if os.path.exists(fname):
+        try:
+            with np.load(fname) as data:
+                arrays = {name: data[name] for name in data.files}
+            os.utime(fname)
+            return arrays
+        except (IOError, OSError, ValueError):
+            pass # Corrupted or evicted entry, compute it again
+
+    arrays = compute()
+
+    try:
+        os.makedirs(cache_directory, exist_ok=True)
+
+        # Write then rename, so that concurrent jobs never read a partial file
+        file_descriptor, temp_fname = tempfile.mkstemp(dir=cache_directory, suffix=".tmp")
+        try:
+            with os.fdopen(file_descriptor, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(temp_fname, fname)
+        except BaseException:
+            if os.path.exists(temp_fname):
+                os.remove(temp_fname)
+            raise
+
+        evict(cache_directory, getMaxEntries(max_entries))
+    except OSError as error:
+        print("Cannot cache the spectrum:", error)
+
+    return arrays
+
+
+def getSpekPySpectrum(kvp, tube_angle = 12, filters = [], cache_directory = None, max_entries = None):
+    """Return the (k, f) arrays of s.get_spectrum(edges=True) for a SpekPy beam.
+
+    filters is the ordered list of (material, thickness in mm).
+    """
+
+    filters = [[material, float(thickness)] for material, thickness in filters]
+
+    def compute():
+        import spekpy as sp
+
+        s = sp.Spek(kvp=kvp, th=tube_angle)
+        for material, thickness in filters:
+            s.filter(material, thickness)
+
+        k, f = s.get_spectrum(edges=True)
+        return {"k": np.asarray(k), "f": np.asarray(f)}
+
+    arrays = getArrays("spekpy", [float(kvp), float(tube_angle), filters], compute, cache_directory, max_entries)
+    return arrays["k"], arrays["f"]
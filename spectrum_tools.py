@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+"""
+NumPy helpers to build the beam spectrum before it is given to gVirtualXRay.
+
+Energies are in keV.
+"""
+
+import re
+import functools
+
+import numpy as np
+
+
+def mergeBins(energies, counts):
+    """Sort the bins, sum the counts of identical energies and drop the empty bins."""
+
+    energies = np.asarray(energies, dtype=np.float64).ravel()
+    counts = np.asarray(counts, dtype=np.float64).ravel()
+
+    if energies.shape != counts.shape:
+        raise ValueError("The number of energies (" + str(energies.size) + ") and photon counts (" + str(counts.size) + ") differ")
+
+    merged_energies, inverse = np.unique(energies, return_inverse=True)
+    merged_counts = np.bincount(inverse.ravel(), weights=counts, minlength=merged_energies.size)
+
+    non_empty = merged_counts > 0
+    return merged_energies[non_empty], merged_counts[non_empty]
+
+
+# Histogram points of a GATE macro, e.g. "/gate/source/mybeam/gps/histpoint 0.08 1000"
+GATE_HISTPOINT = re.compile(rb"^[ \t]*/gate/\S*histpoint[ \t]+(\S+)[ \t]+(\S+)", re.MULTILINE)
+
+
+def readGateMacro(fname):
+    """Read the histogram points of a GATE macro, return the energies and counts (in the unit of the file)."""
+
+    with open(fname, "rb") as f:
+        data = f.read()
+
+    # Commented lines start with '#', they cannot match the expression
+    points = np.array(GATE_HISTPOINT.findall(data), dtype="S").reshape((-1, 2))
+    if not len(points):
+        raise IOError("No histogram point in " + fname)
+
+    points = points.astype(np.float64)
+    return np.ascontiguousarray(points[:, 0]), np.ascontiguousarray(points[:, 1])
+
+
+def readTextFile(fname):
+    """Read a two-column text file (energy, count) with '#' comments, return the energies and counts."""
+
+    points = np.loadtxt(fname, comments="#", usecols=(0, 1), ndmin=2, dtype=np.float64)
+    if not len(points):
+        raise IOError("No energy bin in " + fname)
+
+    return np.ascontiguousarray(points[:, 0]), np.ascontiguousarray(points[:, 1])
+
+
+def getTotalEnergy(energies, counts):
+    """Total energy of the beam (in keV)."""
+    return float(np.dot(energies, counts))
+
+
+def groupBins(energies, counts, number_of_groups):
+    """Group contiguous bins into at most number_of_groups bins.
+
+    The groups hold roughly the same energy fluence. The photon count of a
+    group is the sum of its counts and its energy is the count-weighted mean
+    energy, so the total number of photons and the mean energy are preserved.
+    """
+
+    if number_of_groups >= len(energies):
+        return np.array(energies, dtype=np.float64), np.array(counts, dtype=np.float64)
+
+    fluence = energies * counts
+    cumulative = (np.cumsum(fluence) - 0.5 * fluence) / fluence.sum()
+    group_ids = np.minimum((cumulative * number_of_groups).astype(np.int64), number_of_groups - 1)
+
+    # Remove the empty groups
+    group_ids = np.unique(group_ids, return_inverse=True)[1].ravel()
+
+    grouped_counts = np.bincount(group_ids, weights=counts)
+    grouped_energies = np.bincount(group_ids, weights=fluence) / grouped_counts
+
+    return grouped_energies, grouped_counts
+
+
+def parseMixture(formula):
+    # e.g. "Ti90Al6V4" -> ["Ti", "Al", "V"], [90, 6, 4]
+    symbols = []
+    weights = []
+    for symbol, weight in re.findall(r"([A-Z][a-z]?)([0-9]*\.?[0-9]*)", formula):
+        symbols.append(symbol)
+        weights.append(float(weight) if weight != "" else 1.0)
+    return symbols, weights
+
+
+def getMassAttenuationFunction(sample):
+    """Return E (keV) -> mass attenuation coefficient (cm2/g) for a sample of the configuration.
+
+    Only the variation with energy matters to estimate the rebinning error.
+    Samples defined by a linear attenuation coefficient ("MU") do not depend
+    on the energy, None is returned. Hounsfield values are treated as water.
+    """
+
+    import xraylib as xrl
+
+    def getZ(element):
+        if type(element) == str:
+            return xrl.SymbolToAtomicNumber(element)
+        return int(element)
+
+    if sample.material_type == "ELEMENT":
+        Z = getZ(sample.material_value)
+        return lambda energy: xrl.CS_Total(Z, energy)
+
+    elif sample.material_type == "MIXTURE":
+        if sample.elements is None:
+            symbols, weights = parseMixture(sample.material_value)
+            Z_set = [getZ(symbol) for symbol in symbols]
+        else:
+            Z_set = [getZ(Z) for Z in sample.elements]
+            weights = sample.weights
+
+        weights = np.array(weights) / np.sum(weights)
+        return lambda energy: sum(weight * xrl.CS_Total(Z, energy) for Z, weight in zip(Z_set, weights))
+
+    elif sample.material_type == "COMPOUND":
+        compound = sample.material_value
+        return lambda energy: xrl.CS_Total_CP(compound, energy)
+
+    elif sample.material_type == "HU":
+        return lambda energy: xrl.CS_Total_CP("H2O", energy)
+
+    return None
+
+
+def estimateTransmissionError(energies, counts, grouped_energies, grouped_counts, mass_attenuation_functions,
+                              transmissions = np.logspace(-3, np.log10(0.99), 16)):
+    """Largest relative error on the transmitted energy due to the rebinning.
+
+    For each material, the error is evaluated for the thicknesses giving the
+    requested transmissions at the mean energy of the beam (the detector is
+    assumed to integrate the energy).
+    """
+
+    mean_energy = np.dot(energies, counts) / counts.sum()
+    fluence = energies * counts
+    grouped_fluence = grouped_energies * grouped_counts
+
+    max_error = 0.0
+    for mass_attenuation in mass_attenuation_functions:
+        mu = np.array([mass_attenuation(energy) for energy in energies])
+        grouped_mu = np.array([mass_attenuation(energy) for energy in grouped_energies])
+
+        # Mass thicknesses (g/cm2) giving the requested transmissions at the mean energy
+        mass_thickness = -np.log(transmissions) / mass_attenuation(mean_energy)
+
+        reference = np.exp(-np.outer(mass_thickness, mu)) @ fluence
+        rebinned = np.exp(-np.outer(mass_thickness, grouped_mu)) @ grouped_fluence
+
+        max_error = max(max_error, float(np.max(np.abs(rebinned - reference) / reference)))
+
+    return max_error
+
+
+def rebinSpectrum(energies, counts, max_bins = None, tolerance = None, samples = None):
+    """Rebin the spectrum into as few energy groups as possible.
+
+    With a tolerance, the number of groups increases (up to max_bins) until
+    the estimated transmission error through the materials of the samples is
+    below the tolerance. Without a tolerance, max_bins groups are used.
+    Return the grouped energies, counts and the estimated error (None if it
+    has not been estimated).
+    """
+
+    if max_bins is None:
+        max_bins = len(energies)
+
+    if tolerance is None:
+        grouped_energies, grouped_counts = groupBins(energies, counts, max_bins)
+        return grouped_energies, grouped_counts, None
+
+    # Materials that depend on the energy (the same material is only tested once)
+    functions = {}
+    for sample in samples or []:
+        if sample.material_type is not None:
+            function = getMassAttenuationFunction(sample)
+            if function is not None:
+                functions[sample.getMaterialKey()] = functools.lru_cache(maxsize=None)(function)
+
+    if not len(functions):
+        import xraylib as xrl
+        functions[None] = functools.lru_cache(maxsize=None)(lambda energy: xrl.CS_Total_CP("H2O", energy))
+
+    for number_of_groups in range(1, max_bins + 1):
+        grouped_energies, grouped_counts = groupBins(energies, counts, number_of_groups)
+        error = estimateTransmissionError(energies, counts, grouped_energies, grouped_counts, functions.values())
+
+        if error <= tolerance:
+            break
+
+    return grouped_energies, grouped_counts, error
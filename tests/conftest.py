@@ -0,0 +1,10 @@
+import os
+import sys
+
+# The modules at the top of the repository, and the stub of gvxrPython3
+# used instead of the GPU (also in the processes spawned by the tests)
+tests_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, tests_path)
+sys.path.insert(0, os.path.dirname(tests_path))
+
+os.environ["GVXR_MODULE"] = "gvxr_stub"
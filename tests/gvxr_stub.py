@@ -0,0 +1,109 @@
+"""
+Stub of gvxrPython3 to run the demos and the tests without a GPU, e.g.
+
+    GVXR_MODULE=gvxr_stub PYTHONPATH=tests python projection_farm.py ...
+
+Every call is recorded in calls. The stub keeps the number of pixels of
+the detector and the transformation matrices of the nodes, and each X-ray
+image is filled with the angle (in degrees) of the rotation of the root
+node around the Z axis, so the order of the projections can be checked.
+The other functions do nothing.
+"""
+
+import math
+
+import numpy as np
+
+
+IDENTITY = [1.0, 0.0, 0.0, 0.0,
+            0.0, 1.0, 0.0, 0.0,
+            0.0, 0.0, 1.0, 0.0,
+            0.0, 0.0, 0.0, 1.0]
+
+calls = []
+state = {}
+
+
+def reset():
+    """Forget the calls and the state of the simulation."""
+
+    del calls[:]
+    state.clear()
+    state["number_of_pixels"] = [1, 1]
+    state["matrices"] = {}
+    state["scene_matrix"] = list(IDENTITY)
+
+
+reset()
+
+
+def getCalls(name):
+    """Arguments of each call of the given function."""
+    return [args for function_name, args in calls if function_name == name]
+
+
+def record(name, args):
+    calls.append((name, args))
+
+
+def getVersionOfSimpleGVXR():
+    record("getVersionOfSimpleGVXR", ())
+    return "gvxr_stub"
+
+
+def getVersionOfCoreGVXR():
+    record("getVersionOfCoreGVXR", ())
+    return "gvxr_stub"
+
+
+def setDetectorNumberOfPixels(width, height):
+    record("setDetectorNumberOfPixels", (width, height))
+    state["number_of_pixels"] = [int(width), int(height)]
+
+
+def getDetectorNumberOfPixels():
+    record("getDetectorNumberOfPixels", ())
+    return list(state["number_of_pixels"])
+
+
+def setLocalTransformationMatrix(node, matrix):
+    record("setLocalTransformationMatrix", (node, matrix))
+    state["matrices"][node] = [float(value) for value in matrix]
+
+
+def getLocalTransformationMatrix(node):
+    record("getLocalTransformationMatrix", (node,))
+    return list(state["matrices"].get(node, IDENTITY))
+
+
+def setSceneTransformationMatrix(matrix):
+    record("setSceneTransformationMatrix", (matrix,))
+    state["scene_matrix"] = [float(value) for value in matrix]
+
+
+def getSceneTransformationMatrix():
+    record("getSceneTransformationMatrix", ())
+    return list(state["scene_matrix"])
+
+
+def getAngle(matrix):
+    """Angle (in degrees) of the rotation around Z of a column-major 4x4 matrix."""
+    return math.degrees(math.atan2(matrix[1], matrix[0]))
+
+
+def computeXRayImage():
+    record("computeXRayImage", ())
+    width, height = state["number_of_pixels"]
+    angle = getAngle(state["matrices"].get("root", IDENTITY))
+    return np.full((height, width), angle, dtype=np.float32).tolist()
+
+
+def __getattr__(name):
+    # Any other function of gvxrPython3
+    if name.startswith("__"):
+        raise AttributeError(name)
+
+    def function(*args):
+        record(name, args)
+
+    return function
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+import acquisition
+
+
+def testResumableAppend(tmp_path):
+    fname = str(tmp_path / "projections.npy")
+
+    writer = acquisition.ResumableProjectionWriter([0.0, 10.0, 20.0], fname, (2, 3))
+    writer.write(1, np.full((2, 3), 1.0))
+
+    # append fills the missing angles in turn
+    writer.append(np.full((2, 3), 0.0))
+    writer.append(np.full((2, 3), 2.0))
+    assert writer.isComplete()
+    assert np.array_equal(writer.getStack()[:, 0, 0], [0.0, 1.0, 2.0])
+
+    with pytest.raises(IndexError):
+        writer.append(np.zeros((2, 3)))
+
+
+def testResumableRemove(tmp_path):
+    fname = tmp_path / "projections.npy"
+
+    writer = acquisition.ResumableProjectionWriter([0.0, 10.0], str(fname), (2, 3))
+    writer.write(0, np.full((2, 3), 1.0))
+    stack = writer.getStack()
+
+    writer.remove()
+    assert not fname.exists()
+    assert not (tmp_path / "projections-progress.npy").exists()
+
+    # Still mapped in memory
+    assert stack[0, 0, 0] == 1.0
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+sitk = pytest.importorskip("SimpleITK")
+
+import export
+
+
+@pytest.mark.parametrize("minimum", [0.0, 0.08, 12.5])
+def testDICOMRoundTrip(tmp_path, minimum):
+    rng = np.random.default_rng(0)
+    images = (minimum + 3.0 * rng.random((3, 20, 30))).astype(np.float32)
+    images[:, 0, 0] = minimum
+
+    geometry = export.Geometry([0.5, 0.25], [-1000.0, 0.0, 0.0], [125.0, 0.0, 0.0], kvp=85.0, angles=[0.0, 1.5, 3.0])
+    pattern = str(tmp_path / "projection_{:03d}.dcm")
+
+    with export.ProjectionExporter(pattern, geometry, number_of_threads=2) as exporter:
+        exporter.exportStack(images)
+
+    for index, image in enumerate(images):
+        reader = sitk.ImageFileReader()
+        reader.SetFileName(pattern.format(index))
+        dicom = reader.Execute()
+
+        # Quantised on 16 bits between the minimum and maximum of the image
+        step = (image.max() - image.min()) / 65535.0
+        values = sitk.GetArrayFromImage(dicom).reshape(image.shape)
+        assert np.abs(values - image).max() <= step
+
+        assert np.allclose(dicom.GetSpacing()[:2], [0.5, 0.25])
+        assert float(reader.GetMetaData("0018|1110")) == pytest.approx(1125.0)
+        assert float(reader.GetMetaData("0018|1111")) == pytest.approx(1000.0)
+        assert float(reader.GetMetaData("0018|1510")) == pytest.approx(geometry.angles[index])
+
+
+def testConstantImage(tmp_path):
+    fname = str(tmp_path / "constant_{}.dcm")
+
+    with export.ProjectionExporter(fname) as exporter:
+        exporter.submit(0, np.full((4, 5), 2.5, dtype=np.float32))
+
+    values = sitk.GetArrayFromImage(sitk.ReadImage(fname.format(0)))
+    assert np.allclose(values, 2.5)
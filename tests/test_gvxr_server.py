@@ -0,0 +1,98 @@
+import os
+import json
+import time
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+import gvxr_stub
+import gvxr_server
+import trajectory
+
+
+@pytest.fixture
+def server(tmp_path):
+    config = {
+        "WindowSize": [64, 64],
+        "Source": {
+            "Position": [-40.0, 0.0, 0.0, "cm"],
+            "Shape": "ParallelBeam",
+            "Beam": [{"Energy": 33, "Unit": "keV", "PhotonCount": 100}]
+        },
+        "Detector": {
+            "Position": [40.0, 0.0, 0.0, "cm"],
+            "UpVector": [0, 0, -1],
+            "NumberOfPixels": [5, 3],
+            "Spacing": [0.25, 0.25, "mm"]
+        },
+        "Samples": [
+            {"Label": "cube", "Cube": [10, "mm"], "Material": ["Element", "Cu"]}
+        ]
+    }
+
+    config_fname = tmp_path / "server.json"
+    config_fname.write_text(json.dumps(config))
+    socket_path = str(tmp_path / "server.sock")
+
+    gvxr_stub.reset()
+    server = gvxr_server.SimulationServer(str(config_fname), socket_path)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+
+    # Wait for the server to listen
+    deadline = time.time() + 10
+    while not os.path.exists(socket_path):
+        assert thread.is_alive() and time.time() < deadline
+        time.sleep(0.01)
+
+    return thread, socket_path
+
+
+def getExpectedImages(angles):
+    # The stub fills each image with the angle of the pose of the root node
+    poses = trajectory.getCircularPoses(angles, (0, 0, -1))
+    return [gvxr_stub.getAngle(pose.T.ravel()) for pose in poses]
+
+
+def testRoundTrip(server, monkeypatch):
+    thread, socket_path = server
+
+    # The client runs in the process of the server, which already tracks the
+    # shared memory blocks: the client must not unregister them
+    monkeypatch.setattr(gvxr_server, "attachSharedMemory", lambda name: shared_memory.SharedMemory(name=name))
+
+    with gvxr_server.SimulationClient(socket_path, timeout=10) as client:
+        info = client.info()
+        assert info["number_of_pixels"] == [5, 3]
+        assert info["version"] == "gvxr_stub"
+
+        angles = [0.0, 10.0, 20.0]
+        images = client.render(angles)
+        assert images.shape == (3, 3, 5)
+        assert np.allclose(images.reshape((3, -1)).T, getExpectedImages(angles), atol=1e-4)
+        memory_name = client.memory.name
+
+        # Only the number of pixels differs
+        changes = client.applyConfig(delta={"Detector": {"NumberOfPixels": [8, 6]}})
+        assert changes == ["detector number of pixels"]
+
+        # The images no longer fit in the shared memory block
+        images = client.render(angles)
+        assert images.shape == (3, 6, 8)
+        assert client.memory.name != memory_name
+
+        # A view of the shared memory block
+        images = client.render([30.0, 40.0])
+        view = client.render([30.0, 40.0], copy=False)
+        assert view.shape == (2, 6, 8)
+        assert not view.flags.owndata
+        assert np.array_equal(view, images)
+        del view
+
+        client.shutdown()
+
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert not os.path.exists(socket_path)
@@ -0,0 +1,146 @@
+import json
+
+import numpy as np
+import pytest
+
+import gvxr_stub
+import json2gvxr
+import transformations
+
+
+def getConfig(beam):
+    return {
+        "Source": {
+            "Position": [-40.0, 0.0, 0.0, "cm"],
+            "Shape": "ParallelBeam",
+            "Beam": beam
+        }
+    }
+
+
+def getSpectrumBins():
+    # (energy, unit, count) of each call
+    return gvxr_stub.getCalls("addEnergyBinToSpectrum")
+
+
+@pytest.fixture(autouse=True)
+def resetStub():
+    gvxr_stub.reset()
+
+
+def testListSpectrum():
+    # 33 keV is listed twice, in MeV the second time
+    spectrum, unit, k, f = json2gvxr.initSpectrum(getConfig([
+        {"Energy": 66, "Unit": "keV", "PhotonCount": 3},
+        {"Energy": 33, "Unit": "keV", "PhotonCount": 90},
+        {"Energy": 0.033, "Unit": "MeV", "PhotonCount": 6},
+        {"Energy": 99, "Unit": "keV", "PhotonCount": 1}
+    ]))
+
+    assert getSpectrumBins() == [(33.0, "keV", 96.0), (66.0, "keV", 3.0), (99.0, "keV", 1.0)]
+    assert len(gvxr_stub.getCalls("resetBeamSpectrum")) == 1
+    assert spectrum == {33.0: 96.0, 66.0: 3.0, 99.0: 1.0}
+
+
+def testTextFileSpectrum(tmp_path):
+    fname = tmp_path / "spectrum.txt"
+    fname.write_text("# energy count\n"
+                     "20 5\n"
+                     "10 1\n"
+                     "20 2\n"
+                     "30 0\n")
+
+    json2gvxr.initSpectrum(getConfig({"TextFile": str(fname), "Unit": "keV"}))
+
+    # Sorted, merged, and the empty bin is dropped
+    assert getSpectrumBins() == [(10.0, "keV", 1.0), (20.0, "keV", 7.0)]
+
+
+def testGateMacroSpectrum(tmp_path):
+    fname = tmp_path / "spectrum.mac"
+    fname.write_text("/gate/source/mybeam/gps/particle gamma\n"
+                     "/gate/source/mybeam/gps/histpoint 0.05 10\n"
+                     "# /gate/source/mybeam/gps/histpoint 0.06 1000\n"
+                     "/gate/source/mybeam/gps/histpoint 0.04 20\n"
+                     "/gate/source/mybeam/gps/histpoint 0.05 5\n")
+
+    spectrum, unit, k, f = json2gvxr.initSpectrum(getConfig({"GateMacro": str(fname), "Unit": "MeV"}))
+
+    bins = getSpectrumBins()
+    assert len(bins) == 2
+    assert np.allclose([energy for energy, unit, count in bins], [40.0, 50.0])
+    assert [count for energy, unit, count in bins] == [20.0, 15.0]
+    assert all(unit == "keV" for energy, unit, count in bins)
+
+
+def testSpectrumKeyWithTolerance():
+    def getKey(tolerance, element):
+        config = getConfig({"kvp": 80, "filter": [["Al", 1.0]]})
+        if tolerance is not None:
+            config["Source"]["Beam"]["Tolerance"] = tolerance
+        config["Samples"] = [{"Label": "cube", "Cube": [10, "mm"], "Material": ["Element", element]}]
+        return json2gvxr.SimulationConfig(config).getSpectrumKey()
+
+    # The rebinned spectrum depends on the materials of the samples
+    assert getKey(None, "Cu") == getKey(None, "Al")
+    assert getKey(0.01, "Cu") != getKey(0.01, "Al")
+
+
+def testBatchAfterFailure(tmp_path, monkeypatch):
+    config = {
+        "WindowSize": [64, 64],
+        "Detector": {"Position": [40.0, 0.0, 0.0, "cm"], "UpVector": [0, 0, -1], "NumberOfPixels": [4, 3], "Spacing": [0.25, 0.25, "mm"]},
+        "Samples": [
+            {"Label": "cube", "Cube": [10, "mm"], "Material": ["Element", "Cu"]},
+            {"Label": "cylinder", "Cylinder": [20, 5, 10, "mm"], "Material": ["Element", "Al"]}
+        ]
+    }
+    fnames = []
+    for run_id, element in enumerate(["Al", "Unknown", "Al"]):
+        config["Samples"][1]["Material"][1] = element
+        fname = tmp_path / (str(run_id) + ".json")
+        fname.write_text(json.dumps(config))
+        fnames.append(str(fname))
+
+    # The second run fails half way through the update of the materials
+    setElement = gvxr_stub.setElement
+    def setKnownElement(label, element):
+        if element == "Unknown":
+            raise ValueError("Unknown element")
+        setElement(label, element)
+    monkeypatch.setattr(gvxr_stub, "setElement", setKnownElement, raising=False)
+
+    manifest = json2gvxr.runBatch(fnames, str(tmp_path / "output"))
+
+    assert "error" in manifest[1]
+    assert "error" not in manifest[2]
+
+    # The third run sets the whole scene up again
+    assert "samples" in manifest[2]["changes"]
+
+
+def testTransformOfSceneGraphNode(tmp_path):
+    fname = tmp_path / "scene.dae"
+    fname.write_text("")
+
+    config = {
+        "SceneGraph": {
+            "Path": str(fname),
+            "Unit": "mm",
+            "Samples": [
+                {"Label": "node", "Material": ["Element", "Cu"], "Transform": [["Rotation", 90, 0, 0, 1]]}
+            ]
+        }
+    }
+
+    # The scenegraph gives a translation to the node
+    translation = transformations.getTranslationMatrix(10.0, 0.0, 0.0)
+    gvxr_stub.state["matrices"]["node"] = transformations.toColumnMajorList(translation)
+
+    json2gvxr.initSamples(config)
+
+    # The rotation is right-multiplied, as by gvxr.rotateNode
+    expected = translation @ transformations.getRotationMatrix(90, 0, 0, 1)
+    label, matrix = gvxr_stub.getCalls("setLocalTransformationMatrix")[-1]
+    assert label == "node"
+    assert np.allclose(matrix, transformations.toColumnMajorList(expected))
@@ -0,0 +1,64 @@
+import json
+
+import numpy as np
+import pytest
+
+import gvxr_stub
+import projection_farm
+import trajectory
+
+
+@pytest.fixture
+def config_fname(tmp_path):
+    config = {
+        "WindowSize": [64, 64],
+        "Source": {
+            "Position": [-40.0, 0.0, 0.0, "cm"],
+            "Shape": "ParallelBeam",
+            "Beam": [{"Energy": 33, "Unit": "keV", "PhotonCount": 100}]
+        },
+        "Detector": {
+            "Position": [40.0, 0.0, 0.0, "cm"],
+            "UpVector": [0, 0, -1],
+            "NumberOfPixels": [5, 3],
+            "Spacing": [0.25, 0.25, "mm"]
+        },
+        "Samples": [
+            {"Label": "cube", "Cube": [10, "mm"], "Material": ["Element", "Cu"]}
+        ]
+    }
+
+    fname = tmp_path / "farm.json"
+    fname.write_text(json.dumps(config))
+    return str(fname)
+
+
+def getExpectedImages(angles):
+    # The stub fills each image with the angle of the pose of the root node
+    poses = trajectory.getCircularPoses(angles, (0, 0, -1))
+    return [gvxr_stub.getAngle(pose.T.ravel()) for pose in poses]
+
+
+def testStackOrder(config_fname):
+    angles = np.linspace(0.0, 88.0, num=12)
+
+    # Small chunks, so the workers return them out of order
+    projections = projection_farm.acquireProjections(config_fname, angles, number_of_workers=2, chunk_size=1)
+
+    assert projections.shape == (12, 3, 5)
+    assert projections.dtype == np.float32
+    assert np.allclose(projections.reshape((12, -1)).T, getExpectedImages(angles), atol=1e-4)
+
+
+def testMemmapOutput(config_fname, tmp_path):
+    angles = np.linspace(0.0, 88.0, num=7)
+    output_fname = str(tmp_path / "projections.npy")
+
+    projections = projection_farm.acquireProjections(config_fname, angles, number_of_workers=2, chunk_size=2,
+                                                     output_fname=output_fname)
+
+    # The workers write directly into the file
+    assert isinstance(projections, np.memmap)
+    stack = np.load(output_fname)
+    assert stack.shape == (7, 3, 5)
+    assert np.allclose(stack.reshape((7, -1)).T, getExpectedImages(angles), atol=1e-4)
@@ -0,0 +1,53 @@
+import threading
+
+import numpy as np
+
+import reconstruction
+
+
+def readMetaImageHeader(fname):
+    with open(fname) as f:
+        return dict(line.strip().split(" = ") for line in f)
+
+
+def testSlicesOutOfCore(tmp_path):
+    rng = np.random.default_rng(0)
+    sinograms = rng.random((9, 6, 5), dtype=np.float32)
+    np.save(tmp_path / "sinograms.npy", sinograms)
+
+    thread_counts = []
+
+    def function(sinogram):
+        thread_counts.append(threading.active_count())
+        return np.cumsum(sinogram, axis=0)
+
+    # A budget of 3 slices per slab
+    output_fname = str(tmp_path / "volume.mhd")
+    volume = reconstruction.reconstructSlicesOutOfCore(str(tmp_path / "sinograms.npy"), function, (6, 5), output_fname,
+                                                       (0.5, 0.5, 2.0), memory_budget=3000, number_of_workers=2)
+
+    assert np.allclose(volume, np.cumsum(sinograms, axis=1))
+
+    # No thread reads the next slab while the workers are forked
+    assert len(thread_counts) and max(thread_counts) == 1
+
+    header = readMetaImageHeader(output_fname)
+    assert header["DimSize"] == "5 6 9"
+    assert header["ElementSpacing"] == "0.5 0.5 2.0"
+    assert header["ElementType"] == "MET_FLOAT"
+    assert np.array_equal(np.fromfile(tmp_path / header["ElementDataFile"], dtype=np.float32).reshape(volume.shape), volume)
+
+
+def testOutOfCorePrefetch(tmp_path):
+    sinograms = np.arange(7 * 3 * 4, dtype=np.float32).reshape((7, 3, 4))
+    slabs = []
+
+    def reconstruct(sinogram_slab, volume_slab):
+        slabs.append(len(sinogram_slab))
+        volume_slab[...] = -sinogram_slab
+
+    volume = reconstruction.reconstructOutOfCore(sinograms, reconstruct, (3, 4), str(tmp_path / "volume.mhd"),
+                                                 memory_budget=3 * 144)
+
+    assert slabs == [3, 3, 1]
+    assert np.array_equal(volume, -sinograms)
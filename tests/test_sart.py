@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("scipy")
+
+import reconstruction
+import sart
+
+
+def testSARTOutOfCore(tmp_path, capsys):
+    rng = np.random.default_rng(0)
+    angles = np.linspace(0.0, 180.0, num=30, endpoint=False)
+    sinograms = rng.random((5, 30, 32), dtype=np.float32)
+    np.save(tmp_path / "sinograms.npy", sinograms)
+
+    # The matrices, the tables of the warm start and the buffers of two
+    # slices (besides their sinograms and output) fit in the budget
+    engine = sart.SART(angles, 32, number_of_subsets=5)
+    slice_size = engine.getBytesPerSlice() + 3 * 30 * 32 * 4
+    memory_budget = engine.getMemorySize() + 4 * sart.DEFAULT_CHUNK_SIZE_IN_BYTES + 2 * slice_size + slice_size // 2
+
+    volume = reconstruction.reconstructSARTOutOfCore(str(tmp_path / "sinograms.npy"), angles,
+                                                     str(tmp_path / "volume.mhd"), memory_budget=memory_budget,
+                                                     number_of_subsets=5, max_iterations=3, number_of_threads=1,
+                                                     verbose=1)
+
+    assert "slabs of 2" in capsys.readouterr().out
+
+    expected = sart.SART(angles, 32, number_of_subsets=5).reconstruct(sinograms, max_iterations=3, number_of_threads=1)
+    assert np.allclose(volume, expected, atol=1e-5)
@@ -1,9 +1,13 @@
+import os, sys
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib as mpl
 #from tabletext import to_text
 import xraylib as xrl
 from xpecgen import xpecgen as xg
+#Spectrum cache shared with json2gvxr (at the top of the repository)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import spectrum_cache
 
 def GetDensity(material):
     if material=='H2C':
@@ -63,24 +67,33 @@ def mu(material='H2C'):
     plt.show()
     
 def spectrum(E0,Mat_Z,Mat_X):
-    xrs=xg.calculate_spectrum(E0,12,3,100,epsrel=0.5,monitor=None,z=74)
-    #Inherent filtration: 1.2mm Al + 100cm Air
     mu_Al=xg.get_mu(13)
-    xrs.attenuate(0.12,mu_Al)
-    xrs.attenuate(100,xg.get_mu("air"))
     fluence_to_dose=xg.get_fluence_to_dose()
-    xrs.set_norm(value=0.146,weight=fluence_to_dose)
-    #Attenuation
-    if Mat_Z>0: #Atomic number
-        dMat = xrl.ElementDensity(Mat_Z)
-        fMat = xrl.AtomicNumberToSymbol(Mat_Z)
-        xrs.attenuate(0.1*Mat_X,xg.get_mu(Mat_Z))
-    else: #-1 == 'Water'
-        mH2O = 2. * xrl.AtomicWeight(1) + xrl.AtomicWeight(8)
-        wH = 0.1 * Mat_X * 2. * xrl.AtomicWeight(1) / (xrl.ElementDensity(1) * mH2O)
-        wO = 0.1 * Mat_X * xrl.AtomicWeight(8) / (xrl.ElementDensity(8) * mH2O)
-        xrs.attenuate(wH,xg.get_mu(1))
-        xrs.attenuate(wO,xg.get_mu(8))
+    def compute():
+        xrs=xg.calculate_spectrum(E0,12,3,100,epsrel=0.5,monitor=None,z=74)
+        #Inherent filtration: 1.2mm Al + 100cm Air
+        xrs.attenuate(0.12,mu_Al)
+        xrs.attenuate(100,xg.get_mu("air"))
+        xrs.set_norm(value=0.146,weight=fluence_to_dose)
+        #Attenuation
+        if Mat_Z>0: #Atomic number
+            dMat = xrl.ElementDensity(Mat_Z)
+            fMat = xrl.AtomicNumberToSymbol(Mat_Z)
+            xrs.attenuate(0.1*Mat_X,xg.get_mu(Mat_Z))
+        else: #-1 == 'Water'
+            mH2O = 2. * xrl.AtomicWeight(1) + xrl.AtomicWeight(8)
+            wH = 0.1 * Mat_X * 2. * xrl.AtomicWeight(1) / (xrl.ElementDensity(1) * mH2O)
+            wO = 0.1 * Mat_X * xrl.AtomicWeight(8) / (xrl.ElementDensity(8) * mH2O)
+            xrs.attenuate(wH,xg.get_mu(1))
+            xrs.attenuate(wO,xg.get_mu(8))
+        return {"x": np.array(xrs.x), "y": np.array(xrs.y), "discrete": np.array(xrs.discrete, dtype=float).reshape((-1, 3))}
+    #Reuse the spectrum if this beam has already been computed
+    filters = [["Al", 0.12], ["air", 100], ["dose", 0.146], [int(Mat_Z), float(Mat_X)]]
+    arrays = spectrum_cache.getArrays("xpecgen", [float(E0), 12, 3, 100, 0.5, 74, filters], compute)
+    xrs = xg.Spectrum()
+    xrs.x = arrays["x"].tolist()
+    xrs.y = arrays["y"].tolist()
+    xrs.discrete = arrays["discrete"].tolist()
     #Get the figures
     Nr_Photons = "%.4g" % (xrs.get_norm())
     Average_Energy = "%.2f keV" % (xrs.get_norm(lambda x:x)/xrs.get_norm())
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+"""
+Poses of the sample during a CT scan, as arrays of 4x4 matrices.
+
+All the poses of a scan (circular, helical or arbitrary) are computed at
+once with NumPy. Each view is then set by giving its absolute matrix to
+gVirtualXRay, instead of rotating the sample by a small step after each
+projection: the rounding errors do not accumulate, and the views can be
+computed in any order, split across processes or resumed.
+
+A pose is relative to the initial transformation of the node (or of the
+scene), and lengths are in mm.
+"""
+
+import numpy as np
+
+import transformations
+
+
+def getAngles(number_of_projections, first_angle = 0.0, final_angle = 360.0, include_final_angle = False):
+    """Evenly spaced angles in degrees."""
+    return np.linspace(first_angle, final_angle, num=number_of_projections, endpoint=include_final_angle)
+
+
+def getCircularPoses(angles, axis = (0, 0, -1), centre = (0, 0, 0)):
+    """Rotations of shape (n, 4, 4) by the angles (in degrees) around the axis going through centre (in mm)."""
+
+    poses = transformations.getRotationMatrices(angles, axis)
+
+    if np.any(centre):
+        poses = np.matmul(np.matmul(transformations.getTranslationMatrix(*centre), poses),
+                          transformations.getTranslationMatrix(*(-np.asarray(centre, dtype=np.float64))))
+
+    return poses
+
+
+def getHelicalPoses(angles, pitch, axis = (0, 0, -1), centre = (0, 0, 0)):
+    """Circular poses, translated along the axis by pitch (in mm) per turn."""
+
+    poses = getCircularPoses(angles, axis, centre)
+
+    axis = np.asarray(axis, dtype=np.float64)
+    offsets = np.outer(np.asarray(angles, dtype=np.float64).ravel() / 360.0 * pitch, axis / np.linalg.norm(axis))
+
+    # The translation is applied after the rotation
+    poses[:, :3, 3] += offsets
+    return poses
+
+
+def getPoses(config):
+    """Return the (n, 4, 4) poses of the "Scan" section of a json2gvxr.SimulationConfig."""
+
+    if config.scan_type == "Poses":
+        return transformations.composeTransformChains(config.scan_transforms)
+    elif config.scan_type == "Circular":
+        return getCircularPoses(config.scan_angles, config.scan_axis, config.scan_centre)
+    elif config.scan_type == "Helical":
+        return getHelicalPoses(config.scan_angles, config.scan_pitch, config.scan_axis, config.scan_centre)
+
+    raise IOError("No 'Scan' in the configuration")
+
+
+class PoseSetter:
+    # Set the absolute pose of a node (or of the whole scene if node is None)
+
+    def __init__(self, gvxr, node = "root"):
+        self.gvxr = gvxr
+        self.node = node
+
+        # Column-major in gVirtualXRay
+        self.initial_matrix = self.getMatrix()
+        self.initial_transformation = np.asarray(self.initial_matrix, dtype=np.float64).reshape((4, 4)).T
+
+    def getMatrix(self):
+        if self.node is None:
+            return self.gvxr.getSceneTransformationMatrix()
+        return self.gvxr.getLocalTransformationMatrix(self.node)
+
+    def setMatrix(self, matrix):
+        if self.node is None:
+            self.gvxr.setSceneTransformationMatrix(matrix)
+        else:
+            self.gvxr.setLocalTransformationMatrix(self.node, matrix)
+
+    def __call__(self, pose):
+        # Right-multiplied, like gvxr.rotateNode
+        self.setMatrix(transformations.toColumnMajorList(self.initial_transformation @ pose))
+
+    def restore(self):
+        self.setMatrix(self.initial_matrix)
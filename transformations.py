@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+"""
+4x4 homogeneous transformation matrices, computed with NumPy.
+
+The matrices follow the conventions of gVirtualXRay (and OpenGL): angles are
+in degrees, a transformation chain is applied by right-multiplication
+(like gvxr.rotateNode, gvxr.translateNode and gvxr.scaleNode), and the
+matrices are given to gVirtualXRay in column-major order.
+"""
+
+import numpy as np
+
+
+def getRotationMatrices(angles, axes):
+    """Rotation matrices of shape (n, 4, 4) for n angles (in degrees) around n axes."""
+
+    angles = np.radians(np.asarray(angles, dtype=np.float64).reshape(-1))
+    axes = np.asarray(axes, dtype=np.float64).reshape((-1, 3))
+    axes = np.broadcast_to(axes, (len(angles), 3))
+
+    norms = np.linalg.norm(axes, axis=1)
+    if np.any(norms == 0):
+        raise ValueError("Null rotation axis")
+    x, y, z = (axes / norms[:, np.newaxis]).T
+
+    c = np.cos(angles)
+    s = np.sin(angles)
+    t = 1.0 - c
+
+    matrices = np.zeros((len(angles), 4, 4))
+    matrices[:, 0, 0] = t * x * x + c
+    matrices[:, 0, 1] = t * x * y - s * z
+    matrices[:, 0, 2] = t * x * z + s * y
+    matrices[:, 1, 0] = t * x * y + s * z
+    matrices[:, 1, 1] = t * y * y + c
+    matrices[:, 1, 2] = t * y * z - s * x
+    matrices[:, 2, 0] = t * x * z - s * y
+    matrices[:, 2, 1] = t * y * z + s * x
+    matrices[:, 2, 2] = t * z * z + c
+    matrices[:, 3, 3] = 1.0
+
+    return matrices
+
+
+def getRotationMatrix(angle, x, y, z):
+    return getRotationMatrices([angle], [x, y, z])[0]
+
+
+def getTranslationMatrix(x, y, z):
+    matrix = np.identity(4)
+    matrix[:3, 3] = [x, y, z]
+    return matrix
+
+
+def getScalingMatrix(x, y, z):
+    return np.diag([x, y, z, 1.0])
+
+
+def getTransformMatrix(transform, values):
+    if transform == "Rotation":
+        return getRotationMatrix(*values)
+    elif transform == "Translation":
+        return getTranslationMatrix(*values)
+    elif transform == "Scaling":
+        return getScalingMatrix(*values)
+    raise ValueError("Invalid transformation: " + str(transform))
+
+
+def composeTransformChains(chains):
+    """Compose transformation chains into one matrix per chain.
+
+    chains is a list of lists of (transform, values), e.g.
+    [("Rotation", [angle, x, y, z]), ("Translation", [x, y, z]), ("Scaling", [x, y, z])],
+    with translations in the unit of the scene. Return an array of shape (n, 4, 4).
+    The chains are padded with identity matrices so that the products are
+    computed for all the chains at once.
+    """
+
+    number_of_chains = len(chains)
+    max_length = max([len(chain) for chain in chains], default=0)
+
+    steps = np.tile(np.identity(4), (number_of_chains, max_length, 1, 1))
+    for i, chain in enumerate(chains):
+        for j, (transform, values) in enumerate(chain):
+            steps[i, j] = getTransformMatrix(transform, values)
+
+    matrices = np.tile(np.identity(4), (number_of_chains, 1, 1))
+    for j in range(max_length):
+        matrices = np.matmul(matrices, steps[:, j])
+
+    return matrices
+
+
+def toColumnMajorList(matrix):
+    """Flatten a 4x4 matrix in the order expected by gVirtualXRay."""
+    return np.asarray(matrix, dtype=np.float64).T.ravel().tolist()